@@ -0,0 +1,278 @@
+import os
+import csv
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import threading
+import psutil
+from selenium.webdriver.common.by import By
+from maps_fixture_server import start_server
+
+# Offline scraper benchmark against the local Maps fixture (maps_fixture_server.py): single-driver
+# throughput and per-field latency of scrape_store_data / scrape_reviews, plus every parallel_scrape
+# mode across process counts (tab counts for the cdp mode). Scraper modules are imported per mode, after the environment is set.
+
+PARALLEL_MODES = {
+    "detail": "parallel_detail_scraper",
+    "review": "parallel_review_scraper",
+    "place": "parallel_place_scraper",
+    "cdp": "cdp_engine",
+    "coordinator": "coordinator",
+}
+
+# Samples peak RSS (MB) per worker process, each worker counted with its chromedriver and Chrome children
+class MemorySampler:
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.peaks = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    @staticmethod
+    def tree_rss_mb(proc):
+        total = 0
+        for p in [proc] + proc.children(recursive=True):
+            try:
+                total += p.memory_info().rss
+            except psutil.Error:
+                pass
+        return total / (1024 * 1024)
+
+    def _run(self):
+        parent = psutil.Process()
+        while not self._stop.wait(self.interval):
+            for child in parent.children():
+                try:
+                    rss = self.tree_rss_mb(child)
+                except psutil.Error:
+                    continue
+                self.peaks[child.pid] = max(self.peaks.get(child.pid, 0), rss)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return self.peaks
+
+# Median and 95th percentile of a list of seconds, in milliseconds
+def summarize(samples):
+    if not samples:
+        return {"median_ms": None, "p95_ms": None, "n": 0}
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return {"median_ms": round(statistics.median(ordered) * 1000, 1), "p95_ms": round(p95 * 1000, 1), "n": len(ordered)}
+
+def rate_per_minute(count, seconds):
+    return round(count / seconds * 60, 1) if seconds else 0.0
+
+# scrape_store_data on one browser; use_js toggles the single-script extraction, fields limits it
+# to a partial refresh
+def bench_store_data(place_ids, use_js, fields=None):
+    from multi_element_scraper import init_driver, scrape_store_data
+    from pacing import place_url
+    from driver_pool import driver_rss_mb, quit_driver
+
+    driver = init_driver()
+    durations = []
+    succeeded = 0
+    peak_mb = 0
+    start = time.perf_counter()
+    try:
+        for place_id in place_ids:
+            t = time.perf_counter()
+            data = scrape_store_data(driver, place_url(place_id), place_id, use_js=use_js, fields=fields)
+            durations.append(time.perf_counter() - t)
+            succeeded += bool(data["店名"])
+            peak_mb = max(peak_mb, driver_rss_mb(driver))
+    finally:
+        quit_driver(driver)
+    wall = time.perf_counter() - start
+    return {"places": len(place_ids), "succeeded": succeeded, "wall_s": round(wall, 2),
+            "places_per_minute": rate_per_minute(succeeded, wall), "per_place": summarize(durations),
+            "browser_peak_mb": round(peak_mb, 1)}
+
+# Time every field lookup of the element-by-element path, and the one-call script path, on loaded pages
+def bench_fields(place_ids):
+    from multi_element_scraper import (init_driver, extract_store_data_js, extract_checked_items_with_log,
+                                       XPATHS, SECTIONS)
+    from pacing import open_page, place_url, wait_for_present, wait_for_any
+    from driver_pool import quit_driver
+
+    timings = {}
+
+    def timed(field, fn):
+        t = time.perf_counter()
+        try:
+            fn()
+        except Exception:
+            pass
+        timings.setdefault(field, []).append(time.perf_counter() - t)
+
+    def click(xpath):
+        driver.execute_script("arguments[0].click();", driver.find_element(By.XPATH, xpath))
+
+    driver = init_driver()
+    try:
+        for place_id in place_ids:
+            if not open_page(driver, place_url(place_id), XPATHS["name"]):
+                continue
+            for field in ("name", "rating", "type", "address", "avg_cost"):
+                timed(field, lambda: driver.find_element(By.XPATH, XPATHS[field]).text)
+            timed("phone", lambda: driver.find_element(By.XPATH, XPATHS["phone"]).get_attribute("aria-label"))
+            timed("hours", lambda: (click(XPATHS["hours_button"]),
+                                    wait_for_present(driver, XPATHS["hours"], 5).get_attribute("aria-label")))
+            timed("intro", lambda: (click(XPATHS["intro_button"]),
+                                    wait_for_any(driver, [XPATHS["intro"], XPATHS["section_list"]]),
+                                    driver.find_element(By.XPATH, XPATHS["intro"]).text))
+            for label in SECTIONS:
+                timed(label, lambda: extract_checked_items_with_log(driver, label))
+
+            if open_page(driver, place_url(place_id), XPATHS["name"]):
+                timed("all_fields_js", lambda: extract_store_data_js(driver, place_id))
+    finally:
+        quit_driver(driver)
+    return {field: summarize(samples) for field, samples in timings.items()}
+
+# scrape_reviews on one browser, writing into a temporary folder
+def bench_reviews(place_ids, streaming):
+    from comment_scraper import init_driver, scrape_reviews
+    from driver_pool import driver_rss_mb, quit_driver
+
+    folder = tempfile.mkdtemp(prefix="bench_reviews_")
+    driver = init_driver()
+    durations = []
+    succeeded = 0
+    peak_mb = 0
+    start = time.perf_counter()
+    try:
+        for place_id in place_ids:
+            t = time.perf_counter()
+            succeeded += bool(scrape_reviews(driver, place_id, folder, streaming=streaming))
+            durations.append(time.perf_counter() - t)
+            peak_mb = max(peak_mb, driver_rss_mb(driver))
+    finally:
+        quit_driver(driver)
+    wall = time.perf_counter() - start
+
+    reviews = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder, name)
+        with open(path, "r", encoding="utf-8") as f:
+            reviews += sum(1 for line in f if line.strip()) if name.endswith(".jsonl") else len(json.load(f))
+    return {"places": len(place_ids), "succeeded": succeeded, "reviews": reviews, "wall_s": round(wall, 2),
+            "places_per_minute": rate_per_minute(succeeded, wall),
+            "reviews_per_second": round(reviews / wall, 1) if wall else 0.0,
+            "per_place": summarize(durations), "browser_peak_mb": round(peak_mb, 1)}
+
+# One parallel_scrape run in a scratch directory, so outputs and crawl state start empty
+def bench_parallel(mode, place_ids, num_processes, pages_per_minute, review_counts):
+    import importlib
+    from crawl_state import CrawlState
+
+    module = importlib.import_module(PARALLEL_MODES[mode])
+    workdir = tempfile.mkdtemp(prefix=f"bench_{mode}_")
+    input_file = os.path.join(workdir, "places.csv")
+    with open(input_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Place ID", "評論數"])
+        for place_id in place_ids:
+            writer.writerow([place_id, review_counts.get(place_id, 0)])
+
+    kwargs = {"pages_per_minute": pages_per_minute}
+    if mode == "detail":
+        kwargs["use_js"] = True
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    sampler = MemorySampler()
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        module.parallel_scrape(input_file, num_processes, True, **kwargs)
+    finally:
+        wall = time.perf_counter() - start
+        peaks = sampler.stop()
+        os.chdir(cwd)
+
+    state = CrawlState(os.path.join(workdir, "crawl_state.sqlite"))
+    kinds = {"detail": ["餐廳詳細資訊"], "review": ["餐廳評論爬蟲"]}.get(mode, ["餐廳詳細資訊", "餐廳評論爬蟲"])
+    done = min(state.summary(kind).get("done", 0) for kind in kinds)
+    state.close()
+    worker_peaks = sorted(peaks.values())
+    return {"processes": num_processes, "places": len(place_ids), "succeeded": done, "wall_s": round(wall, 2),
+            "places_per_minute": rate_per_minute(done, wall),
+            "worker_peak_mb_max": round(max(worker_peaks), 1) if worker_peaks else None,
+            "worker_peak_mb_mean": round(statistics.mean(worker_peaks), 1) if worker_peaks else None}
+
+def print_table(title, rows, columns):
+    print(f"\n== {title} ==")
+    print(" | ".join(f"{column:>20}" for column in columns))
+    for row in rows:
+        print(" | ".join(f"{str(row.get(column, '')):>20}" for column in columns))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline scraper benchmark against the local Maps fixture")
+    parser.add_argument("--places", type=int, default=20, help="Places per run")
+    parser.add_argument("--processes", default="1,2,4",
+                        help="Process counts for the parallel modes, tab counts for cdp (e.g. 10,30)")
+    parser.add_argument("--modes", default="store_data,fields,reviews,detail,review,place",
+                        help="Comma-separated: store_data, fields, reviews, detail, review, place, cdp, coordinator")
+    parser.add_argument("--min-reviews", type=int, default=20)
+    parser.add_argument("--max-reviews", type=int, default=100)
+    parser.add_argument("--page-latency", type=float, default=0.3)
+    parser.add_argument("--review-latency", type=float, default=0.15)
+    parser.add_argument("--pages-per-minute", type=float, default=600,
+                        help="Rate limit per worker; high by default so the scraper itself is measured")
+    parser.add_argument("--fields", default="評分,開始營業時間",
+                        help="Fields of the partial-refresh store_data runs; empty to skip them")
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+
+    server, url = start_server(review_count=(args.min_reviews, args.max_reviews),
+                               page_latency=args.page_latency, review_latency=args.review_latency)
+    os.environ["SCRAPER_PLACE_URL"] = url
+    os.environ["SCRAPER_PAGES_PER_MINUTE"] = str(args.pages_per_minute)
+    print(f"Maps fixture: {url}")
+
+    modes = args.modes.split(",")
+    place_ids = [f"BENCH{i:06d}" for i in range(args.places)]
+    review_counts = {place_id: len(server.fixture.get_place(place_id)["reviews"]) for place_id in place_ids}
+    results = {"config": vars(args), "single": {}, "fields": None, "parallel": {}}
+
+    if "store_data" in modes:
+        for use_js in (False, True):
+            name = "scrape_store_data (js)" if use_js else "scrape_store_data (elements)"
+            results["single"][name] = bench_store_data(place_ids, use_js)
+            if args.fields:
+                results["single"][f"{name[:-1]}, {args.fields})"] = bench_store_data(place_ids, use_js, args.fields)
+    if "fields" in modes:
+        results["fields"] = bench_fields(place_ids[:min(len(place_ids), 10)])
+    if "reviews" in modes:
+        for streaming in (False, True):
+            name = "scrape_reviews (jsonl)" if streaming else "scrape_reviews (json)"
+            results["single"][name] = bench_reviews(place_ids, streaming)
+    for mode in PARALLEL_MODES:
+        if mode in modes:
+            results["parallel"][mode] = [
+                bench_parallel(mode, place_ids, int(n), args.pages_per_minute, review_counts)
+                for n in args.processes.split(",")]
+
+    server.shutdown()
+
+    if results["single"]:
+        print_table("Single browser", [{"run": name, **r} for name, r in results["single"].items()],
+                    ["run", "succeeded", "wall_s", "places_per_minute", "browser_peak_mb"])
+    if results["fields"]:
+        print_table("Per-field extraction latency", [{"field": f, **s} for f, s in results["fields"].items()],
+                    ["field", "median_ms", "p95_ms", "n"])
+    for mode, rows in results["parallel"].items():
+        print_table(f"parallel_scrape ({mode})", rows,
+                    ["processes", "succeeded", "wall_s", "places_per_minute", "worker_peak_mb_max"])
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, ensure_ascii=False, indent=4)
+    print(f"\nResults saved to {args.output}")
@@ -0,0 +1,540 @@
+import os
+import json
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from multi_element_scraper import EXTRACT_STORE_DATA_JS, XPATHS, extract_args, resolve_fields, store_data_from_raw
+from comment_scraper import (COLLECT_REVIEWS_JS, REVIEWS_BUTTON_XPATH, SCROLLABLE_XPATH, REVIEW_CARD_XPATH,
+                             write_reviews)
+from parallel_place_scraper import plan_jobs, record_results, retry_source
+from metrics import get_metrics, setup_logging, reset_snapshots, export_metrics
+from pacing import (BLOCK_URL_PATTERNS, BLOCK_TEXT_PATTERNS, GONE_TEXT_PATTERNS, PAGE_FAILURES, configure_rate_limiter,
+                    place_url)
+from resource_policy import default_policy, get_policy
+from crawl_state import CrawlState
+from failures import CircuitBreaker
+from process_guard import start_run, kill_tree, kill_run_processes
+from output_sink import default_sink, open_sink
+
+logger = logging.getLogger(__name__)
+
+# Asyncio engine that drives one headless Chromium over the DevTools protocol: every place gets its
+# own browser context (isolated cookies and storage) and tab, and num_tabs places are in flight at
+# once in a single process. Extraction reuses EXTRACT_STORE_DATA_JS and COLLECT_REVIEWS_JS, and output
+# goes through the same sinks, review files and crawl state as parallel_place_scraper.
+
+CHROME_BINARIES = ["google-chrome", "google-chrome-stable", "chromium", "chromium-browser", "chrome"]
+
+COUNT_JS = """
+return document.evaluate(arguments[0], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null).snapshotLength;
+"""
+
+CLICK_JS = """
+var el = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+if (el) el.click();
+return !!el;
+"""
+
+SCROLL_JS = """
+var el = document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+if (el) el.scrollTop = el.scrollHeight;
+return !!el;
+"""
+
+PAGE_TEXT_JS = """
+return {url: location.href, text: document.body ? document.body.innerText.slice(0, 2000) : ''};
+"""
+
+class CDPError(Exception):
+    pass
+
+# Chrome binary from SCRAPER_CHROME_BINARY, or the first one found on PATH
+def find_chrome():
+    binary = os.environ.get("SCRAPER_CHROME_BINARY")
+    if binary:
+        return binary
+    for name in CHROME_BINARIES:
+        path = shutil.which(name)
+        if path:
+            return path
+    raise FileNotFoundError("Chrome not found, set SCRAPER_CHROME_BINARY to its path")
+
+# One DevTools websocket shared by every tab; commands for a tab carry its flattened session id
+class CDPConnection:
+    def __init__(self, ws):
+        self.ws = ws
+        self.ids = itertools.count(1)
+        self.pending = {}
+        self.reader = asyncio.ensure_future(self._read())
+
+    @classmethod
+    async def connect(cls, url):
+        try:
+            import websockets
+        except ImportError:
+            raise ImportError("The CDP engine requires websockets: pip install websockets")
+        ws = await websockets.connect(url, max_size=None, ping_interval=None)
+        return cls(ws)
+
+    @property
+    def closed(self):
+        return self.reader.done()
+
+    # Resolve command futures by id; events are not subscribed to, page state is polled instead
+    async def _read(self):
+        error = CDPError("DevTools connection closed")
+        try:
+            async for message in self.ws:
+                data = json.loads(message)
+                future = self.pending.pop(data.get("id"), None)
+                if future is None or future.done():
+                    continue
+                if "error" in data:
+                    future.set_exception(CDPError(data["error"].get("message", str(data["error"]))))
+                else:
+                    future.set_result(data.get("result", {}))
+        except Exception as e:
+            error = CDPError(f"DevTools connection lost: {e}")
+        finally:
+            for future in self.pending.values():
+                if not future.done():
+                    future.set_exception(error)
+            self.pending.clear()
+
+    async def send(self, method, params=None, session_id=None, timeout=30):
+        if self.closed:
+            raise CDPError("DevTools connection closed")
+        message_id = next(self.ids)
+        message = {"id": message_id, "method": method, "params": params or {}}
+        if session_id:
+            message["sessionId"] = session_id
+        future = asyncio.get_running_loop().create_future()
+        self.pending[message_id] = future
+        try:
+            await self.ws.send(json.dumps(message))
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self.pending.pop(message_id, None)
+
+    async def close(self):
+        await self.ws.close()
+        try:
+            await self.reader
+        except Exception:
+            pass
+
+# Headless Chromium started with a DevTools port chosen by the browser itself
+class Browser:
+    def __init__(self, process, user_data_dir, conn):
+        self.process = process
+        self.user_data_dir = user_data_dir
+        self.conn = conn
+        self.visits = 0
+        self.active = 0
+        self.closing = False
+
+    @classmethod
+    async def launch(cls, policy=None, binary=None, timeout=30):
+        policy = get_policy(policy)
+        user_data_dir = tempfile.mkdtemp(prefix="cdp_chrome_")
+        args = [binary or find_chrome(), "--headless=new", "--remote-debugging-port=0",
+                f"--user-data-dir={user_data_dir}", "--no-first-run", "--no-default-browser-check",
+                "--disable-gpu", "--disable-dev-shm-usage", "--disable-background-networking",
+                "--disable-blink-features=AutomationControlled", "--window-size=1920,1080"]
+        if policy and policy.get("block_images"):
+            args.append("--blink-settings=imagesEnabled=false")
+        if policy and policy.get("disable_webgl"):
+            args += ["--disable-webgl", "--disable-3d-apis"]
+        args.append("about:blank")
+        process = await asyncio.create_subprocess_exec(*args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+        # Chrome writes the port and browser websocket path once DevTools is listening
+        port_file = os.path.join(user_data_dir, "DevToolsActivePort")
+        deadline = time.monotonic() + timeout
+        while True:
+            if os.path.exists(port_file):
+                with open(port_file, "r", encoding="utf-8") as f:
+                    lines = f.read().split()
+                if len(lines) >= 2:
+                    break
+            if process.returncode is not None or time.monotonic() > deadline:
+                if process.returncode is None:
+                    process.kill()
+                shutil.rmtree(user_data_dir, ignore_errors=True)
+                raise CDPError("Chrome did not start its DevTools endpoint")
+            await asyncio.sleep(0.1)
+
+        conn = await CDPConnection.connect(f"ws://127.0.0.1:{lines[0]}{lines[1]}")
+        logger.info(f"Chrome started (pid {process.pid}, DevTools port {lines[0]})")
+        return cls(process, user_data_dir, conn)
+
+    @property
+    def alive(self):
+        return self.process.returncode is None and not self.conn.closed
+
+    async def close(self):
+        if self.closing:
+            return
+        self.closing = True
+        try:
+            await self.conn.send("Browser.close", timeout=5)
+        except Exception:
+            pass
+        await self.conn.close()
+        try:
+            await asyncio.wait_for(self.process.wait(), 10)
+        except asyncio.TimeoutError:
+            # Kill the renderers and helpers along with the browser process
+            await asyncio.get_running_loop().run_in_executor(None, kill_tree, self.process.pid)
+            await self.process.wait()
+        shutil.rmtree(self.user_data_dir, ignore_errors=True)
+
+# A tab in its own browser context; closing it disposes the context and everything in it
+class Tab:
+    def __init__(self, conn, context_id, session_id):
+        self.conn = conn
+        self.context_id = context_id
+        self.session_id = session_id
+
+    @classmethod
+    async def open(cls, conn, blocked_urls=None):
+        context = await conn.send("Target.createBrowserContext", {"disposeOnDetach": True})
+        context_id = context["browserContextId"]
+        try:
+            target = await conn.send("Target.createTarget", {"url": "about:blank", "browserContextId": context_id})
+            session = await conn.send("Target.attachToTarget", {"targetId": target["targetId"], "flatten": True})
+            tab = cls(conn, context_id, session["sessionId"])
+            if blocked_urls:
+                await tab.send("Network.enable")
+                await tab.send("Network.setBlockedURLs", {"urls": blocked_urls})
+        except Exception:
+            await conn.send("Target.disposeBrowserContext", {"browserContextId": context_id})
+            raise
+        return tab
+
+    def send(self, method, params=None, timeout=30):
+        return self.conn.send(method, params, self.session_id, timeout)
+
+    # Run a Selenium-style script (arguments[i], top-level return) in the page and return its value;
+    # with async_callback the script gets a done callback as its last argument, like execute_async_script
+    async def call(self, script, *args, async_callback=False, timeout=30):
+        args_json = json.dumps(list(args), ensure_ascii=False)
+        if async_callback:
+            expression = (f"new Promise(function (resolve) {{ (function () {{\n{script}\n}})"
+                          f".apply(null, {args_json}.concat([resolve])); }})")
+        else:
+            expression = f"(function () {{\n{script}\n}}).apply(null, {args_json})"
+        result = await self.send("Runtime.evaluate", {"expression": expression, "returnByValue": True,
+                                                      "awaitPromise": async_callback}, timeout=timeout)
+        if "exceptionDetails" in result:
+            details = result["exceptionDetails"]
+            raise CDPError(details.get("exception", {}).get("description") or details.get("text"))
+        return result["result"].get("value")
+
+    async def navigate(self, url):
+        result = await self.send("Page.navigate", {"url": url})
+        if result.get("errorText"):
+            raise CDPError(f"Navigation failed: {result['errorText']}")
+
+    async def count(self, xpath):
+        return await self.call(COUNT_JS, xpath)
+
+    async def wait_for_xpath(self, xpath, timeout=20, poll=0.2):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                if await self.count(xpath):
+                    return True
+            except CDPError:
+                pass  # Execution context replaced while the page is still loading
+            await asyncio.sleep(poll)
+        return False
+
+    # Wait until more than previous_count elements match; returns the count, unchanged on timeout
+    async def wait_for_count_growth(self, xpath, previous_count, timeout=8, poll=0.2):
+        deadline = time.monotonic() + timeout
+        count = await self.count(xpath)
+        while count <= previous_count and time.monotonic() < deadline:
+            await asyncio.sleep(poll)
+            count = await self.count(xpath)
+        return count
+
+    # Why a page did not become ready: blocked, gone (Maps can't find the place) or not_ready
+    async def failure_outcome(self):
+        try:
+            page = await self.call(PAGE_TEXT_JS)
+        except CDPError:
+            return "not_ready"
+        if (any(pattern in page["url"] for pattern in BLOCK_URL_PATTERNS)
+                or any(pattern in page["text"] for pattern in BLOCK_TEXT_PATTERNS)):
+            return "blocked"
+        if any(pattern in page["text"] for pattern in GONE_TEXT_PATTERNS):
+            return "gone"
+        return "not_ready"
+
+    async def close(self):
+        try:
+            await self.conn.send("Target.disposeBrowserContext", {"browserContextId": self.context_id}, timeout=10)
+        except (CDPError, asyncio.TimeoutError) as e:
+            logger.debug(f"Failed to dispose browser context {self.context_id}: {e!r}")
+
+# Run a blocking rate limiter call on a thread, so waiting tabs do not stall the event loop
+async def acquire(limiter, cost=1.0):
+    await asyncio.get_running_loop().run_in_executor(None, limiter.acquire, cost)
+
+# Navigate under the rate limit and wait until the page is ready, the CDP version of pacing.open_page;
+# returns the page outcome: ready, blocked, gone or not_ready
+async def open_place(tab, limiter, url, timeout=30):
+    metrics = get_metrics()
+    with metrics.timer("rate_limit_wait"):
+        await acquire(limiter)
+    with metrics.timer("navigation"):
+        await tab.navigate(url)
+    with metrics.timer("wait_ready"):
+        ready = await tab.wait_for_xpath(XPATHS["name"], timeout)
+    if not ready:
+        outcome = await tab.failure_outcome()
+        if outcome == "blocked":
+            limiter.report_block()
+        metrics.inc("scraper_pages_total", result=outcome)
+        logger.warning(f"Page not ready after {timeout} seconds ({outcome}): {url}")
+        return outcome
+    limiter.report_success()
+    metrics.inc("scraper_pages_total", result="ready")
+    return "ready"
+
+# Click the reviews tab, scroll until the list stops growing and write {place_id}.json
+async def collect_reviews(tab, limiter, place_id, review_folder, scroll_timeout=8):
+    metrics = get_metrics()
+    with metrics.timer("reviews_click"):
+        if not await tab.call(CLICK_JS, REVIEWS_BUTTON_XPATH):
+            raise CDPError("Reviews button not found")
+        await tab.wait_for_count_growth(REVIEW_CARD_XPATH, 0, scroll_timeout)
+
+    reviews = []
+    cursor = 0
+    while True:
+        batch = await tab.call(COLLECT_REVIEWS_JS, cursor)
+        cursor = batch["next"]
+        reviews.extend({"內容": review["text"], "日期": review["date"]}
+                       for review in batch["reviews"] if review["text"])
+
+        with metrics.timer("rate_limit_wait"):
+            await acquire(limiter, 0.2)
+        with metrics.timer("review_scroll"):
+            await tab.call(SCROLL_JS, SCROLLABLE_XPATH)
+            count = await tab.wait_for_count_growth(REVIEW_CARD_XPATH, cursor, scroll_timeout)
+        if count == cursor:
+            # Give in-flight requests a chance to land before concluding the list ended
+            with metrics.timer("review_scroll_end"):
+                count = await tab.wait_for_count_growth(REVIEW_CARD_XPATH, cursor, 1.5)
+            if count == cursor:
+                break
+
+    file_path = os.path.join(review_folder, f"{place_id}.json")
+    with metrics.timer("save", sink="reviews_json"):
+        await asyncio.get_running_loop().run_in_executor(None, write_reviews, file_path, reviews)
+    metrics.inc("scraper_reviews_total", value=len(reviews))
+    logger.info(f"Reviews saved to {file_path}")
+    return True
+
+# One place in a fresh context: details and reviews from a single page load. Returns the results of
+# scrape_place and the error class of a page that did not load, for record_results
+async def scrape_place_cdp(conn, limiter, place_id, parts, review_folder, blocked_urls=None, scroll_timeout=8):
+    tab = await Tab.open(conn, blocked_urls)
+    try:
+        outcome = await open_place(tab, limiter, place_url(place_id))
+        if outcome != "ready":
+            return {part: None for part in parts}, PAGE_FAILURES[outcome]
+
+        results = {}
+        if "details" in parts:
+            with get_metrics().timer("extract_js"):
+                raw = await tab.call(EXTRACT_STORE_DATA_JS, XPATHS, *extract_args(resolve_fields()), async_callback=True,
+                                     timeout=60)
+            results["details"] = store_data_from_raw(place_id, json.loads(raw))
+        if "reviews" in parts:
+            try:
+                results["reviews"] = await collect_reviews(tab, limiter, place_id, review_folder, scroll_timeout)
+            except CDPError as e:
+                logger.warning(f"Scraping failed: {place_id}, Error: {e}")
+                results["reviews"] = False
+        return results, "PageNotReady"
+    finally:
+        await tab.close()
+
+class CDPEngine:
+    def __init__(self, detail_folder, review_folder, state_file, num_tabs=30, pages_per_minute=60,
+                 sink_name="json", policy=None, place_timeout=300, recycle_after=1000, retry_source=None):
+        self.detail_folder = detail_folder
+        self.review_folder = review_folder
+        self.state_file = state_file
+        self.num_tabs = num_tabs
+        self.limiter = configure_rate_limiter(per_minute=pages_per_minute, burst=max(1, num_tabs // 10))
+        self.sink_name = sink_name
+        self.policy = get_policy(policy if policy is not None else default_policy())
+        self.blocked_urls = self.policy.get("blocked_urls", []) if self.policy else []
+        self.place_timeout = place_timeout
+        self.recycle_after = recycle_after
+        self.retry_source = retry_source
+        self.browser = None
+        self.browser_lock = None
+        self.visits = 0
+        self.parts_done = 0
+        self.in_flight = 0
+        self.io = None
+
+    # Run a blocking crawl-state or sink call on the engine's I/O thread, which owns their SQLite
+    # connections, so the tabs keep running while it waits on disk or a database lock
+    async def blocking(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.io, fn, *args)
+
+    # Running browser, relaunched when it crashed or has served recycle_after places
+    async def get_browser(self):
+        async with self.browser_lock:
+            browser = self.browser
+            if browser is not None and browser.alive and browser.visits < self.recycle_after:
+                return browser
+            if browser is not None:
+                logger.info("Restarting Chrome" if browser.alive else "Chrome exited, starting a new one")
+                get_metrics().inc("scraper_browser_recycled_total")
+                # A recycled browser is closed by the last tab still using it
+                if not browser.alive or not browser.active:
+                    await browser.close()
+            self.browser = await Browser.launch(self.policy)
+            return self.browser
+
+    async def run_tab(self, queue, state, sink):
+        breaker = CircuitBreaker(state)
+        while True:
+            job = await queue.get()
+            if job is None:
+                return
+            self.in_flight += 1
+            try:
+                remaining = await self.blocking(breaker.pause_remaining)
+                if remaining > 0:
+                    logger.info(f"Circuit breaker open, waiting {remaining:.0f} seconds")
+                    await asyncio.sleep(remaining)
+                await self.scrape_job(job, state, sink)
+            finally:
+                self.in_flight -= 1
+
+    # Scrape one place on the current browser and record its parts
+    async def scrape_job(self, job, state, sink):
+        metrics = get_metrics()
+        place_id = job['place_id']
+        parts = job['parts']
+        logger.info(f"Tab starts scraping Place ID: {place_id} ({', '.join(parts)})")
+        start = time.perf_counter()
+        browser = None
+        try:
+            browser = await self.get_browser()
+            browser.visits += 1
+            browser.active += 1
+            results, page_error = await asyncio.wait_for(
+                scrape_place_cdp(browser.conn, self.limiter, place_id, parts, self.review_folder,
+                                 self.blocked_urls), self.place_timeout)
+            self.visits += 1
+        except Exception as e:
+            logger.warning(f"Failed to scrape Place ID {place_id}, Error: {e}")
+            for part in parts:
+                kind = self.detail_folder if part == "details" else self.review_folder
+                await self.blocking(state.mark_failure, kind, place_id, type(e).__name__, str(e))
+            return
+        finally:
+            if browser is not None:
+                browser.active -= 1
+                if browser is not self.browser and not browser.active:
+                    await browser.close()
+            metrics.observe("scraper_job_seconds", time.perf_counter() - start)
+            metrics.maybe_dump()
+
+        self.parts_done += await self.blocking(record_results, state, sink, self.detail_folder, self.review_folder,
+                                               place_id, results, page_error)
+
+    # Crawl state and detail sink, opened on the I/O thread that uses them
+    def open_outputs(self):
+        state = CrawlState(self.state_file)
+
+        # Details are marked done only once the sink has written their batch
+        def mark_written(place_ids):
+            for place_id in place_ids:
+                state.mark_success(self.detail_folder, place_id)
+
+        return state, open_sink(self.sink_name, self.detail_folder, on_flush=mark_written)
+
+    async def run(self, jobs):
+        self.browser_lock = asyncio.Lock()
+        self.io = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cdp-io")
+        state, sink = await self.blocking(self.open_outputs)
+        queue = asyncio.Queue(maxsize=self.num_tabs * 2)
+
+        # Planned jobs first, then retries as they come due until none are scheduled and no tab is busy
+        async def feed():
+            for job in jobs:
+                await queue.put(job)
+            while self.retry_source is not None:
+                due, retry_at = await self.blocking(self.retry_source)
+                for job in due:
+                    await queue.put(job)
+                if not due and retry_at is None and queue.empty() and not self.in_flight:
+                    break
+                await asyncio.sleep(5)
+            for _ in range(self.num_tabs):
+                await queue.put(None)
+
+        try:
+            await asyncio.gather(feed(), *(self.run_tab(queue, state, sink) for _ in range(self.num_tabs)))
+        finally:
+            await self.blocking(sink.close)
+            await self.blocking(state.close)
+            self.io.shutdown()
+            if self.browser is not None:
+                await self.browser.close()
+            logger.info(f"CDP engine finished {self.parts_done} parts in {self.visits} page visits")
+            get_metrics().dump()
+
+# Main control function: like parallel_place_scraper.parallel_scrape, with num_tabs concurrent tabs
+# in one browser instead of one browser per process
+def parallel_scrape(input_file, num_tabs=30, is_restaurant=True, cost_column="評論數", pages_per_minute=60,
+                    state_file="crawl_state.sqlite", sink_name=None, policy=None):
+    sink_name = sink_name or default_sink()
+    detail_folder, review_folder, jobs = plan_jobs(input_file, is_restaurant, cost_column, state_file)
+
+    start_run()  # Chrome inherits the run ID, so browsers left by a crash are cleaned up next time
+    reset_snapshots()
+    engine = CDPEngine(detail_folder, review_folder, state_file, num_tabs, pages_per_minute, sink_name, policy,
+                       retry_source=retry_source(detail_folder, review_folder, state_file))
+    try:
+        asyncio.run(engine.run(jobs))
+    finally:
+        kill_run_processes()
+    export_metrics()
+
+    logger.info("All scraping tabs completed!")
+
+if __name__ == "__main__":
+    setup_logging()
+
+    # Get script directory path
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    # Configure input file and tab count
+    input_file = os.path.join(script_dir, "完整_台北_新北_地點清單")  # .csv / .parquet / .jsonl / .xlsx
+    num_tabs = 30
+    is_restaurant = True  # Set to False for attractions
+    pages_per_minute = 60  # Shared by all tabs
+    sink_name = "json"  # "json" (one file per place), "jsonl" (sharded), "sqlite" or "parquet"
+
+    logger.info("Starting CDP scraping (details and reviews in one visit)")
+    logger.info(f"Input file: {input_file}")
+    logger.info(f"Number of tabs: {num_tabs}")
+    logger.info(f"Data type: {'Restaurant' if is_restaurant else 'Attraction'}")
+
+    parallel_scrape(input_file, num_tabs, is_restaurant, pages_per_minute=pages_per_minute, sink_name=sink_name)
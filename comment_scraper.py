@@ -1,24 +1,32 @@
 import os
 import json
-import random
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-import time
-import pandas as pd
-import psutil
 import re
+import logging
+from resource_policy import default_policy, apply_to_options, apply_to_driver
+from place_source import iter_place_ids, resolve_input_file
+from crawl_state import CrawlState, migrate_output_folder
+from pacing import (open_page, page_failure, place_url, get_rate_limiter, wait_for_count_growth, wait_for_network_idle,
+                    wait_for_any)
+from metrics import get_metrics, setup_logging, export_metrics
+from process_guard import ensure_run_id, apply_timeouts, kill_stale_runs
+from job_queue import heartbeat
+from review_store import review_fingerprint, read_review_file
 
-# Clean up residual Chrome and Chromedriver processes
+logger = logging.getLogger(__name__)
+
+# Clean up Chrome and Chromedriver processes left by scraper runs that are no longer alive;
+# browsers of other running scrapers on the machine are left alone
 def kill_chrome_processes():
-    for proc in psutil.process_iter(['name']):
-        if proc.info['name'] in ['chrome', 'chromedriver']:
-            proc.kill()
-    print("Cleaned up residual Chrome and Chromedriver processes")
+    kill_stale_runs()
 
 # Initialize Selenium WebDriver
-def init_driver():
+def init_driver(resource_policy=None, performance_log=False):
+    resource_policy = resource_policy or default_policy()
+    ensure_run_id()  # Inherited by chromedriver and Chrome, so the run can find its own processes
     options = webdriver.ChromeOptions()
     options.add_argument("--headless")
     options.add_argument("--disable-gpu")
@@ -27,61 +35,118 @@ def init_driver():
     options.add_argument("--incognito")
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option("useAutomationExtension", False)
-    return webdriver.Chrome(options=options)
-
-# Add random delay to avoid detection
-def random_delay(min_delay=3, max_delay=5):
-    delay = random.uniform(min_delay, max_delay)
-    print(f"Random delay {delay:.2f} seconds")
-    time.sleep(delay)
+    apply_to_options(options, resource_policy, performance_log)
+    driver = webdriver.Chrome(options=options)
+    apply_timeouts(driver)
+    apply_to_driver(driver, resource_policy)
+    return driver
 
 # Wait for element to be present
 def wait_for_element(driver, xpath, timeout=30):
     return WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.XPATH, xpath)))
 
-# Main scraping function
-def scrape_reviews(driver, place_id, folder_name):
-    url = f"https://www.google.com/maps/place/?q=place_id:{place_id}"
-    print(f"Accessing URL: {url}")
+# XPaths of the place name, the reviews tab and its scrollable list
+NAME_XPATH = '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]/div/div[1]/div[1]/h1'
+REVIEWS_BUTTON_XPATH = "//button[.//div[contains(text(), '評論')]]"
+SCROLLABLE_XPATH = '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]'
+REVIEW_CARD_XPATH = "//div[contains(@class, 'jftiEf')]"
+REVIEW_XPATH = "//div[contains(@class, 'jftiEf')]//span[@class='wiI7pd']"
+REVIEW_DATE_XPATH = "//div[contains(@class, 'jftiEf')]//span[@class='rsqaWe']"
+SORT_BUTTON_XPATH = "//button[contains(@aria-label, '排序') or .//span[contains(text(), '排序')]]"
+SORT_NEWEST_XPATH = "//div[@role='menuitemradio'][.//div[contains(text(), '最新')]]"
+
+# Runs inside the page: returns only the review cards appended since the cursor
+COLLECT_REVIEWS_JS = """
+var cards = document.querySelectorAll('div.jftiEf');
+var reviews = [];
+for (var i = arguments[0]; i < cards.length; i++) {
+    var text = cards[i].querySelector('span.wiI7pd');
+    var date = cards[i].querySelector('span.rsqaWe');
+    reviews.push({
+        text: text ? text.innerText.trim() : '',
+        date: date ? date.innerText.trim() : ''
+    });
+}
+return {next: cards.length, reviews: reviews};
+"""
 
+# Open a place page, click the reviews tab and return the scrollable review list
+def open_reviews(driver, place_id, folder_name, scroll_timeout=8, navigate=True):
+    # Navigate under the worker's rate limit and wait for the page to render, unless the caller
+    # already loaded the place page; a blocked or missing page fails right away, and page_failure()
+    # tells the caller which it was
+    if navigate:
+        url = place_url(place_id)
+        logger.debug(f"Accessing URL: {url}")
+        if not open_page(driver, url, NAME_XPATH, timeout=30):
+            raise RuntimeError(f"Place page not ready ({page_failure()})")
+
+    # Get location name
     try:
-        driver.get(url)
-        random_delay(7, 10)
-
-        # Get location name
-        try:
-            location_name_element = wait_for_element(driver, '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]/div/div[1]/div[1]/h1')
-            location_name = location_name_element.text.strip()
-            location_name = re.sub(r'[\\/:*?"<>|]', '_', location_name)
-            print(f"Location name extracted: {location_name}")
-        except Exception as e:
-            print("Failed to get location name, using default name", e)
-            location_name = place_id
-
-        # Create output folder if not exists
-        file_path = os.path.join(folder_name, f"{place_id}.json")
-        if not os.path.exists(folder_name):
-            os.mkdir(folder_name)
+        location_name_element = wait_for_element(driver, NAME_XPATH, timeout=5)
+        location_name = location_name_element.text.strip()
+        location_name = re.sub(r'[\\/:*?"<>|]', '_', location_name)
+        logger.debug(f"Location name extracted: {location_name}")
+    except Exception as e:
+        logger.info(f"Failed to get location name, using default name: {e}")
+        location_name = place_id
+
+    # Create output folder if not exists
+    if not os.path.exists(folder_name):
+        os.mkdir(folder_name)
 
-        # Click reviews button
-        reviews_button = wait_for_element(driver, "//button[.//div[contains(text(), '評論')]]")
+    # Click reviews button and wait for the first reviews to render
+    with get_metrics().timer("reviews_click"):
+        reviews_button = wait_for_element(driver, REVIEWS_BUTTON_XPATH)
         reviews_button.click()
-        random_delay()
+        wait_for_count_growth(driver, REVIEW_CARD_XPATH, 0, timeout=scroll_timeout)
 
-        # Scroll reviews area
-        scrollable_div = wait_for_element(driver, '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]')
-        previous_reviews_count = 0
+    return wait_for_element(driver, SCROLLABLE_XPATH)
 
-        # Keep scrolling until no more reviews
-        while True:
-            driver.execute_script('arguments[0].scrollTop = arguments[0].scrollHeight', scrollable_div)
-            random_delay()
+# Scroll the review list once and return the new count, unchanged when the list has ended
+def scroll_reviews(driver, scrollable_div, xpath, previous_count, scroll_timeout=8):
+    metrics = get_metrics()
+    with metrics.timer("rate_limit_wait"):
+        get_rate_limiter().acquire(cost=0.2)
+    heartbeat()
+
+    with metrics.timer("review_scroll"):
+        driver.execute_script('arguments[0].scrollTop = arguments[0].scrollHeight', scrollable_div)
+        count = wait_for_count_growth(driver, xpath, previous_count, timeout=scroll_timeout)
+
+    if count == previous_count:
+        # Give in-flight requests a chance to land before concluding the list ended
+        with metrics.timer("review_scroll_end"):
+            wait_for_network_idle(driver, timeout=scroll_timeout)
+            count = wait_for_count_growth(driver, xpath, previous_count, timeout=1)
+    return count
+
+# Count reviews already flushed to a partial JSONL file
+def count_flushed_reviews(file_path):
+    if not os.path.exists(file_path):
+        return 0
+    with open(file_path, "r", encoding="utf-8") as f:
+        return sum(1 for line in f if line.strip())
+
+# Main scraping function
+def scrape_reviews(driver, place_id, folder_name, scroll_timeout=8, streaming=False, navigate=True):
+    if streaming:
+        return stream_reviews(driver, place_id, folder_name, scroll_timeout, navigate)
 
-            reviews = driver.find_elements(By.XPATH, "//div[contains(@class, 'jftiEf')]//span[@class='wiI7pd']")
-            review_dates = driver.find_elements(By.XPATH, "//div[contains(@class, 'jftiEf')]//span[@class='rsqaWe']")
-            if len(reviews) == previous_reviews_count:
+    try:
+        scrollable_div = open_reviews(driver, place_id, folder_name, scroll_timeout, navigate)
+        file_path = os.path.join(folder_name, f"{place_id}.json")
+
+        # Keep scrolling until the review count stops growing
+        previous_reviews_count = 0
+        while True:
+            reviews_count = scroll_reviews(driver, scrollable_div, REVIEW_XPATH, previous_reviews_count, scroll_timeout)
+            if reviews_count == previous_reviews_count:
                 break
-            previous_reviews_count = len(reviews)
+            previous_reviews_count = reviews_count
+
+        reviews = driver.find_elements(By.XPATH, REVIEW_XPATH)
+        review_dates = driver.find_elements(By.XPATH, REVIEW_DATE_XPATH)
 
         # Collect reviews and dates
         reviews_dict = {}
@@ -91,49 +156,225 @@ def scrape_reviews(driver, place_id, folder_name):
             reviews_dict[f"評論 {i}"] = {"內容": review_text, "日期": review_date_text}
 
         # Save to JSON file
-        with open(file_path, "w", encoding="utf-8") as f:
+        with get_metrics().timer("save", sink="reviews_json"):
+            with open(file_path, "w", encoding="utf-8") as f:
+                json.dump(reviews_dict, f, ensure_ascii=False, indent=4)
+        get_metrics().inc("scraper_reviews_total", value=len(reviews_dict))
+        logger.info(f"Reviews saved to {file_path}")
+        return True
+
+    except Exception as e:
+        logger.warning(f"Scraping failed: {place_id}, Error: {e}")
+        return False
+
+# Streaming mode: append each scroll batch to {place_id}.jsonl.part as it loads,
+# resuming after the last flushed review and renaming to .jsonl when the list ends
+def stream_reviews(driver, place_id, folder_name, scroll_timeout=8, navigate=True):
+    file_path = os.path.join(folder_name, f"{place_id}.jsonl")
+    part_path = file_path + ".part"
+
+    try:
+        scrollable_div = open_reviews(driver, place_id, folder_name, scroll_timeout, navigate)
+
+        flushed = count_flushed_reviews(part_path)
+        if flushed:
+            logger.info(f"Resuming {place_id} after {flushed} flushed reviews")
+
+        cursor = 0
+        ordinal = 0
+        with open(part_path, "a", encoding="utf-8") as f:
+            while True:
+                # Read only the cards appended since the last batch
+                batch = driver.execute_script(COLLECT_REVIEWS_JS, cursor)
+                cursor = batch["next"]
+
+                written = 0
+                for review in batch["reviews"]:
+                    if not review["text"]:
+                        continue
+                    ordinal += 1
+                    if ordinal <= flushed:
+                        continue
+                    f.write(json.dumps({"序號": ordinal, "內容": review["text"], "日期": review["date"]},
+                                       ensure_ascii=False) + "\n")
+                    written += 1
+                f.flush()
+                if written:
+                    get_metrics().inc("scraper_reviews_total", value=written)
+                    logger.debug(f"Flushed {written} reviews, total {ordinal}")
+
+                if scroll_reviews(driver, scrollable_div, REVIEW_CARD_XPATH, cursor, scroll_timeout) == cursor:
+                    break
+
+        os.replace(part_path, file_path)
+        logger.info(f"Reviews saved to {file_path}")
+        return True
+
+    except Exception as e:
+        logger.warning(f"Scraping failed: {place_id}, Error: {e}")
+        return False
+
+# Load stored reviews of a place as (path, [{"內容", "日期"}, ...]), newest first as saved
+def load_existing_reviews(folder_name, place_id):
+    json_path = os.path.join(folder_name, f"{place_id}.json")
+    jsonl_path = json_path + "l"
+    for path in (jsonl_path, json_path):
+        if os.path.exists(path):
+            return path, read_review_file(path)
+    return json_path, []
+
+# Write reviews back in the format of the given path, renumbering positional keys
+def write_reviews(file_path, reviews):
+    temp_path = file_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        if file_path.endswith(".jsonl"):
+            for i, review in enumerate(reviews, 1):
+                f.write(json.dumps({"序號": i, **review}, ensure_ascii=False) + "\n")
+        else:
+            reviews_dict = {f"評論 {i}": review for i, review in enumerate(reviews, 1)}
             json.dump(reviews_dict, f, ensure_ascii=False, indent=4)
-        print(f"Reviews saved to {file_path}")
+    os.replace(temp_path, file_path)
+
+# Switch the review list to newest first
+def sort_reviews_newest(driver, timeout=8):
+    sort_button = wait_for_element(driver, SORT_BUTTON_XPATH, timeout=timeout)
+    driver.execute_script("arguments[0].click();", sort_button)
+    if not wait_for_any(driver, [SORT_NEWEST_XPATH], timeout=timeout):
+        raise RuntimeError("Newest-first sort option not found")
+    driver.execute_script("arguments[0].click();", driver.find_element(By.XPATH, SORT_NEWEST_XPATH))
+    wait_for_network_idle(driver, timeout=timeout)
+
+# Relative review dates ("3 天前", "一個月前") as approximate days
+REVIEW_AGE_PATTERN = re.compile(r"(\d+|[一二兩三四五六七八九十])\s*(分鐘|小時|天|週|周|星期|個月|月|年)前")
+REVIEW_AGE_UNITS = {"分鐘": 1 / 1440, "小時": 1 / 24, "天": 1, "週": 7, "周": 7, "星期": 7, "個月": 30, "月": 30, "年": 365}
+CHINESE_NUMERALS = {"一": 1, "二": 2, "兩": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9, "十": 10}
+REVIEW_AGE_SLACK = 1.25  # "4 週前" may follow "1 個月前"; units are coarse
+
+# Approximate age in days of a relative review date, or None when it cannot be read
+def review_age_days(date):
+    match = REVIEW_AGE_PATTERN.search(date or "")
+    if not match:
+        return 0.0 if date and "剛剛" in date else None
+    number = match.group(1)
+    return (int(number) if number.isdigit() else CHINESE_NUMERALS[number]) * REVIEW_AGE_UNITS[match.group(2)]
+
+# Picks the reviews of a newest-first crawl that are not stored yet. Stored reviews are matched
+# occurrence by occurrence on text, author and date, so a second "好吃" still counts as new when
+# only one is stored. Relative dates drift between crawls, so a stored review matches a scraped
+# one that is at least as old (the closest such age wins) rather than the same date text
+class NewReviewFilter:
+    def __init__(self, existing, known_streak=3):
+        self.known = {}  # Fingerprint -> ages of the stored occurrences
+        for review in existing:
+            self.known.setdefault(self._key(review), []).append(review_age_days(review.get("日期")))
+        self.known_streak = known_streak
+        self.streak = 0
+        self.new_reviews = []
+
+    @staticmethod
+    def _key(review):
+        return review_fingerprint(review["內容"], review.get("作者", ""))
+
+    # Consume the stored occurrence matching a scraped review; False when there is none
+    def _match_stored(self, review):
+        ages = self.known.get(self._key(review))
+        if not ages:
+            return False
+        age = review_age_days(review.get("日期"))
+        candidates = [i for i, stored in enumerate(ages)
+                      if age is None or stored is None or stored <= age * REVIEW_AGE_SLACK + 1]
+        if not candidates:
+            return False
+        ages.pop(max(candidates, key=lambda i: -1 if ages[i] is None else ages[i]))
+        return True
+
+    # Take the next scraped review; returns True once known_streak stored reviews came in a row
+    def add(self, review):
+        if self._match_stored(review):
+            self.streak += 1
+            return self.streak >= self.known_streak
+        self.streak = 0
+        self.new_reviews.append(review)
+        return False
+
+# Delta re-crawl: scroll newest-first until known_streak consecutive reviews are already stored,
+# then merge only the new reviews in front of the existing output
+def refresh_reviews(driver, place_id, folder_name, scroll_timeout=8, known_streak=3):
+    try:
+        file_path, existing = load_existing_reviews(folder_name, place_id)
+        new_filter = NewReviewFilter(existing, known_streak)
+
+        scrollable_div = open_reviews(driver, place_id, folder_name, scroll_timeout)
+        sort_reviews_newest(driver, scroll_timeout)
+        wait_for_count_growth(driver, REVIEW_CARD_XPATH, 0, timeout=scroll_timeout)
+
+        reached_known = False
+        cursor = 0
+        while not reached_known:
+            batch = driver.execute_script(COLLECT_REVIEWS_JS, cursor)
+            cursor = batch["next"]
+            for review in batch["reviews"]:
+                if not review["text"]:
+                    continue
+                if new_filter.add({"內容": review["text"], "日期": review["date"]}):
+                    reached_known = True
+                    break
+
+            if reached_known:
+                break
+            if scroll_reviews(driver, scrollable_div, REVIEW_CARD_XPATH, cursor, scroll_timeout) == cursor:
+                break
+
+        new_reviews = new_filter.new_reviews
+        if new_reviews or not os.path.exists(file_path):
+            with get_metrics().timer("save", sink="reviews_json"):
+                write_reviews(file_path, new_reviews + existing)
+        get_metrics().inc("scraper_reviews_total", value=len(new_reviews))
+        logger.info(f"Refreshed {place_id}: {len(new_reviews)} new reviews, {len(existing)} already stored")
         return True
 
     except Exception as e:
-        print(f"Scraping failed: {place_id}, Error: {e}")
+        logger.warning(f"Refresh failed: {place_id}, Error: {e}")
         return False
 
 if __name__ == "__main__":
+    setup_logging()
+
     # Get script directory path
     script_dir = os.path.dirname(os.path.abspath(__file__))
     
     # Input file path - can be modified based on data type
-    input_file = os.path.join(script_dir, "完整_台北_新北_地點清單.xlsx")
+    input_file = resolve_input_file(os.path.join(script_dir, "完整_台北_新北_地點清單"))
     
     # Folder name parameter - can be modified based on data type
     folder_name = "景點評論爬蟲"  # or "餐廳評論爬蟲"
+    streaming = False  # True appends reviews to {place_id}.jsonl while scrolling
+    state_file = "crawl_state.sqlite"
 
     # Clean residual processes
     kill_chrome_processes()
 
-    # Read location list
-    df = pd.read_excel(input_file)
-
-    # Check existing files
-    if os.path.exists(folder_name):
-        crawled_files = {file.replace(".json", "") for file in os.listdir(folder_name) if file.endswith(".json")}
-    else:
-        crawled_files = set()
-
-    # Filter list to keep only non-scraped Place IDs
-    df = df[~df['Place ID'].isin(crawled_files)]
-    print(f"Remaining locations to scrape: {len(df)}")
+    # Load crawl state, importing existing review files on the first run
+    state = CrawlState(state_file)
+    migrate_output_folder(state, folder_name, folder_name)
+    crawled_files = state.settled_ids(folder_name)
+    logger.info(f"Already scraped locations: {len(crawled_files)}")
 
-    # Initialize WebDriver and start scraping
+    # Initialize WebDriver and start scraping, streaming non-scraped Place IDs from the input
     driver = init_driver()
     try:
-        for index, row in df.iterrows():
-            place_id = row['Place ID']
-            print(f"Start scraping Place ID: {place_id}")
-            success = scrape_reviews(driver, place_id, folder_name)
+        for place_id in iter_place_ids(input_file):
+            if place_id in crawled_files:
+                continue
+            logger.info(f"Start scraping Place ID: {place_id}")
+            success = scrape_reviews(driver, place_id, folder_name, streaming=streaming)
             if success:
-                print(f"Successfully scraped Place ID: {place_id}")
+                state.mark_success(folder_name, place_id)
+                logger.info(f"Successfully scraped Place ID: {place_id}")
+            else:
+                state.mark_failure(folder_name, place_id, page_failure("ScrapeFailed"))
     finally:
-        driver.quit()
\ No newline at end of file
+        driver.quit()
+        state.close()
+        get_metrics().dump()
+        export_metrics()
\ No newline at end of file
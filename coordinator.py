@@ -0,0 +1,406 @@
+import os
+import json
+import time
+import shutil
+import socket
+import logging
+import argparse
+import tempfile
+import threading
+import requests
+from multiprocessing import Process, Queue
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse
+from parallel_place_scraper import plan_jobs, record_results, retry_source, scrape_place
+from multi_element_scraper import init_driver
+from driver_pool import DriverPool
+from job_queue import HEARTBEAT_TIMEOUT, progress_age
+from process_guard import start_run, process_tree, kill_processes, kill_tree, kill_run_processes
+from metrics import get_metrics, setup_logging, reset_snapshots, export_metrics
+from pacing import configure_rate_limiter, page_failure
+from crawl_state import CrawlState
+from failures import CircuitBreaker
+from output_sink import default_sink, open_sink
+
+logger = logging.getLogger(__name__)
+
+# Coordinator/worker mode for spreading one crawl across machines. The coordinator owns the job
+# queue and crawl state (crawl_state.sqlite) and writes all output; workers on any host lease
+# batches of places over HTTP, keep their lease alive with heartbeats and push each place's
+# results back. Leases that are not renewed within lease_ttl go back to the queue.
+#
+#   python coordinator.py serve 完整_台北_新北_地點清單 --port 8767
+#   python coordinator.py work http://coordinator-host:8767 --processes 6
+
+DEFAULT_PORT = 8767
+
+# Queue, lease and result handling; used from the single server thread only
+class Coordinator:
+    def __init__(self, detail_folder, review_folder, state_file="crawl_state.sqlite", sink_name="json",
+                 lease_ttl=120):
+        self.detail_folder = detail_folder
+        self.review_folder = review_folder
+        self.lease_ttl = lease_ttl
+        self.state = CrawlState(state_file)
+        self.breaker = CircuitBreaker(self.state)
+        self.retry_source = retry_source(detail_folder, review_folder, state_file)
+        self.retry_at = None
+        self.next_retry_check = 0
+        self.sink = open_sink(sink_name, detail_folder, on_flush=self.mark_written)
+        self.reported = 0
+        self.workers = set()
+        self.released = set()
+        self.finished_at = None
+
+    # Details are marked done only once the sink has written their batch
+    def mark_written(self, place_ids):
+        for place_id in place_ids:
+            self.state.mark_success(self.detail_folder, place_id)
+
+    def enqueue(self, jobs):
+        queued = self.state.enqueue(jobs)
+        logger.info(f"{queued} places queued")
+
+    # Lease a batch to a worker; while the circuit breaker is open workers are told to pause instead
+    def lease(self, worker, count):
+        self.workers.add(worker)
+        pause = self.breaker.pause_remaining()
+        if pause > 0:
+            return {"lease_id": None, "ttl": self.lease_ttl, "jobs": [], "finished": False, "pause": pause}
+        lease_id, jobs = self.state.lease(worker, count, self.lease_ttl)
+        finished = self.finished()
+        if jobs:
+            logger.debug(f"Leased {len(jobs)} places to {worker}")
+            get_metrics().inc("scraper_leases_total")
+        elif finished:
+            self.released.add(worker)
+        return {"lease_id": lease_id, "ttl": self.lease_ttl, "jobs": jobs, "finished": finished}
+
+    def heartbeat(self, lease_id):
+        return {"ok": self.state.renew_lease(lease_id, self.lease_ttl)}
+
+    # Record a place's results the way a local worker would; reports are accepted even after the
+    # lease expired, since recording the same place twice is harmless
+    def report(self, worker, place_id, parts, results=None, error=None, review_file=None, page_error=None):
+        if error is not None:
+            logger.warning(f"{worker} failed to scrape Place ID {place_id}, Error: {error['message']}")
+            for part in parts:
+                kind = self.detail_folder if part == "details" else self.review_folder
+                self.state.mark_failure(kind, place_id, error["class"], error["message"])
+        else:
+            if review_file is not None:
+                self.write_review_file(review_file["name"], review_file["content"])
+            record_results(self.state, self.sink, self.detail_folder, self.review_folder, place_id, results,
+                           page_error or "PageNotReady")
+        self.state.dequeue(place_id)
+        self.reported += 1
+        return {"ok": True}
+
+    # Store a worker's review file under the same name, replacing any older copy
+    def write_review_file(self, name, content):
+        path = os.path.join(self.review_folder, os.path.basename(name))
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+
+    def status(self):
+        return {"queue": self.state.queue_summary(), "reported": self.reported,
+                "details": self.state.summary(self.detail_folder), "reviews": self.state.summary(self.review_folder)}
+
+    # Nothing queued, leased or scheduled for a retry
+    def finished(self):
+        summary = self.state.queue_summary()
+        return summary["queued"] == 0 and summary["leased"] == 0 and self.retry_at is None
+
+    # Finished, and every worker has been told so (or lease_ttl passed for the ones that vanished)
+    def can_exit(self):
+        if not self.finished():
+            self.finished_at = None
+            return False
+        self.finished_at = self.finished_at or time.time()
+        return self.workers <= self.released or time.time() - self.finished_at >= self.lease_ttl
+
+    # Periodic housekeeping between requests
+    def tick(self):
+        self.state.requeue_expired()
+        if time.time() >= self.next_retry_check:
+            due, self.retry_at = self.retry_source()
+            if due:
+                self.state.enqueue(due)
+            self.next_retry_check = time.time() + 5
+        if time.time() - self.sink.last_flush >= self.sink.flush_interval:
+            self.sink.flush()
+        self.state.flush()
+
+    def close(self):
+        self.sink.close()
+        self.state.close()
+
+def make_handler(coordinator):
+    routes = {
+        "/lease": lambda body: coordinator.lease(body["worker"], body.get("count", 5)),
+        "/heartbeat": lambda body: coordinator.heartbeat(body["lease_id"]),
+        "/report": lambda body: coordinator.report(body["worker"], body["place_id"], body["parts"],
+                                                   body.get("results"), body.get("error"), body.get("review_file"),
+                                                   body.get("page_error")),
+    }
+
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, data, status=200):
+            body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if urlparse(self.path).path == "/status":
+                self.send_json(coordinator.status())
+            else:
+                self.send_error(404)
+
+        def do_POST(self):
+            route = routes.get(urlparse(self.path).path)
+            if route is None:
+                self.send_error(404)
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                self.send_json(route(body))
+            except (KeyError, ValueError) as e:
+                self.send_json({"error": f"Bad request: {e}"}, status=400)
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+# Queue the places still missing a part and serve workers until the queue is empty
+# (or forever when exit_when_done is False); ready receives the coordinator URL once listening
+def serve(input_file, is_restaurant=True, cost_column="評論數", state_file="crawl_state.sqlite", sink_name=None,
+          host="0.0.0.0", port=DEFAULT_PORT, lease_ttl=120, exit_when_done=True, ready=None):
+    setup_logging()
+    detail_folder, review_folder, jobs = plan_jobs(input_file, is_restaurant, cost_column, state_file)
+    coordinator = Coordinator(detail_folder, review_folder, state_file, sink_name or default_sink(), lease_ttl)
+    coordinator.enqueue(jobs)
+
+    server = HTTPServer((host, port), make_handler(coordinator))
+    server.timeout = 1
+    url = f"http://{socket.gethostname() if host == '0.0.0.0' else host}:{server.server_address[1]}"
+    logger.info(f"Coordinator listening on {url}")
+    if ready is not None:
+        ready.put(url)
+
+    last_report = time.time()
+    try:
+        while not (exit_when_done and coordinator.can_exit()):
+            server.handle_request()
+            coordinator.tick()
+            if time.time() - last_report >= 60:
+                status = coordinator.status()
+                logger.info(f"Queue: {status['queue']['queued']} queued, {status['queue']['leased']} leased, "
+                            f"{status['reported']} reported")
+                last_report = time.time()
+    finally:
+        server.server_close()
+        coordinator.close()
+        get_metrics().dump()
+    logger.info("All queued places reported, coordinator stopped")
+
+# HTTP client for the coordinator API; retries while the coordinator restarts
+class CoordinatorClient:
+    def __init__(self, url, worker, timeout=30, retries=5):
+        self.url = url.rstrip("/")
+        self.worker = worker
+        self.timeout = timeout
+        self.retries = retries
+        self.session = requests.Session()
+
+    def post(self, path, payload):
+        for attempt in range(self.retries):
+            try:
+                response = self.session.post(self.url + path, json=payload, timeout=self.timeout)
+                response.raise_for_status()
+                return response.json()
+            except requests.RequestException as e:
+                if attempt == self.retries - 1:
+                    raise
+                logger.warning(f"Coordinator request {path} failed, retrying: {e}")
+                time.sleep(2 ** attempt)
+
+    def lease(self, count):
+        return self.post("/lease", {"worker": self.worker, "count": count})
+
+    def heartbeat(self, lease_id):
+        return self.post("/heartbeat", {"worker": self.worker, "lease_id": lease_id})["ok"]
+
+    def report(self, place_id, parts, **payload):
+        return self.post("/report", {"worker": self.worker, "place_id": place_id, "parts": parts, **payload})
+
+# Renews a lease on its own connection while the batch is being scraped
+class Heartbeat(threading.Thread):
+    def __init__(self, url, worker, lease_id, interval):
+        super().__init__(daemon=True)
+        self.client = CoordinatorClient(url, worker, retries=1)
+        self.lease_id = lease_id
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            # A hung page: stop renewing, kill this worker's browsers and exit so run_workers replaces it
+            if progress_age() > HEARTBEAT_TIMEOUT:
+                logger.error(f"No progress for {progress_age():.0f} seconds, killing this worker")
+                get_metrics().dump()
+                kill_processes(process_tree(os.getpid())[1:])
+                os._exit(1)
+            try:
+                if not self.client.heartbeat(self.lease_id):
+                    logger.warning(f"Lease {self.lease_id} expired, its places may be scraped twice")
+            except requests.RequestException as e:
+                logger.warning(f"Heartbeat failed: {e}")
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+# Scrape one leased place into the scratch folder; returns the report payload
+def scrape_job(pool, job, scratch_folder, use_js=True, streaming=False):
+    place_id = job['place_id']
+    parts = job['parts']
+    try:
+        results = pool.run(scrape_place, place_id, parts, scratch_folder, use_js=use_js, streaming=streaming,
+                           succeeded=lambda results: any(results.values()))
+    except Exception as e:
+        return {"error": {"class": type(e).__name__, "message": str(e)[:500]}}
+
+    payload = {"results": results, "page_error": page_failure()}
+    if results.get("reviews"):
+        for name in (f"{place_id}.json", f"{place_id}.jsonl"):
+            path = os.path.join(scratch_folder, name)
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    payload["review_file"] = {"name": name, "content": f.read()}
+                os.remove(path)
+                break
+    return payload
+
+# Worker process: lease a batch, scrape it with a heartbeat running, report each place, repeat
+def run_worker_process(url, batch_size=5, use_js=True, pages_per_minute=12, streaming=False, idle_wait=5):
+    setup_logging()
+    pid = os.getpid()
+    worker = f"{socket.gethostname()}-{pid}"
+    configure_rate_limiter(per_minute=pages_per_minute)
+    client = CoordinatorClient(url, worker)
+    pool = DriverPool(init_driver)
+    scratch_folder = tempfile.mkdtemp(prefix="worker_reviews_")
+    metrics = get_metrics()
+    reported = 0
+
+    try:
+        while True:
+            try:
+                lease = client.lease(batch_size)
+            except requests.RequestException as e:
+                logger.error(f"Coordinator unreachable, {worker} stops: {e}")
+                break
+            if not lease["jobs"]:
+                if lease["finished"]:
+                    break
+                # Circuit breaker open, or other workers hold the remaining leases and retries
+                time.sleep(lease.get("pause") or idle_wait)
+                continue
+
+            heartbeat = Heartbeat(url, worker, lease["lease_id"], lease["ttl"] / 3)
+            heartbeat.start()
+            try:
+                for job in lease["jobs"]:
+                    logger.info(f"{worker} starts scraping Place ID: {job['place_id']} ({', '.join(job['parts'])})")
+                    started = time.time()
+                    payload = scrape_job(pool, job, scratch_folder, use_js, streaming)
+                    client.report(job['place_id'], job['parts'], **payload)
+                    reported += 1
+                    metrics.observe("scraper_job_seconds", time.time() - started)
+                    metrics.maybe_dump()
+            finally:
+                heartbeat.stop()
+    finally:
+        pool.close()
+        shutil.rmtree(scratch_folder, ignore_errors=True)
+        logger.info(f"{worker} reported {reported} places")
+        metrics.dump()
+
+# Run num_processes workers on this host against a coordinator, replacing workers that crash
+# or kill themselves over a hung page; their leases expire and go back to the queue
+def run_workers(url, num_processes, batch_size=5, use_js=True, pages_per_minute=12, streaming=False):
+    start_run()
+    reset_snapshots()
+
+    def start_worker():
+        p = Process(target=run_worker_process, args=(url, batch_size, use_js, pages_per_minute, streaming))
+        p.start()
+        return p
+
+    processes = [start_worker() for _ in range(num_processes)]
+    restarts = 0
+    while any(p.is_alive() for p in processes):
+        for i, p in enumerate(processes):
+            p.join(timeout=1)
+            if p.exitcode not in (None, 0) and restarts < 3 * num_processes:
+                restarts += 1
+                logger.error(f"Worker {p.pid} exited with code {p.exitcode}, replacing it")
+                get_metrics().inc("scraper_worker_killed_total")
+                kill_tree(p.pid)
+                processes[i] = start_worker()
+    kill_run_processes()
+    prom_path, json_path = export_metrics()
+    logger.info(f"Metrics exported to {prom_path} and {json_path}")
+
+# Coordinator plus num_processes workers on this host, the same interface as the other parallel_scrape
+# functions; a local stand-in for a multi-machine crawl
+def parallel_scrape(input_file, num_processes, is_restaurant=True, cost_column="評論數", use_js=True,
+                    pages_per_minute=12, streaming=False, state_file="crawl_state.sqlite", sink_name=None,
+                    batch_size=5, lease_ttl=120):
+    ready = Queue()
+    server = Process(target=serve, args=(input_file, is_restaurant, cost_column, state_file, sink_name),
+                     kwargs={"host": "127.0.0.1", "port": 0, "lease_ttl": lease_ttl, "ready": ready})
+    server.start()
+    url = ready.get(timeout=600)
+    try:
+        run_workers(url, num_processes, batch_size, use_js, pages_per_minute, streaming)
+    finally:
+        server.join(timeout=60)
+        if server.is_alive():
+            logger.warning("Coordinator still has unreported places, stopping it")
+            server.terminate()
+    logger.info("All scraping processes completed!")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Distributed crawl: one coordinator, workers on any host")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_parser = commands.add_parser("serve", help="Queue places and hand them out to workers")
+    serve_parser.add_argument("input_file", help="Place list (.csv / .parquet / .jsonl / .xlsx)")
+    serve_parser.add_argument("--attractions", action="store_true", help="Scrape attractions instead of restaurants")
+    serve_parser.add_argument("--host", default="0.0.0.0")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--state-file", default="crawl_state.sqlite")
+    serve_parser.add_argument("--sink", default=None, help="json, jsonl, sqlite or parquet")
+    serve_parser.add_argument("--lease-ttl", type=int, default=120, help="Seconds before an unrenewed lease expires")
+    serve_parser.add_argument("--keep-running", action="store_true", help="Keep serving after the queue is empty")
+
+    work_parser = commands.add_parser("work", help="Scrape places leased from a coordinator")
+    work_parser.add_argument("url", help="Coordinator URL, e.g. http://127.0.0.1:8767")
+    work_parser.add_argument("--processes", type=int, default=6)
+    work_parser.add_argument("--batch-size", type=int, default=5, help="Places per lease")
+    work_parser.add_argument("--pages-per-minute", type=float, default=12, help="Rate limit per process")
+    work_parser.add_argument("--streaming", action="store_true", help="Write reviews as JSONL")
+    work_parser.add_argument("--no-js", action="store_true", help="Use per-element lookups instead of one script")
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.command == "serve":
+        serve(args.input_file, not args.attractions, state_file=args.state_file, sink_name=args.sink,
+              host=args.host, port=args.port, lease_ttl=args.lease_ttl, exit_when_done=not args.keep_running)
+    else:
+        run_workers(args.url, args.processes, args.batch_size, not args.no_js, args.pages_per_minute, args.streaming)
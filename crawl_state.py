@@ -0,0 +1,432 @@
+import os
+import json
+import glob
+import time
+import uuid
+import sqlite3
+import logging
+import argparse
+from metrics import get_metrics, setup_logging
+from failures import classify, retry_delay
+
+logger = logging.getLogger(__name__)
+
+# Transactional crawl state shared by all worker processes (WAL-mode SQLite).
+# One row per (place_id, kind), where kind is the output the crawl produces,
+# e.g. "餐廳詳細資訊" or "餐廳評論爬蟲". Status is done, retry (next_attempt set
+# while a retry is scheduled) or dead (dead-letter list, skipped by later runs);
+# failures counts the failed attempts since the last success.
+# signals keeps the grid-search rating and review count of each place: the latest seen,
+# the ones it was last crawled against, and the ones a pending recrawl was planned against.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS places (
+    place_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error_class TEXT,
+    error_message TEXT,
+    first_attempt REAL,
+    last_attempt REAL,
+    completed_at REAL,
+    failure_class TEXT,
+    next_attempt REAL,
+    failures INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (place_id, kind)
+);
+CREATE INDEX IF NOT EXISTS places_kind_status ON places (kind, status);
+CREATE TABLE IF NOT EXISTS queue (
+    place_id TEXT PRIMARY KEY,
+    parts TEXT NOT NULL,
+    cost REAL NOT NULL DEFAULT 0,
+    lease_id TEXT,
+    worker TEXT,
+    lease_expires REAL
+);
+CREATE INDEX IF NOT EXISTS queue_lease ON queue (lease_id, cost);
+CREATE TABLE IF NOT EXISTS blocks (at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS breaker (id INTEGER PRIMARY KEY CHECK (id = 1), paused_until REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS signals (
+    place_id TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    rating REAL,
+    review_count INTEGER,
+    seen_at REAL,
+    crawled_rating REAL,
+    crawled_review_count INTEGER,
+    planned_rating REAL,
+    planned_review_count INTEGER,
+    planned_at REAL,
+    PRIMARY KEY (place_id, kind)
+);
+"""
+
+# Columns added after the first release, for state files created before them
+MIGRATIONS = {
+    "failure_class": "ALTER TABLE places ADD COLUMN failure_class TEXT",
+    "next_attempt": "ALTER TABLE places ADD COLUMN next_attempt REAL",
+    "failures": "ALTER TABLE places ADD COLUMN failures INTEGER NOT NULL DEFAULT 0; "
+                "UPDATE places SET failures = attempts WHERE status != 'done'",
+}
+
+RECORD_SQL = """
+INSERT INTO places (place_id, kind, status, attempts, error_class, error_message,
+                    first_attempt, last_attempt, completed_at, failure_class, next_attempt, failures)
+VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (place_id, kind) DO UPDATE SET
+    status = excluded.status,
+    attempts = attempts + 1,
+    error_class = excluded.error_class,
+    error_message = excluded.error_message,
+    first_attempt = COALESCE(first_attempt, excluded.first_attempt),
+    last_attempt = excluded.last_attempt,
+    completed_at = COALESCE(excluded.completed_at, completed_at),
+    failure_class = excluded.failure_class,
+    next_attempt = excluded.next_attempt,
+    failures = CASE WHEN excluded.status = 'done' THEN 0 ELSE failures + 1 END
+"""
+
+class CrawlState:
+    def __init__(self, path="crawl_state.sqlite", batch_size=20, flush_interval=5):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(places)")}
+        for column, sql in MIGRATIONS.items():
+            if column not in columns:
+                self.conn.executescript(sql)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS places_retry ON places (status, next_attempt)")
+        self.conn.commit()
+        self.pending = []
+        self.last_flush = time.time()
+
+    # Set of Place IDs finished for a kind, for O(1) membership checks
+    def done_ids(self, kind):
+        self.flush()
+        rows = self.conn.execute("SELECT place_id FROM places WHERE kind=? AND status='done'", (kind,))
+        return {row[0] for row in rows}
+
+    # Place IDs that need no further attempt: done, or on the dead-letter list
+    def settled_ids(self, kind):
+        self.flush()
+        rows = self.conn.execute("SELECT place_id FROM places WHERE kind=? AND status IN ('done', 'dead')", (kind,))
+        return {row[0] for row in rows}
+
+    # Check a single Place ID
+    def is_done(self, kind, place_id):
+        self.flush()
+        row = self.conn.execute("SELECT 1 FROM places WHERE kind=? AND place_id=? AND status='done'",
+                                (kind, place_id)).fetchone()
+        return row is not None
+
+    # Full state row of a place as a dict, or None
+    def get(self, kind, place_id):
+        self.flush()
+        cursor = self.conn.execute("SELECT * FROM places WHERE kind=? AND place_id=?", (kind, place_id))
+        row = cursor.fetchone()
+        return dict(zip([c[0] for c in cursor.description], row)) if row else None
+
+    # Count places per status for a kind
+    def summary(self, kind):
+        self.flush()
+        rows = self.conn.execute("SELECT status, COUNT(*) FROM places WHERE kind=? GROUP BY status", (kind,))
+        return dict(rows.fetchall())
+
+    # Queue an attempt result; committed in batches
+    def record(self, kind, place_id, status, error_class=None, error_message=None, failure_class=None,
+               next_attempt=None):
+        now = time.time()
+        completed_at = now if status == "done" else None
+        get_metrics().inc("scraper_places_total", kind=kind, result=status, error=error_class or "",
+                          failure=failure_class or "")
+        self.pending.append((place_id, kind, status, error_class, error_message, now, now, completed_at,
+                             failure_class, next_attempt, 0 if status == "done" else 1))
+        if len(self.pending) >= self.batch_size or now - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def mark_success(self, kind, place_id):
+        self.record(kind, place_id, "done")
+
+    # Classify a failure and schedule a retry with backoff, or move the place to the dead-letter list
+    # once its class has used up its retries; only failures since the last success count, so a
+    # recrawl of a place crawled many times before gets the full set. Committed right away, so the
+    # retry scheduler and the circuit breaker in other processes see it; returns the failure class
+    def mark_failure(self, kind, place_id, error_class, error_message=None):
+        failure_class = classify(error_class, error_message)
+        row = self.get(kind, place_id)
+        delay = retry_delay(failure_class, (row["failures"] if row else 0) + 1)
+        if delay is None:
+            logger.warning(f"Place ID {place_id} moved to the dead-letter list ({kind}, {failure_class})")
+            self.record(kind, place_id, "dead", error_class, (error_message or "")[:500], failure_class)
+        else:
+            self.record(kind, place_id, "retry", error_class, (error_message or "")[:500], failure_class,
+                        time.time() + delay)
+        if failure_class == "blocked":
+            self.conn.execute("INSERT INTO blocks (at) VALUES (?)", (time.time(),))
+        self.flush()
+        return failure_class
+
+    # Commit queued updates in one transaction
+    def flush(self):
+        if not self.pending:
+            if self.conn.in_transaction:
+                self.conn.commit()
+            return
+        with self.conn:
+            self.conn.executemany(RECORD_SQL, self.pending)
+        self.pending = []
+        self.last_flush = time.time()
+
+    # Mark Place IDs as done without counting an attempt (used for migrations)
+    def import_done(self, kind, place_ids):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO places (place_id, kind, status, completed_at) VALUES (?, ?, 'done', ?)",
+                ((place_id, kind, now) for place_id in place_ids))
+
+    # Whether a kind has any rows yet
+    def has_kind(self, kind):
+        self.flush()
+        return self.conn.execute("SELECT 1 FROM places WHERE kind=? LIMIT 1", (kind,)).fetchone() is not None
+
+    # Claim the retries that came due for the given kinds; returns [(place_id, kind)]
+    def claim_retries(self, kinds):
+        self.flush()
+        marks = ",".join("?" * len(kinds))
+        with self.conn:
+            rows = self.conn.execute(
+                f"SELECT place_id, kind FROM places WHERE status='retry' AND next_attempt <= ? AND kind IN ({marks}) "
+                f"ORDER BY next_attempt", (time.time(), *kinds)).fetchall()
+            self.conn.executemany("UPDATE places SET next_attempt=NULL WHERE place_id=? AND kind=?", rows)
+        return rows
+
+    # Time of the next scheduled retry for the given kinds, or None
+    def next_retry_at(self, kinds):
+        marks = ",".join("?" * len(kinds))
+        row = self.conn.execute(f"SELECT MIN(next_attempt) FROM places WHERE status='retry' AND kind IN ({marks})",
+                                tuple(kinds)).fetchone()
+        return row[0]
+
+    # Drop scheduled retries; a new run plans every place that is not settled anyway
+    def reset_retries(self, kinds):
+        self.flush()
+        marks = ",".join("?" * len(kinds))
+        with self.conn:
+            self.conn.execute(f"UPDATE places SET next_attempt=NULL WHERE status='retry' AND kind IN ({marks})",
+                              tuple(kinds))
+
+    # Dead-letter rows, optionally for one kind, as dicts
+    def dead_letters(self, kind=None):
+        self.flush()
+        cursor = self.conn.execute("SELECT * FROM places WHERE status='dead' AND (? IS NULL OR kind=?) "
+                                   "ORDER BY kind, last_attempt", (kind, kind))
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    # Give dead-lettered places a fresh set of retries on the next run; returns the number requeued
+    def requeue_dead(self, kind=None, failure_class=None):
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE places SET status='retry', attempts=0, failures=0, next_attempt=NULL WHERE status='dead' "
+                "AND (? IS NULL OR kind=?) AND (? IS NULL OR failure_class=?)",
+                (kind, kind, failure_class, failure_class))
+        return cursor.rowcount
+
+    # Blocked failures recorded since a time, for the circuit breaker
+    def count_blocks(self, since):
+        return self.conn.execute("SELECT COUNT(*) FROM blocks WHERE at >= ?", (since,)).fetchone()[0]
+
+    def paused_until(self):
+        row = self.conn.execute("SELECT paused_until FROM breaker WHERE id = 1").fetchone()
+        return row[0] if row else 0
+
+    # Pause every worker until a time, starting the block count over
+    def pause_until(self, until):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO breaker (id, paused_until) VALUES (1, ?)", (until,))
+            self.conn.execute("DELETE FROM blocks")
+
+    # Add jobs to the coordinator queue, updating the parts of places already queued
+    def enqueue(self, jobs):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO queue (place_id, parts, cost) VALUES (?, ?, ?) "
+                "ON CONFLICT (place_id) DO UPDATE SET parts = excluded.parts, cost = excluded.cost",
+                ((job["place_id"], json.dumps(job["parts"]), job.get("cost", 0)) for job in jobs))
+        return self.queue_summary()["queued"]
+
+    # Lease up to count unleased jobs, biggest first, for ttl seconds; returns (lease_id, jobs)
+    def lease(self, worker, count, ttl):
+        self.requeue_expired()
+        lease_id = uuid.uuid4().hex
+        with self.conn:
+            rows = self.conn.execute(
+                "SELECT place_id, parts, cost FROM queue WHERE lease_id IS NULL ORDER BY cost DESC LIMIT ?",
+                (count,)).fetchall()
+            self.conn.executemany("UPDATE queue SET lease_id=?, worker=?, lease_expires=? WHERE place_id=?",
+                                  ((lease_id, worker, time.time() + ttl, row[0]) for row in rows))
+        jobs = [{"place_id": place_id, "parts": json.loads(parts), "cost": cost} for place_id, parts, cost in rows]
+        return (lease_id if jobs else None), jobs
+
+    # Extend a lease; False when it already expired and its jobs went back to the queue
+    def renew_lease(self, lease_id, ttl):
+        with self.conn:
+            cursor = self.conn.execute("UPDATE queue SET lease_expires=? WHERE lease_id=?",
+                                       (time.time() + ttl, lease_id))
+        return cursor.rowcount > 0
+
+    # Put jobs whose lease ran out back in the queue
+    def requeue_expired(self):
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE queue SET lease_id=NULL, worker=NULL, lease_expires=NULL WHERE lease_expires < ?",
+                (time.time(),))
+        if cursor.rowcount:
+            get_metrics().inc("scraper_leases_expired_total", value=cursor.rowcount)
+            logger.warning(f"Requeued {cursor.rowcount} jobs with expired leases")
+        return cursor.rowcount
+
+    # Remove a finished job from the queue
+    def dequeue(self, place_id):
+        with self.conn:
+            self.conn.execute("DELETE FROM queue WHERE place_id=?", (place_id,))
+
+    # Queued (unleased) and leased job counts
+    def queue_summary(self):
+        queued, leased = self.conn.execute(
+            "SELECT COUNT(*) - COUNT(lease_id), COUNT(lease_id) FROM queue").fetchone()
+        return {"queued": queued, "leased": leased}
+
+    # Store the latest grid-search signals, rows of (place_id, rating, review_count), for a kind.
+    # Places seen for the first time take them as the baseline they were crawled against, since
+    # nothing tells what they were back then; places crawled outside a planned recrawl since the
+    # previous snapshot take that snapshot's signals
+    def record_signals(self, kind, rows):
+        self.flush()
+        now = time.time()
+        crawled_since_seen = ("planned_at IS NULL AND (SELECT completed_at FROM places p WHERE p.place_id = "
+                              "signals.place_id AND p.kind = signals.kind) > seen_at")
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO signals (place_id, kind, rating, review_count, seen_at, crawled_rating, "
+                "crawled_review_count) VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (place_id, kind) DO UPDATE SET "
+                f"crawled_rating = CASE WHEN {crawled_since_seen} THEN rating ELSE crawled_rating END, "
+                f"crawled_review_count = CASE WHEN {crawled_since_seen} THEN review_count ELSE crawled_review_count END, "
+                "rating = excluded.rating, review_count = excluded.review_count, seen_at = excluded.seen_at",
+                ((place_id, kind, rating, review_count, now, rating, review_count)
+                 for place_id, rating, review_count in rows))
+
+    # Remember the signals a recrawl of these places is planned against
+    def plan_signals(self, kind, place_ids):
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE signals SET planned_rating = rating, planned_review_count = review_count, planned_at = ? "
+                "WHERE place_id = ? AND kind = ?", ((time.time(), place_id, kind) for place_id in place_ids))
+
+    # Planned signals become the baseline of places whose recrawl finished since it was planned;
+    # returns how many were settled
+    def settle_signals(self, kind):
+        self.flush()
+        with self.conn:
+            cursor = self.conn.execute(
+                "UPDATE signals SET crawled_rating = planned_rating, crawled_review_count = planned_review_count, "
+                "planned_at = NULL WHERE kind = ? AND planned_at IS NOT NULL AND EXISTS (SELECT 1 FROM places p "
+                "WHERE p.place_id = signals.place_id AND p.kind = signals.kind AND p.completed_at >= signals.planned_at)",
+                (kind,))
+        return cursor.rowcount
+
+    # Signals of a kind joined with the crawl state of the places, as dicts
+    def signal_rows(self, kind):
+        self.flush()
+        cursor = self.conn.execute(
+            "SELECT s.place_id, s.rating, s.review_count, s.crawled_rating, s.crawled_review_count, p.status, "
+            "p.failures, p.failure_class, p.completed_at FROM signals s JOIN places p "
+            "ON p.place_id = s.place_id AND p.kind = s.kind WHERE s.kind = ?", (kind,))
+        columns = [c[0] for c in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+# Retry jobs for run_job_queue: returns (jobs that came due, time of the next scheduled retry).
+# kinds maps each crawl-state kind to its part name for jobs with parts, or is a list of kinds for
+# single-part jobs; retries due more than horizon seconds out are left for the next run
+class RetrySource:
+    def __init__(self, state_file, kinds, horizon=900):
+        self.state_file = state_file
+        self.kinds = kinds
+        self.horizon = horizon
+        state = CrawlState(state_file)
+        state.reset_retries(list(kinds))
+        state.close()
+
+    def __call__(self):
+        state = CrawlState(self.state_file)
+        try:
+            rows = state.claim_retries(list(self.kinds))
+            next_at = state.next_retry_at(list(self.kinds))
+        finally:
+            state.close()
+
+        jobs = {}
+        for place_id, kind in rows:
+            job = jobs.setdefault(place_id, {"place_id": place_id, "cost": 0})
+            if isinstance(self.kinds, dict):
+                job.setdefault("parts", []).append(self.kinds[kind])
+        if jobs:
+            logger.info(f"Retrying {len(jobs)} places")
+        if next_at is not None and next_at - time.time() > self.horizon:
+            next_at = None
+        return list(jobs.values()), next_at
+
+# Import a legacy crawled_*.json progress list and temp_crawled_detail_{pid}.json backups
+def migrate_progress_files(state, kind, progress_file, temp_pattern="temp_crawled_detail_*.json"):
+    files = glob.glob(temp_pattern)
+    if os.path.exists(progress_file) and not state.has_kind(kind):
+        files.insert(0, progress_file)
+    for file in files:
+        try:
+            with open(file, "r", encoding="utf-8") as f:
+                place_ids = json.load(f)
+            state.import_done(kind, place_ids)
+            logger.info(f"Imported {len(place_ids)} crawled IDs from {file}")
+        except Exception as e:
+            logger.warning(f"Failed to import progress file {file}: {e}")
+
+# Import existing per-place output files once, so later runs never rescan the directory
+def migrate_output_folder(state, kind, folder_name, extensions=(".json", ".jsonl")):
+    if state.has_kind(kind) or not os.path.isdir(folder_name):
+        return
+    place_ids = [os.path.splitext(file)[0] for file in os.listdir(folder_name) if file.endswith(extensions)]
+    state.import_done(kind, place_ids)
+    logger.info(f"Imported {len(place_ids)} existing files from {folder_name}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the crawl state and its dead-letter list")
+    parser.add_argument("--state-file", default="crawl_state.sqlite")
+    parser.add_argument("--kind", help="Output folder kind, e.g. 餐廳詳細資訊")
+    parser.add_argument("--dead-letters", action="store_true", help="List places on the dead-letter list")
+    parser.add_argument("--requeue", action="store_true", help="Give dead-lettered places a fresh set of retries")
+    parser.add_argument("--failure-class", help="Only requeue this failure class, e.g. blocked")
+    args = parser.parse_args()
+
+    setup_logging()
+    state = CrawlState(args.state_file)
+    if args.requeue:
+        logger.info(f"Requeued {state.requeue_dead(args.kind, args.failure_class)} dead-lettered places")
+    elif args.dead_letters:
+        for row in state.dead_letters(args.kind):
+            print(f"{row['kind']}\t{row['place_id']}\t{row['failure_class']}\t{row['attempts']}\t"
+                  f"{row['error_class']}: {row['error_message'] or ''}")
+    else:
+        kinds = [args.kind] if args.kind else [row[0] for row in state.conn.execute("SELECT DISTINCT kind FROM places")]
+        for kind in kinds:
+            print(f"{kind}: {state.summary(kind)}")
+    state.close()
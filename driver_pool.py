@@ -0,0 +1,160 @@
+import os
+import logging
+import functools
+import threading
+import psutil
+from resource_policy import report_page_transfer
+from metrics import get_metrics
+from process_guard import process_tree, kill_processes
+
+logger = logging.getLogger(__name__)
+
+# The chromedriver process and every Chrome process it spawned
+def driver_processes(driver):
+    try:
+        return process_tree(driver.service.process.pid)
+    except AttributeError:
+        return []
+
+# Sum RSS (MB) of a driver's process tree
+def driver_rss_mb(driver):
+    total = 0
+    for proc in driver_processes(driver):
+        try:
+            total += proc.memory_info().rss
+        except psutil.Error:
+            pass
+    return total / (1024 * 1024)
+
+# Check whether the browser session still responds
+def is_driver_alive(driver):
+    try:
+        driver.execute_script("return 1")
+        return True
+    except Exception:
+        return False
+
+# Quit a driver, ignoring errors from an already dead session. The process tree is captured
+# first, so a hung quit or Chrome processes that outlive chromedriver are killed after timeout seconds
+def quit_driver(driver, timeout=15):
+    procs = driver_processes(driver)
+
+    def target():
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.warning(f"Failed to quit browser cleanly: {e}")
+
+    quitter = threading.Thread(target=target, daemon=True)
+    quitter.start()
+    quitter.join(timeout)
+    if quitter.is_alive():
+        logger.warning(f"Browser did not quit within {timeout} seconds, killing its processes")
+    killed = kill_processes(procs)
+    if killed:
+        get_metrics().inc("scraper_browser_processes_killed_total", killed)
+
+# Keeps one browser per worker, recycling it after N pages or when RSS grows too large. With
+# transfer_report the browsers are started with the performance log, which page_done drains
+class DriverPool:
+    def __init__(self, init_fn, max_pages=300, max_rss_mb=1500, prelaunch_ratio=0.8, transfer_report=True):
+        self.init_fn = functools.partial(init_fn, performance_log=True) if transfer_report else init_fn
+        self.transfer_report = transfer_report
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.prelaunch_ratio = prelaunch_ratio
+        self.pid = os.getpid()
+        self.driver = None
+        self.pages = 0
+        self.recycled = 0
+        self._spare = None
+        self._spare_error = None
+        self._spare_thread = None
+
+    # Launch the replacement browser in a background thread
+    def _launch_spare(self):
+        if self._spare_thread is not None or self._spare is not None:
+            return
+
+        def target():
+            try:
+                self._spare = self.init_fn()
+            except Exception as e:
+                self._spare_error = e
+
+        logger.info(f"Process {self.pid} pre-launching replacement browser")
+        self._spare_thread = threading.Thread(target=target, daemon=True)
+        self._spare_thread.start()
+
+    # Take the pre-launched browser, or start one now if none is ready
+    def _take_spare(self):
+        if self._spare_thread is not None:
+            self._spare_thread.join()
+            self._spare_thread = None
+        driver, self._spare = self._spare, None
+        if self._spare_error is not None:
+            logger.warning(f"Process {self.pid} replacement browser failed to start: {self._spare_error}")
+            self._spare_error = None
+        return driver if driver is not None else self.init_fn()
+
+    # Swap in a fresh browser and quit the old one without blocking the worker
+    def _replace(self, reason):
+        old = self.driver
+        self.driver = self._take_spare()
+        self.pages = 0
+        self.recycled += 1
+        get_metrics().inc("scraper_browser_recycled_total")
+        logger.info(f"Process {self.pid} recycled browser ({reason}), total recycled: {self.recycled}")
+        if old is not None:
+            threading.Thread(target=quit_driver, args=(old,), daemon=True).start()
+
+    # Return a live driver, transparently replacing a dead session
+    def get(self):
+        if self.driver is None:
+            self.driver = self.init_fn()
+        elif not is_driver_alive(self.driver):
+            self._replace("session died")
+        return self.driver
+
+    # Count a finished page and recycle the browser when it reaches its limits
+    def page_done(self):
+        self.pages += 1
+        if self.transfer_report:
+            report_page_transfer(self.driver)
+        rss = driver_rss_mb(self.driver) if self.max_rss_mb else 0
+
+        if self.max_pages and self.pages >= self.max_pages:
+            self._replace(f"{self.pages} pages")
+        elif self.max_rss_mb and rss >= self.max_rss_mb:
+            self._replace(f"RSS {rss:.0f} MB")
+        elif (self.max_pages and self.pages >= self.max_pages * self.prelaunch_ratio) or \
+                (self.max_rss_mb and rss >= self.max_rss_mb * self.prelaunch_ratio):
+            self._launch_spare()
+
+    # Run fn(driver, ...) and retry once on a fresh browser if the session died
+    def run(self, fn, *args, succeeded=bool, **kwargs):
+        for attempt in range(2):
+            driver = self.get()
+            try:
+                result = fn(driver, *args, **kwargs)
+            except Exception:
+                if attempt == 0 and not is_driver_alive(driver):
+                    self._replace("session died during page")
+                    continue
+                raise
+            if not succeeded(result) and attempt == 0 and not is_driver_alive(driver):
+                self._replace("session died during page")
+                continue
+            self.page_done()
+            return result
+
+    # Quit the active and any pre-launched browser
+    def close(self):
+        if self._spare_thread is not None:
+            self._spare_thread.join()
+            self._spare_thread = None
+        for driver in (self.driver, self._spare):
+            if driver is not None:
+                quit_driver(driver)
+        self.driver = None
+        self._spare = None
@@ -0,0 +1,88 @@
+import time
+import random
+import logging
+from metrics import get_metrics
+from job_queue import heartbeat, HEARTBEAT_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# Failure classes with their retry policy: retries before a place goes to the dead-letter list,
+# and the base backoff in seconds, doubled on every further attempt
+POLICIES = {
+    "timeout": {"retries": 3, "backoff": 60},
+    "selector_miss": {"retries": 1, "backoff": 600},
+    "blocked": {"retries": 5, "backoff": 900},
+    "driver_crash": {"retries": 3, "backoff": 30},
+    "place_gone": {"retries": 0, "backoff": 0},
+    "unknown": {"retries": 2, "backoff": 120},
+}
+
+# error_class values recorded by the scrapers (their own names or exception class names)
+ERROR_CLASSES = {
+    "PageNotReady": "timeout",
+    "TimeoutException": "timeout",
+    "TimeoutError": "timeout",
+    "ReadTimeout": "timeout",
+    "NameNotFound": "selector_miss",
+    "ScrapeFailed": "selector_miss",
+    "NoSuchElementException": "selector_miss",
+    "StaleElementReferenceException": "selector_miss",
+    "ElementClickInterceptedException": "selector_miss",
+    "Blocked": "blocked",
+    "PlaceGone": "place_gone",
+    "InvalidSessionIdException": "driver_crash",
+    "NoSuchWindowException": "driver_crash",
+    "SessionNotCreatedException": "driver_crash",
+}
+
+# Messages of generic WebDriver/CDP errors that mean the browser itself went away
+DRIVER_CRASH_PATTERNS = ["invalid session id", "chrome not reachable", "session deleted", "disconnected",
+                         "target window already closed", "DevTools connection", "Connection refused"]
+
+# Failure class of a recorded error
+def classify(error_class, error_message=None):
+    if error_class in ERROR_CLASSES:
+        return ERROR_CLASSES[error_class]
+    if error_message and any(pattern in error_message for pattern in DRIVER_CRASH_PATTERNS):
+        return "driver_crash"
+    return "unknown"
+
+# Seconds until the next attempt after the given number of failed attempts, or None once the
+# class has used up its retries; jitter spreads retries of places that failed together
+def retry_delay(failure_class, attempts, jitter=0.2):
+    policy = POLICIES.get(failure_class, POLICIES["unknown"])
+    if attempts > policy["retries"]:
+        return None
+    delay = policy["backoff"] * 2 ** (attempts - 1)
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+# Pauses every worker sharing a crawl state once block signals spike: threshold blocked
+# failures within window seconds open the breaker for cooldown seconds
+class CircuitBreaker:
+    def __init__(self, state, threshold=3, window=300, cooldown=900):
+        self.state = state
+        self.threshold = threshold
+        self.window = window
+        self.cooldown = cooldown
+
+    # Seconds left in the current pause, opening the breaker first if blocks spiked
+    def pause_remaining(self):
+        now = time.time()
+        paused_until = self.state.paused_until()
+        if paused_until <= now and self.state.count_blocks(now - self.window) >= self.threshold:
+            paused_until = now + self.cooldown
+            self.state.pause_until(paused_until)
+            get_metrics().inc("scraper_circuit_open_total")
+            logger.warning(f"Block signals spiked, pausing all workers for {self.cooldown} seconds")
+        return max(0.0, paused_until - now)
+
+    # Block until the breaker is closed, heartbeating so the supervisor does not take the wait for a hang
+    def wait(self):
+        remaining = self.pause_remaining()
+        if remaining > 0:
+            logger.info(f"Circuit breaker open, waiting {remaining:.0f} seconds")
+            with get_metrics().timer("circuit_breaker_wait"):
+                deadline = time.time() + remaining
+                while time.time() < deadline:
+                    heartbeat()
+                    time.sleep(max(0.0, min(HEARTBEAT_INTERVAL, deadline - time.time())))
@@ -1,7 +1,6 @@
-import requests
 import pandas as pd
-import time
 from dotenv import dotenv_values
+from places_api import PlacesClient, SearchEngine, ResponseCache, UniquePlaceWriter, QuadtreeSubdivider, make_cells, cell_task
 
 config = dotenv_values(".env")
 # Google API Key
@@ -15,74 +14,73 @@ bounds = {
     "west": 121.380,  # 西邊界
 }
 
-
-radius = 500  # 每次查詢的半徑 (單位: 公尺)
 PLACES_API_URL = config["PLACES_API_URL"]
 
+# 並行查詢設定
+qps = float(config.get("PLACES_QPS", 10))  # 全域每秒請求數上限
+max_workers = 8  # 同時進行的請求數
+
+# 查詢結果快取：中斷後重跑會從快取接續，調整 bounds/place_types 也只查詢新的部分
+cache_file = config.get("PLACES_CACHE", "places_cache.sqlite")
+cache_ttl_days = float(config.get("PLACES_CACHE_TTL_DAYS", 30))
+
 # 要查詢的地點類型
 place_types = [
     "art_gallery", "tourist_attraction", "school", "market", "store", "library", "park", "gym", "night_club"
 ]
 
-# 儲存結果
-results = []
-
-step = 0.01  
-grid = []
-lat = bounds["south"]
-while lat <= bounds["north"]:
-    lng = bounds["west"]
-    while lng <= bounds["east"]:
-        grid.append({"lat": lat, "lng": lng})
-        lng += step
-    lat += step
-
-# 查詢單個網格點，處理分頁
-def fetch_places(location, place_type):
-    next_page_token = None
-    while True:
-        params = {
-            "location": f"{location['lat']},{location['lng']}",
-            "radius": radius,
-            "type": place_type,
-            "key": API_KEY,
-        }
-        if next_page_token:
-            params["pagetoken"] = next_page_token
-
-        response = requests.get(PLACES_API_URL, params=params)
-        data = response.json()
-
-        # 儲存結果
-        for place in data.get("results", []):
-            results.append({
-                "名稱": place.get("name"),
-                "地址": place.get("vicinity"),
-                "評分": place.get("rating"),
-                "評論數": place.get("user_ratings_total"),
-                "Place ID": place.get("place_id"),
-                "類型": place_type,
-                "經度": place["geometry"]["location"]["lng"],
-                "緯度": place["geometry"]["location"]["lat"],
-            })
+# 輸出設定：不重複的地點邊查詢邊附加寫入 output_file（.csv 或 .jsonl），
+# 全部完成後可選擇另外匯出 Excel
+output_file = "完整_台北_新北_地點清單.csv"
+export_excel = True
+excel_file = "完整_台北_新北_地點清單.xlsx"
+fieldnames = ["名稱", "地址", "評分", "評論數", "Place ID", "類型", "經度", "緯度"]
 
-        # 檢查是否有下一頁
-        next_page_token = data.get("next_page_token")
-        if not next_page_token:
-            break
+# 自適應網格：先以粗網格查詢，只有結果達到 60 筆上限的網格才切成四塊再查，
+# 查詢半徑依網格大小計算（半對角線）
+initial_step = 0.04  # 初始網格大小 (單位: 度)
+max_depth = 6  # 最多細分層數，0.04° 細分 6 層約為 0.000625°
+cells = make_cells(bounds, initial_step)
 
-        # 分頁查詢需要延遲
-        time.sleep(2)
+# 儲存單頁查詢結果（去重後寫入）
+def on_page(task, data):
+    rows = []
+    for place in data.get("results", []):
+        rows.append({
+            "名稱": place.get("name"),
+            "地址": place.get("vicinity"),
+            "評分": place.get("rating"),
+            "評論數": place.get("user_ratings_total"),
+            "Place ID": place.get("place_id"),
+            "類型": task["type"],
+            "經度": place["geometry"]["location"]["lng"],
+            "緯度": place["geometry"]["location"]["lat"],
+        })
+    writer.add(rows)
 
-# 查詢所有網格點和類型
-for place_type in place_types:
-    for i, loc in enumerate(grid):
-        print(f"正在查詢類型 {place_type}，網格點 {i + 1}/{len(grid)}: {loc}")
-        fetch_places(loc, place_type)
+# 查詢所有初始網格和類型，分頁與細分後的查詢由引擎排程
+tasks = [cell_task(cell, place_type) for place_type in place_types for cell in cells]
+print(f"共 {len(tasks)} 個初始查詢任務（{len(place_types)} 種類型 × {len(cells)} 個網格）")
+cache = ResponseCache(cache_file, ttl_days=cache_ttl_days)
+client = PlacesClient(PLACES_API_URL, API_KEY, qps=qps, pool_size=max_workers, cache=cache)
+subdivider = QuadtreeSubdivider(max_depth=max_depth)
+writer = UniquePlaceWriter(output_file, fieldnames)
+try:
+    SearchEngine(client, max_workers=max_workers).run(tasks, on_page, on_task_done=subdivider)
+finally:
+    client.close()
+    cache.close()
+    writer.close()
 
-# 去重處理
-df = pd.DataFrame(results).drop_duplicates(subset=["Place ID"])
+unique_places = len(writer.seen)
+print(f"API 呼叫 {client.calls} 次（快取命中 {cache.hits} 次），找到 {unique_places} 個不重複地點"
+      f"（略過 {writer.duplicates} 筆重複），細分 {subdivider.split} 個網格")
+print(f"資料已儲存至 {output_file}")
+if subdivider.truncated:
+    print(f"警告：{subdivider.truncated} 個網格在最大深度仍達 60 筆上限，可能有遺漏")
 
-# 將結果輸出為 Excel
-df.to_excel("完整_台北_新北_地點清單.xlsx", index=False)
-print("資料已儲存至 完整_台北_新北_地點清單.xlsx")
+# 將結果輸出為 Excel（選用）
+if export_excel:
+    df = pd.read_csv(output_file) if output_file.endswith(".csv") else pd.read_json(output_file, lines=True)
+    df.to_excel(excel_file, index=False)
+    print(f"資料已儲存至 {excel_file}")
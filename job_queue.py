@@ -0,0 +1,241 @@
+import os
+import time
+import queue
+import logging
+from collections import deque
+from multiprocessing import Array, Process, Queue
+from metrics import get_metrics, reset_snapshots, export_metrics
+from process_guard import start_run, kill_tree, kill_run_processes
+
+logger = logging.getLogger(__name__)
+
+# A worker with a job in flight that sends no heartbeat for this many seconds is killed and replaced
+HEARTBEAT_TIMEOUT = float(os.environ.get("SCRAPER_HEARTBEAT_TIMEOUT", 300))
+HEARTBEAT_INTERVAL = 5
+
+_last_progress = time.time()
+_heartbeats = None
+_slot = None
+
+# Report that the current worker is still making progress (a page loaded, reviews scrolled).
+# The time goes into this worker's slot of an array shared with the supervisor, so it is cheap
+# enough to call from inner loops and does not depend on the result queue being drained
+def heartbeat():
+    global _last_progress
+    _last_progress = time.time()
+    if _heartbeats is not None:
+        _heartbeats[_slot] = _last_progress
+
+# Seconds since the current worker last reported progress
+def progress_age():
+    return time.time() - _last_progress
+
+# Build jobs from input rows; with a cost column the biggest jobs go first,
+# otherwise jobs are yielded lazily in input order
+def build_jobs(rows, cost_column=None):
+    if cost_column is None:
+        return ({"place_id": row['Place ID'], "cost": 0} for row in rows if row['Place ID'])
+
+    jobs = []
+    for row in rows:
+        place_id = row['Place ID']
+        if not place_id:
+            continue
+        try:
+            cost = float(row.get(cost_column) or 0)
+            if cost != cost:  # NaN
+                cost = 0
+        except (TypeError, ValueError):
+            cost = 0
+        jobs.append({"place_id": place_id, "cost": cost})
+
+    jobs.sort(key=lambda job: job["cost"], reverse=True)
+    if jobs:
+        logger.info(f"Jobs ordered by {cost_column}, largest: {jobs[0]['cost']:.0f}")
+    return jobs
+
+# Worker process entry point: attach the worker to its heartbeat slot, then run the worker target
+def _run_worker(worker_target, heartbeats, slot, job_queue, result_queue, *worker_args):
+    global _heartbeats, _slot
+    _heartbeats, _slot = heartbeats, slot
+    worker_target(job_queue, result_queue, *worker_args)
+
+# Pull jobs one at a time from this worker's job queue, reporting busy time back to the parent
+# and periodically dumping this worker's metrics snapshot
+def iter_jobs(job_queue, result_queue):
+    pid = os.getpid()
+    metrics = get_metrics()
+    heartbeat()
+    result_queue.put(("worker_start", pid, None, time.time()))
+    try:
+        while True:
+            job = job_queue.get()
+            if job is None:
+                break
+            heartbeat()
+            started = time.time()
+            yield job
+            elapsed = time.time() - started
+            heartbeat()
+            result_queue.put(("job_done", pid, job["place_id"], elapsed))
+            metrics.observe("scraper_job_seconds", elapsed)
+            metrics.maybe_dump()
+    finally:
+        result_queue.put(("worker_end", pid, None, time.time()))
+
+# Log per-worker utilisation so we can see how balanced the run was
+def report_utilisation(stats, wall_time):
+    logger.info(f"Run finished in {wall_time:.1f} seconds")
+    logger.info(f"{'Worker':>10} {'Jobs':>6} {'Busy(s)':>10} {'Alive(s)':>10} {'Util':>7}")
+    total_busy = 0
+    for pid, s in sorted(stats.items()):
+        alive = (s["end"] or time.time()) - s["start"]
+        utilisation = s["busy"] / wall_time if wall_time > 0 else 0
+        total_busy += s["busy"]
+        logger.info(f"{pid:>10} {s['jobs']:>6} {s['busy']:>10.1f} {alive:>10.1f} {utilisation:>6.1%}")
+    if stats and wall_time > 0:
+        logger.info(f"Average utilisation: {total_busy / (wall_time * len(stats)):.1%}")
+
+# Run worker processes that are handed jobs one at a time until all jobs are processed;
+# jobs may be a list or a lazy iterator, workers start before the jobs are read.
+# retry_source() returns (retry jobs that came due, time of the next one or None); due retries
+# are fed at the end of the queue and the run waits for scheduled ones before stopping.
+# Workers report liveness through a shared per-worker heartbeat time. A worker that dies, or stops
+# heartbeating mid-job, is killed with its browsers and replaced; its job is queued once more, then
+# dropped. Workers that die before their first heartbeat are not replaced, as a failing startup
+# would only repeat. Browsers still tagged with this run are stopped at the end.
+# Worker metrics snapshots are merged and exported when the run ends
+def run_job_queue(jobs, worker_target, worker_args, num_processes, retry_source=None,
+                  heartbeat_timeout=HEARTBEAT_TIMEOUT):
+    if isinstance(jobs, list):
+        if not jobs:
+            logger.info("No jobs to run")
+            return {}
+        num_processes = min(num_processes, len(jobs))
+    num_workers = max(1, num_processes)
+
+    start_run()
+    result_queue = Queue()
+    heartbeats = Array("d", num_workers, lock=False)
+    reset_snapshots()
+
+    # Slot i runs processes[i], which reads jobs from its own inboxes[i] and heartbeats into
+    # heartbeats[i] (0 until its first heartbeat). A worker killed while waiting on a shared queue
+    # would leave the queue's lock held, so each worker's queue is dropped along with it
+    def start_worker(slot):
+        heartbeats[slot] = 0
+        inboxes[slot] = Queue()
+        p = Process(target=_run_worker, args=(worker_target, heartbeats, slot, inboxes[slot], result_queue,
+                                              *worker_args))
+        p.start()
+        spawned[slot] = time.time()
+        slots[p.pid] = slot
+        processes[slot] = p
+
+    run_start = time.time()
+    processes = [None] * num_workers
+    inboxes = [None] * num_workers
+    spawned = [run_start] * num_workers
+    slots = {}
+    for slot in range(num_workers):
+        start_worker(slot)
+
+    pending = deque(jobs)
+    logger.info(f"Started {num_workers} workers for {len(pending)} jobs")
+
+    stats = {}
+    in_flight = [None] * num_workers
+    hung_jobs = set()
+    retry_at = None
+    next_retry_check = 0
+    while True:
+        # Feed retries when they come due, checking right away once the queue runs dry
+        if retry_source is not None and ((not pending and not any(in_flight)) or time.time() >= next_retry_check):
+            due, retry_at = retry_source()
+            pending.extend(due)
+            next_retry_check = time.time() + 5
+        if not pending and not any(in_flight):
+            if retry_at is None:
+                break
+            time.sleep(min(5, max(0.0, retry_at - time.time())))
+            continue
+
+        # Kill and replace workers that died, or hung with a job in flight
+        for slot, p in enumerate(processes):
+            if p is None:
+                continue
+            job = in_flight[slot]
+            silent = time.time() - max(heartbeats[slot], spawned[slot])
+            if p.is_alive() and (job is None or silent < heartbeat_timeout):
+                continue
+            in_flight[slot] = None
+            del slots[p.pid]
+            if not p.is_alive() and not heartbeats[slot]:
+                logger.error(f"Worker {p.pid} exited during startup (exit code {p.exitcode}), not replacing it")
+                processes[slot] = None
+                if job is not None:
+                    pending.appendleft(job)
+                continue
+            reason = f"silent for {silent:.0f} seconds" if p.is_alive() else f"exit code {p.exitcode}"
+            task = f"on Place ID {job['place_id']}" if job else "while idle"
+            logger.error(f"Worker {p.pid} stopped {task} ({reason}), replacing it")
+            get_metrics().inc("scraper_worker_killed_total")
+            kill_tree(p.pid)
+            p.join(timeout=5)
+            if p.pid in stats:
+                stats[p.pid]["end"] = time.time()
+            if job is not None and job['place_id'] in hung_jobs:
+                logger.error(f"Place ID {job['place_id']} stalled a worker twice, dropping it from this run")
+            elif job is not None:
+                hung_jobs.add(job['place_id'])
+                pending.append(job)
+            start_worker(slot)
+
+        if not any(processes):
+            logger.error(f"All workers exited with {len(pending)} jobs unfinished")
+            break
+
+        # Hand each idle worker its next job
+        for slot, p in enumerate(processes):
+            if p is not None and in_flight[slot] is None and pending:
+                in_flight[slot] = pending.popleft()
+                inboxes[slot].put(in_flight[slot])
+
+        try:
+            kind, pid, place_id, value = result_queue.get(timeout=5)
+        except queue.Empty:
+            continue
+
+        s = stats.setdefault(pid, {"jobs": 0, "busy": 0.0, "start": run_start, "end": None})
+        if kind == "worker_start":
+            s["start"] = value
+        elif kind == "job_done":
+            s["jobs"] += 1
+            s["busy"] += value
+            # A replaced worker's job was queued again and is settled by that copy
+            slot = slots.get(pid)
+            if slot is not None and in_flight[slot] is not None and in_flight[slot]['place_id'] == place_id:
+                in_flight[slot] = None
+        elif kind == "worker_end":
+            s["end"] = value
+
+    # Tell every worker to stop, draining their final messages while they exit
+    workers = [p for p in processes if p is not None]
+    for slot, p in enumerate(processes):
+        if p is not None:
+            inboxes[slot].put(None)
+    while any(p.is_alive() for p in workers) or not result_queue.empty():
+        try:
+            kind, pid, place_id, value = result_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        if kind == "worker_end" and pid in stats:
+            stats[pid]["end"] = value
+    for p in workers:
+        p.join()
+    kill_run_processes()
+
+    report_utilisation(stats, time.time() - run_start)
+    prom_path, json_path = export_metrics()
+    logger.info(f"Metrics exported to {prom_path} and {json_path}")
+    return stats
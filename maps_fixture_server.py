@@ -0,0 +1,271 @@
+import json
+import time
+import html
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# Local stand-in for Google Maps place pages, used by benchmark.py. Pages reproduce the DOM the
+# scrapers rely on (QA0Szd panel, DkEaL type button, ZQ6we/hpLkke attribute lists, jftiEf review
+# cards with wiI7pd/rsqaWe spans and infinite scroll). Point the scrapers at it with
+# SCRAPER_PLACE_URL=http://127.0.0.1:8766/maps/place/?q=place_id:{place_id}
+
+REVIEW_BATCH = 10
+CHECK_MARK = "\ue5ca"
+CROSS_MARK = "\ue033"
+SECTION_ITEMS = {
+    "無障礙程度": ["無障礙入口", "無障礙座位", "無障礙停車場"],
+    "服務項目": ["外帶", "內用", "外送"],
+    "產品/服務": ["咖啡", "素食", "酒精飲料"],
+    "用餐選擇": ["午餐", "晚餐", "甜點"],
+    "設施": ["無線網路", "洗手間"],
+    "客層族群": ["適合家庭", "適合團體"],
+    "氛圍": ["輕鬆", "舒適"],
+    "付款方式": ["信用卡", "行動支付", "現金"],
+    "兒童": ["適合兒童", "兒童座椅"],
+    "停車場": ["付費停車場", "路邊停車"],
+}
+DAYS = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
+AGES = [("天前", 1, 6), ("週前", 1, 3), ("個月前", 1, 11), ("年前", 1, 5)]
+
+# Deterministic fake place for a Place ID
+def generate_place(place_id, review_count):
+    rng = random.Random(hashlib.md5(place_id.encode("utf-8")).hexdigest())
+    reviews = []
+    for i in range(review_count):
+        unit, low, high = AGES[min(len(AGES) - 1, i * len(AGES) // max(review_count, 1))]
+        sentences = rng.randint(1, 6)
+        reviews.append({
+            "author": f"評論者 {rng.randint(1, 99999)}",
+            "text": " ".join(f"{place_id} 第 {i + 1} 則評論的第 {j + 1} 句。" for j in range(sentences)),
+            "date": f"{rng.randint(low, high)} {unit}",
+        })
+    opens = rng.choice(["09:00", "10:00", "11:00"])
+    closes = rng.choice(["20:00", "21:00", "22:00"])
+    return {
+        "name": f"測試地點 {place_id}",
+        "rating": f"{rng.uniform(3.0, 5.0):.1f}",
+        "type": rng.choice(["餐廳", "咖啡廳", "博物館", "公園"]),
+        "address": f"台北市測試路 {rng.randint(1, 500)} 號",
+        "avg_cost": rng.choice(["$200-400", "$400-600", "$1-200"]),
+        "phone": f"02 {rng.randint(1000, 9999)} {rng.randint(1000, 9999)}",
+        "hours": "; ".join(f"{day}、{opens}到{closes}" for day in DAYS) + "; 隱藏本週營業時間",
+        "intro": f"{place_id} 的簡介文字。",
+        "sections": {label: [(item, rng.random() < 0.7) for item in items] for label, items in SECTION_ITEMS.items()},
+        "reviews": reviews,
+    }
+
+# Panel script: hours and intro buttons reveal their content, the reviews tab loads cards in
+# batches from /reviews whenever the list is scrolled to the bottom, and the sort menu reloads newest first
+PAGE_SCRIPT = """
+var placeId = document.body.getAttribute('data-place-id');
+var scroller = document.getElementById('scroller');
+var reviewList = null, offset = 0, ended = false, loading = false, sort = 'relevant';
+
+// Content behind a button is only added to the DOM once it is clicked, as on the real page
+function reveal(templateId, parent, before) {
+    var template = document.getElementById(templateId);
+    if (!template) return;
+    setTimeout(function () {
+        parent.insertBefore(template.content.cloneNode(true), before || null);
+        template.remove();
+    }, 50);
+}
+document.getElementById('hours-button').addEventListener('click', function () {
+    var button = document.getElementById('hours-button');
+    reveal('hours-template', button.parentNode, button.nextSibling);
+});
+document.getElementById('intro-button').addEventListener('click', function () {
+    reveal('intro-template', scroller, scroller.children[1]);
+});
+
+function loadReviews() {
+    if (loading || ended || !reviewList) return;
+    loading = true;
+    fetch('/reviews?place_id=' + encodeURIComponent(placeId) + '&offset=' + offset + '&sort=' + sort)
+        .then(function (r) { return r.json(); })
+        .then(function (data) {
+            data.reviews.forEach(function (review) {
+                var card = document.createElement('div');
+                card.className = 'jftiEf fontBodyMedium';
+                card.style.minHeight = '80px';
+                card.innerHTML = '<div class="d4r55"></div><span class="rsqaWe"></span>' +
+                    '<div class="MyEned"><span class="wiI7pd"></span></div>';
+                card.querySelector('.d4r55').textContent = review.author;
+                card.querySelector('.rsqaWe').textContent = review.date;
+                card.querySelector('.wiI7pd').textContent = review.text;
+                reviewList.appendChild(card);
+            });
+            offset += data.reviews.length;
+            ended = !data.more;
+            loading = false;
+        });
+}
+
+function openReviews() {
+    if (reviewList) reviewList.remove();
+    reviewList = document.createElement('div');
+    scroller.appendChild(reviewList);
+    offset = 0; ended = false;
+    loadReviews();
+}
+
+document.getElementById('reviews-button').addEventListener('click', openReviews);
+document.getElementById('sort-button').addEventListener('click', function () {
+    document.getElementById('sort-menu').hidden = false;
+});
+document.getElementById('sort-newest').addEventListener('click', function () {
+    document.getElementById('sort-menu').hidden = true;
+    sort = 'newest';
+    openReviews();
+});
+setInterval(function () {
+    if (scroller.scrollTop + scroller.clientHeight >= scroller.scrollHeight - 10) loadReviews();
+}, 100);
+"""
+
+# Render a place page; the nesting mirrors the absolute XPaths in multi_element_scraper.XPATHS
+def render_place(place_id, place):
+    e = html.escape
+    hours = f'<template id="hours-template"><div aria-label="{e(place["hours"])}"><table></table></div></template>'
+    sections = "".join(
+        f'<h2>{e(label)}</h2><ul class="ZQ6we">' +
+        "".join(f'<li class="hpLkke"><span>{CHECK_MARK if checked else CROSS_MARK}</span><span>{e(item)}</span></li>'
+                for item, checked in items) +
+        "</ul>"
+        for label, items in place["sections"].items())
+    return f"""<!DOCTYPE html>
+<html lang="zh-TW"><head><meta charset="utf-8"><title>{e(place["name"])} - Google 地圖</title></head>
+<body data-place-id="{e(place_id)}">
+<div id="QA0Szd"><div><div><div>
+  <div></div>
+  <div><div><div><div><div>
+    <div></div>
+    <div id="scroller" style="height:600px; overflow-y:auto">
+      <div>
+        <div>
+          <div><h1>{e(place["name"])}</h1></div>
+          <div><div><div>
+            <div></div>
+            <div><span><span>{e(place["rating"])}</span></span></div>
+            <span><span><span><span></span><span><span><span>{e(place["avg_cost"])}</span></span></span></span></span></span>
+          </div></div></div>
+        </div>
+        <div role="tablist">
+          <button role="tab"><div>總覽</div></button>
+          <button role="tab" id="reviews-button"><div>評論</div></button>
+          <button role="tab" id="intro-button" aria-label="關於{e(place["name"])}的簡介"><div>簡介</div></button>
+        </div>
+        <button class="DkEaL">{e(place["type"])}</button>
+        <button aria-label="地址: {e(place["address"])}"><div>{e(place["address"])}</div></button>
+        <button aria-label="電話號碼: {e(place["phone"])}"><div>{e(place["phone"])}</div></button>
+        <div class="OqCZI fontBodyMedium WVXvdc" id="hours-button"><span>營業中</span></div>
+        {hours}
+        <button aria-label="排序評論" id="sort-button"><span>排序</span></button>
+        <div role="menu" id="sort-menu" hidden>
+          <div role="menuitemradio"><div>最相關</div></div>
+          <div role="menuitemradio" id="sort-newest"><div>最新</div></div>
+        </div>
+      </div>
+    </div>
+    <template id="intro-template"><div><p><span><span>{e(place["intro"])}</span></span></p>{sections}</div></template>
+  </div></div></div></div></div>
+</div></div></div></div>
+<script>{PAGE_SCRIPT}</script>
+</body></html>"""
+
+class MapsFixture:
+    def __init__(self, review_count=(20, 200), page_latency=0.3, review_latency=0.15, seed=42):
+        self.review_count = review_count
+        self.page_latency = page_latency
+        self.review_latency = review_latency
+        self.seed = seed
+        self.places = {}
+        self.lock = threading.Lock()
+        self.page_views = 0
+        self.review_requests = 0
+
+    # Fake place for a Place ID, generated on first use
+    def get_place(self, place_id):
+        with self.lock:
+            if place_id not in self.places:
+                low, high = self.review_count
+                count = random.Random(f"{self.seed}:{place_id}").randint(low, high)
+                self.places[place_id] = generate_place(place_id, count)
+            return self.places[place_id]
+
+    # Latency with +-30% jitter so workers do not run in lockstep
+    def _sleep(self, latency):
+        if latency:
+            time.sleep(latency * random.uniform(0.7, 1.3))
+
+    def page(self, place_id):
+        self._sleep(self.page_latency)
+        with self.lock:
+            self.page_views += 1
+        return render_place(place_id, self.get_place(place_id))
+
+    def reviews(self, place_id, offset, sort):
+        self._sleep(self.review_latency)
+        with self.lock:
+            self.review_requests += 1
+        reviews = self.get_place(place_id)["reviews"]
+        if sort != "newest":
+            reviews = sorted(reviews, key=lambda review: hashlib.md5(review["text"].encode("utf-8")).hexdigest())
+        batch = reviews[offset:offset + REVIEW_BATCH]
+        return {"reviews": batch, "more": offset + REVIEW_BATCH < len(reviews)}
+
+def make_handler(fixture):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            if url.path.startswith("/maps/place") and params.get("q", "").startswith("place_id:"):
+                body = fixture.page(params["q"][len("place_id:"):]).encode("utf-8")
+                content_type = "text/html; charset=utf-8"
+            elif url.path == "/reviews" and "place_id" in params:
+                data = fixture.reviews(params["place_id"], int(params.get("offset", 0)), params.get("sort"))
+                body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+                content_type = "application/json; charset=utf-8"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.send_header("Cache-Control", "no-store")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+# Start the fixture server in a background thread and return (server, place URL template)
+def start_server(port=0, review_count=(20, 200), page_latency=0.3, review_latency=0.15, seed=42):
+    fixture = MapsFixture(review_count, page_latency, review_latency, seed)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fixture))
+    server.daemon_threads = True
+    server.fixture = fixture
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/maps/place/?q=place_id:{{place_id}}"
+    return server, url
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Google Maps place page fixture")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--min-reviews", type=int, default=20)
+    parser.add_argument("--max-reviews", type=int, default=200)
+    parser.add_argument("--page-latency", type=float, default=0.3, help="Seconds before a place page is served")
+    parser.add_argument("--review-latency", type=float, default=0.15, help="Seconds before a review batch is served")
+    args = parser.parse_args()
+
+    server, url = start_server(args.port, (args.min_reviews, args.max_reviews), args.page_latency, args.review_latency)
+    print(f"Maps fixture running, set SCRAPER_PLACE_URL={url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,232 @@
+import os
+import glob
+import json
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+# Per-process stage timings and counters. Each worker dumps a snapshot to
+# SCRAPER_METRICS_DIR/worker-{pid}.json; the parent merges them and exports
+# a Prometheus textfile and a JSON snapshot.
+
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+LOG_FORMAT = "%(asctime)s %(processName)s %(levelname)s %(name)s: %(message)s"
+
+# Leveled logging for all scraper modules, SCRAPER_LOG_LEVEL=DEBUG shows per-field details
+def setup_logging(level=None):
+    level = level or os.environ.get("SCRAPER_LOG_LEVEL", "INFO")
+    logging.basicConfig(level=level.upper(), format=LOG_FORMAT)
+
+def metrics_dir():
+    return os.environ.get("SCRAPER_METRICS_DIR", "metrics")
+
+# Label dict as a stable, hashable key
+def label_key(labels):
+    return tuple(sorted(labels.items()))
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    # Upper bucket bound below which the given share of observations fall
+    def quantile(self, q):
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets + [float("inf")], self.counts):
+            seen += count
+            if seen >= target and count:
+                return bound
+        return None
+
+    def to_dict(self):
+        return {"buckets": self.buckets, "counts": self.counts, "sum": self.sum, "count": self.count}
+
+    @classmethod
+    def from_dict(cls, data):
+        histogram = cls(data["buckets"])
+        histogram.counts = list(data["counts"])
+        histogram.sum = data["sum"]
+        histogram.count = data["count"]
+        return histogram
+
+    def merge(self, other):
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+class Metrics:
+    def __init__(self, dump_interval=30):
+        self.histograms = {}
+        self.counters = {}
+        self.dump_interval = dump_interval
+        self.last_dump = time.time()
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def observe(self, name, seconds, **labels):
+        with self.lock:
+            key = (name, label_key(labels))
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        with self.lock:
+            key = (name, label_key(labels))
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    # Time a block into the stage histogram
+    @contextmanager
+    def timer(self, stage, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe("scraper_stage_seconds", time.perf_counter() - start, stage=stage, **labels)
+
+    # Time a field extraction and count it as a success, or a failure if the block raises
+    @contextmanager
+    def field(self, field, method="elements"):
+        start = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("scraper_field_total", field=field, method=method, result="failure")
+            raise
+        finally:
+            self.observe("scraper_field_seconds", time.perf_counter() - start, field=field, method=method)
+        self.inc("scraper_field_total", field=field, method=method, result="success")
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "histograms": [{"name": name, "labels": dict(labels), **histogram.to_dict()}
+                               for (name, labels), histogram in self.histograms.items()],
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in self.counters.items()],
+            }
+
+    # Write this process's snapshot atomically
+    def dump(self, directory=None):
+        directory = directory or metrics_dir()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"worker-{os.getpid()}.json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        self.last_dump = time.time()
+
+    def maybe_dump(self, directory=None):
+        if time.time() - self.last_dump >= self.dump_interval:
+            self.dump(directory)
+
+_metrics = None
+
+# Metrics registry of the current process; a forked worker starts with an empty one
+def get_metrics():
+    global _metrics
+    if _metrics is None or _metrics.pid != os.getpid():
+        _metrics = Metrics()
+    return _metrics
+
+# Remove worker snapshots left by a previous run
+def reset_snapshots(directory=None):
+    for path in glob.glob(os.path.join(directory or metrics_dir(), "worker-*.json")):
+        os.remove(path)
+
+# Merge every worker snapshot in a directory into one snapshot
+def merge_snapshots(directory=None):
+    histograms = {}
+    counters = {}
+    for path in glob.glob(os.path.join(directory or metrics_dir(), "worker-*.json")):
+        with open(path, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        for item in snapshot["histograms"]:
+            key = (item["name"], label_key(item["labels"]))
+            histogram = Histogram.from_dict(item)
+            if key in histograms:
+                histograms[key].merge(histogram)
+            else:
+                histograms[key] = histogram
+        for item in snapshot["counters"]:
+            key = (item["name"], label_key(item["labels"]))
+            counters[key] = counters.get(key, 0) + item["value"]
+    return histograms, counters
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{str(v)}"' for k, v in pairs) + "}"
+
+# Prometheus text exposition format, for node_exporter's textfile collector
+def to_prometheus(histograms, counters):
+    lines = []
+    for name in sorted({name for name, _ in histograms}):
+        lines.append(f"# TYPE {name} histogram")
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f"{name}_bucket{format_labels(labels, [('le', bound)])} {cumulative}")
+            lines.append(f"{name}_bucket{format_labels(labels, [('le', '+Inf')])} {histogram.count}")
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram.count}")
+    for name in sorted({name for name, _ in counters}):
+        lines.append(f"# TYPE {name} counter")
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f"{name}{format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+# Merge worker snapshots and write metrics.prom and metrics.json next to them
+def export_metrics(directory=None):
+    directory = directory or metrics_dir()
+    histograms, counters = merge_snapshots(directory)
+    os.makedirs(directory, exist_ok=True)
+
+    prom_path = os.path.join(directory, "metrics.prom")
+    with open(prom_path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(to_prometheus(histograms, counters))
+    os.replace(prom_path + ".tmp", prom_path)
+
+    json_path = os.path.join(directory, "metrics.json")
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "histograms": [{"name": name, "labels": dict(labels), **h.to_dict(),
+                            "mean": h.sum / h.count if h.count else None, "p95": h.quantile(0.95)}
+                           for (name, labels), h in sorted(histograms.items())],
+            "counters": [{"name": name, "labels": dict(labels), "value": value}
+                         for (name, labels), value in sorted(counters.items())],
+        }, f, ensure_ascii=False, indent=4)
+
+    log_summary(histograms)
+    return prom_path, json_path
+
+# Log the slowest stages and fields by total time
+def log_summary(histograms, top=15):
+    logger = logging.getLogger(__name__)
+    rows = sorted(histograms.items(), key=lambda item: item[1].sum, reverse=True)[:top]
+    if not rows:
+        return
+    logger.info(f"{'Metric':<48} {'Count':>7} {'Mean(s)':>8} {'p95<=':>7} {'Total(s)':>9}")
+    for (name, labels), h in rows:
+        label = ",".join(str(v) for _, v in labels)
+        logger.info(f"{name.replace('scraper_', '') + '[' + label + ']':<48} {h.count:>7} "
+                    f"{h.sum / h.count:>8.3f} {h.quantile(0.95):>7} {h.sum:>9.1f}")
@@ -0,0 +1,146 @@
+import json
+import math
+import time
+import random
+import argparse
+import threading
+import uuid
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+# 本機模擬 Places API Nearby Search，用於測試 grid-based search.py：
+# 將 .env 的 PLACES_API_URL 設為 http://127.0.0.1:8765/maps/api/place/nearbysearch/json
+
+PAGE_SIZE = 20
+MAX_RESULTS = 60
+CELL = 0.01
+
+# 兩點距離（公尺）
+def distance_m(lat1, lng1, lat2, lng2):
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 6371000 * 2 * math.asin(math.sqrt(a))
+
+# 產生固定種子的假地點：部分集中在幾個熱區，其餘平均散佈
+def generate_places(bounds, count, types, seed=42):
+    rng = random.Random(seed)
+    hotspots = [(rng.uniform(bounds["south"], bounds["north"]), rng.uniform(bounds["west"], bounds["east"]))
+                for _ in range(8)]
+    places = []
+    for i in range(count):
+        if rng.random() < 0.6:
+            center = rng.choice(hotspots)
+            lat, lng = rng.gauss(center[0], 0.01), rng.gauss(center[1], 0.01)
+        else:
+            lat, lng = rng.uniform(bounds["south"], bounds["north"]), rng.uniform(bounds["west"], bounds["east"])
+        places.append({
+            "name": f"模擬地點 {i}",
+            "vicinity": f"模擬路 {i} 號",
+            "rating": round(rng.uniform(2.5, 5.0), 1),
+            "user_ratings_total": int(rng.expovariate(1 / 200)),
+            "place_id": f"MOCK{i:07d}",
+            "types": [rng.choice(types)],
+            "geometry": {"location": {"lat": lat, "lng": lng}},
+        })
+    return places
+
+class MockPlaces:
+    def __init__(self, places, qps_limit=50, token_delay=1.5):
+        self.cells = {}
+        for place in places:
+            loc = place["geometry"]["location"]
+            self.cells.setdefault((int(loc["lat"] // CELL), int(loc["lng"] // CELL)), []).append(place)
+        self.qps_limit = qps_limit
+        self.token_delay = token_delay
+        self.tokens = {}
+        self.window = []
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    # 依半徑與類型找出最近的地點，最多 60 筆
+    def search(self, lat, lng, radius, place_type):
+        span = radius / 111000 + CELL
+        hits = []
+        for i in range(int((lat - span) // CELL), int((lat + span) // CELL) + 1):
+            for j in range(int((lng - span) // CELL), int((lng + span) // CELL) + 1):
+                for place in self.cells.get((i, j), []):
+                    if place_type and place_type not in place["types"]:
+                        continue
+                    loc = place["geometry"]["location"]
+                    d = distance_m(lat, lng, loc["lat"], loc["lng"])
+                    if d <= radius:
+                        hits.append((d, place))
+        hits.sort(key=lambda hit: hit[0])
+        return [place for _, place in hits[:MAX_RESULTS]]
+
+    # 模擬一次 API 呼叫
+    def handle(self, params):
+        now = time.monotonic()
+        with self.lock:
+            self.calls += 1
+            self.window = [t for t in self.window if now - t < 1.0]
+            if len(self.window) >= self.qps_limit:
+                return {"status": "OVER_QUERY_LIMIT", "results": []}
+            self.window.append(now)
+
+        if "pagetoken" in params:
+            with self.lock:
+                entry = self.tokens.get(params["pagetoken"])
+            if entry is None or now < entry["valid_after"]:
+                return {"status": "INVALID_REQUEST", "results": []}
+            hits, offset = entry["hits"], entry["offset"]
+        else:
+            lat, lng = (float(v) for v in params["location"].split(","))
+            hits = self.search(lat, lng, float(params.get("radius", 500)), params.get("type"))
+            offset = 0
+
+        page = hits[offset:offset + PAGE_SIZE]
+        data = {"status": "OK" if page else "ZERO_RESULTS", "results": page}
+        if offset + PAGE_SIZE < len(hits):
+            token = uuid.uuid4().hex
+            with self.lock:
+                self.tokens[token] = {"hits": hits, "offset": offset + PAGE_SIZE, "valid_after": now + self.token_delay}
+            data["next_page_token"] = token
+        return data
+
+def make_handler(mock):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            params = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+            body = json.dumps(mock.handle(params), ensure_ascii=False).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+    return Handler
+
+# 在背景執行緒啟動模擬伺服器，回傳 (server, url)
+def start_server(places, port=0, qps_limit=50, token_delay=1.5):
+    mock = MockPlaces(places, qps_limit, token_delay)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(mock))
+    server.mock = mock
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/maps/api/place/nearbysearch/json"
+    return server, url
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="本機模擬 Places API Nearby Search")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--places", type=int, default=20000)
+    parser.add_argument("--qps-limit", type=int, default=50)
+    parser.add_argument("--token-delay", type=float, default=1.5)
+    args = parser.parse_args()
+
+    bounds = {"north": 25.188, "south": 24.951, "east": 121.665, "west": 121.380}
+    types = ["art_gallery", "tourist_attraction", "school", "market", "store", "library", "park", "gym", "night_club"]
+    server, url = start_server(generate_places(bounds, args.places, types), args.port, args.qps_limit, args.token_delay)
+    print(f"模擬 Places API 已啟動：{url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
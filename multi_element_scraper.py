@@ -1,16 +1,25 @@
 import os
 import json
-import random
-import pandas as pd
 from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-import time
 import re
+import logging
+from resource_policy import default_policy, apply_to_options, apply_to_driver
+from place_source import iter_place_ids, resolve_input_file
+from crawl_state import CrawlState, migrate_progress_files
+from output_sink import default_sink, open_sink
+from pacing import open_page, page_failure, place_url, wait_for_present, wait_for_any
+from metrics import get_metrics, setup_logging, export_metrics
+from process_guard import ensure_run_id, apply_timeouts
+
+logger = logging.getLogger(__name__)
 
 # Initialize Selenium WebDriver
-def init_driver():
+def init_driver(resource_policy=None, performance_log=False):
+    resource_policy = resource_policy or default_policy()
+    ensure_run_id()  # Inherited by chromedriver and Chrome, so the run can find its own processes
     options = webdriver.ChromeOptions()
     options.add_argument("--headless")
     options.add_argument("--disable-gpu")
@@ -19,90 +28,84 @@ def init_driver():
     options.add_argument("--incognito")
     options.add_experimental_option("excludeSwitches", ["enable-automation"])
     options.add_experimental_option("useAutomationExtension", False)
-    return webdriver.Chrome(options=options)
-
-# Add random delay to avoid detection
-def random_delay(min_delay=3, max_delay=5):
-    delay = random.uniform(min_delay, max_delay)
-    time.sleep(delay)
+    apply_to_options(options, resource_policy, performance_log)
+    driver = webdriver.Chrome(options=options)
+    apply_timeouts(driver)
+    apply_to_driver(driver, resource_policy)
+    return driver
 
 # Wait for element to be present
 def wait_for_element(driver, xpath, timeout=20):
     return WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.XPATH, xpath)))
 
+# Checkmark / cross icons Google Maps renders in front of attribute items
+CHECK_MARK = "\ue5ca"
+CROSS_MARK = "\ue033"
+
+# Attribute sections listed on the introduction tab
+SECTIONS = [
+    "無障礙程度", "服務項目", "產品/服務", "用餐選擇", "設施",
+    "客層族群", "氛圍", "付款方式", "兒童", "停車場"
+]
+
+# Keep only items with a checkmark, logging the ones that are not provided
+def filter_checked_items(texts):
+    checked_items = []
+    for text in texts:
+        if CHECK_MARK in text:
+            clean_text = text.replace(CHECK_MARK, "").replace("\n", "").strip() #定位打勾元素
+            checked_items.append(clean_text)
+        else:
+            logger.debug(f"Not provided: {text.replace(CROSS_MARK, '')}") #不抓取叉叉元素
+    return checked_items
+
 # Extract checked items from specific sections
 def extract_checked_items_with_log(driver, label):
     try:
-        print(f"Detected【{label}】")
+        logger.debug(f"Detected【{label}】")
 
-        # Locate title area
-        title_xpath = f'//h2[contains(text(), "{label}")]'
-        title_element = driver.find_element(By.XPATH, title_xpath)
-        
-        # Locate parent container ul
-        ul_element = title_element.find_element(By.XPATH, './following-sibling::ul[contains(@class, "ZQ6we")]')
-        
-        # Locate all li child elements
-        items = ul_element.find_elements(By.XPATH, './/li[contains(@class, "hpLkke")]')
-
-        # Filter elements without checkmark
-        checked_items = []
-        for item in items:
-            if "" in item.text:
-                clean_text = item.text.replace("", "").replace("\n", "").strip() #定位打勾元素
-                checked_items.append(clean_text)
-            else:
-                print(f"Not provided: {item.text.replace('', '')}") #不抓取叉叉元素
+        with get_metrics().field(label):
+            # Locate title area
+            title_xpath = f'//h2[contains(text(), "{label}")]'
+            title_element = driver.find_element(By.XPATH, title_xpath)
+
+            # Locate parent container ul
+            ul_element = title_element.find_element(By.XPATH, './following-sibling::ul[contains(@class, "ZQ6we")]')
+
+            # Locate all li child elements
+            items = ul_element.find_elements(By.XPATH, './/li[contains(@class, "hpLkke")]')
+
+            # Filter elements without checkmark
+            checked_items = filter_checked_items([item.text for item in items])
         
         if checked_items:
-            print(f"Confirmed【{label}】: {', '.join(checked_items)}")
+            logger.debug(f"Confirmed【{label}】: {', '.join(checked_items)}")
             return checked_items
         else:
-            print("No checked elements")
+            logger.debug("No checked elements")
             return []
     except Exception:
-        print(f"{label} extraction failed")
+        logger.info(f"{label} extraction failed")
         return []
 
-# Save progress to JSON file
-def save_progress(place_id, pid, progress_file):
-    try:
-        if os.path.exists(progress_file):
-            with open(progress_file, "r", encoding="utf-8") as f:
-                crawled_ids = json.load(f)
-        else:
-            crawled_ids = []
-
-        if place_id not in crawled_ids:
-            crawled_ids.append(place_id)
-            with open(progress_file, "w", encoding="utf-8") as f:
-                json.dump(list(set(crawled_ids)), f, ensure_ascii=False, indent=4)
-            print(f"Process {pid} updated main record: {place_id}")
-    except Exception as e:
-        print(f"Failed to update progress file: {e}")
-        # Save to temporary file as backup
-        temp_file = f"temp_crawled_detail_{pid}.json"
-        try:
-            if os.path.exists(temp_file):
-                with open(temp_file, "r", encoding="utf-8") as f:
-                    temp_ids = json.load(f)
-            else:
-                temp_ids = []
-
-            if place_id not in temp_ids:
-                temp_ids.append(place_id)
-                with open(temp_file, "w", encoding="utf-8") as f:
-                    json.dump(temp_ids, f, ensure_ascii=False, indent=4)
-            print(f"Process {pid} updated temporary record: {place_id}")
-        except Exception as e:
-            print(f"Failed to update temporary record: {e}")
-
-# Main scraping function
-def scrape_store_data(driver, url, place_id):
-    driver.get(url)
-    random_delay()
-
-    store_data = {
+# XPaths of the fields on a place page
+XPATHS = {
+    "name": '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]/div/div[1]/div[1]/h1',
+    "rating": '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]/div/div[1]/div[2]/div/div[1]/div[2]/span[1]/span[1]',
+    "type": '//button[contains(@class, "DkEaL")]',
+    "address": '//button[contains(@aria-label, "地址")]',
+    "avg_cost": '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]/div/div[1]/div[2]/div/div[1]/span/span/span/span[2]/span/span',
+    "hours_button": '//div[contains(@class, "OqCZI fontBodyMedium WVXvdc")]',
+    "hours": '//div[contains(@aria-label, "星期一")]',
+    "phone": '//button[contains(@aria-label, "電話號碼")]',
+    "intro_button": '//button[contains(@aria-label, "簡介")]',
+    "intro": '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]/div[2]/p/span/span',
+    "section_list": '//ul[contains(@class, "ZQ6we")]',
+}
+
+# Empty record with every output field
+def new_store_data(place_id):
+    return {
         "店名": "",
         "Place ID": place_id,  
         "評分": "",
@@ -124,182 +127,370 @@ def scrape_store_data(driver, url, place_id):
         "停車場": [],
     }
 
+# Fields a scrape can be limited to; the name is always extracted since it tells whether the page loaded
+FIELDS = [field for field in new_store_data("") if field != "Place ID"]
+
+# Keys of the fields in the raw result of EXTRACT_STORE_DATA_JS (sections come back under "sections")
+RAW_KEYS = {"店名": "name", "評分": "rating", "種類": "type", "地址": "address", "平均每人消費": "avg_cost",
+            "電話": "phone", "開始營業時間": "hours", "簡介": "intro"}
+
+# The set of fields to scrape from a list or comma-separated string; None means every field
+def resolve_fields(fields=None):
+    if fields is None:
+        return set(FIELDS)
+    if isinstance(fields, str):
+        fields = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in fields if field not in FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)} ({', '.join(FIELDS)})")
+    return set(fields) | {"店名"}
+
+# Empty record whose fields outside the scraped ones carry over from the previously stored record
+def base_store_data(place_id, wanted, previous=None):
+    store_data = new_store_data(place_id)
+    for field in FIELDS:
+        if field not in wanted and previous and field in previous:
+            store_data[field] = previous[field]
+    return store_data
+
+# Turn the hours aria-label into {"星期一": "11:00~21:00", ...}
+def parse_business_hours(full_hours):
+    clean_hours = full_hours.strip().replace("隱藏本週營業時間", "").strip()
+    hours_dict = {}
+    for day_hours in clean_hours.split("; "):
+        day, time = day_hours.split("、", 1)
+        hours_dict[day] = time.replace("到", "~").strip()
+    return hours_dict
+
+# Extract the phone number from the phone button aria-label
+def parse_phone(label):
+    return label.split("電話號碼:")[-1].strip()
+
+# Runs inside the page: clicks the hours and intro buttons, waits for their content
+# and returns the requested fields as one JSON string, so extraction costs a single round trip.
+# A button is clicked only when a requested field needs it
+EXTRACT_STORE_DATA_JS = """
+var xp = arguments[0], sections = arguments[1], clickTimeout = arguments[2], want = {};
+arguments[3].forEach(function (key) { want[key] = true; });
+var done = arguments[arguments.length - 1];
+
+function first(path, ctx) {
+    return document.evaluate(path, ctx || document, null,
+        XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+}
+function all(path, ctx) {
+    var snap = document.evaluate(path, ctx || document, null,
+        XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+    var nodes = [];
+    for (var i = 0; i < snap.snapshotLength; i++) nodes.push(snap.snapshotItem(i));
+    return nodes;
+}
+function text(el) { return el ? (el.innerText || el.textContent || "").trim() : null; }
+function attr(el, name) { return el ? el.getAttribute(name) : null; }
+function waitFor(paths, callback) {
+    var start = Date.now();
+    (function poll() {
+        for (var i = 0; i < paths.length; i++) {
+            if (first(paths[i])) return callback();
+        }
+        if (Date.now() - start > clickTimeout) return callback();
+        setTimeout(poll, 100);
+    })();
+}
+function fail(e) { done(JSON.stringify({error: String(e)})); }
+
+var result = {name: text(first(xp.name))};
+["rating", "type", "address", "avg_cost"].forEach(function (key) {
+    if (want[key]) result[key] = text(first(xp[key]));
+});
+if (want.phone) result.phone = attr(first(xp.phone), "aria-label");
+
+function finish() {
+    try {
+        if (want.intro) result.intro = text(first(xp.intro));
+        result.sections = {};
+        sections.forEach(function (label) {
+            var title = first('//h2[contains(text(), "' + label + '")]');
+            var ul = title && first('./following-sibling::ul[contains(@class, "ZQ6we")]', title);
+            result.sections[label] = ul ?
+                all('.//li[contains(@class, "hpLkke")]', ul).map(function (li) { return li.innerText; }) : null;
+        });
+        done(JSON.stringify(result));
+    } catch (e) { fail(e); }
+}
+
+function afterHours() {
+    try {
+        if (want.hours) result.hours = attr(first(xp.hours), "aria-label");
+        if (!want.intro && !sections.length) return finish();
+        var introButton = first(xp.intro_button);
+        if (!introButton) return finish();
+        introButton.click();
+        waitFor([xp.intro, xp.section_list], finish);
+    } catch (e) { fail(e); }
+}
+
+try {
+    var hoursButton = want.hours && first(xp.hours_button);
+    if (hoursButton) {
+        hoursButton.click();
+        waitFor([xp.hours], afterHours);
+    } else {
+        afterHours();
+    }
+} catch (e) { fail(e); }
+"""
+
+# Arguments of EXTRACT_STORE_DATA_JS after the XPaths: the sections to read, the click timeout
+# in milliseconds and the raw keys of the other fields to read
+def extract_args(wanted, click_timeout=5):
+    return ([label for label in SECTIONS if label in wanted], int(click_timeout * 1000),
+            [key for field, key in RAW_KEYS.items() if field in wanted])
+
+# Extract the store_data dict with one execute_script call
+def extract_store_data_js(driver, place_id, click_timeout=5, wanted=None, previous=None):
+    wanted = wanted or resolve_fields()
+    with get_metrics().timer("extract_js"):
+        raw = json.loads(driver.execute_async_script(EXTRACT_STORE_DATA_JS, XPATHS, *extract_args(wanted, click_timeout)))
+    return store_data_from_raw(place_id, raw, wanted, previous)
+
+# Build the store_data dict from the fields EXTRACT_STORE_DATA_JS returned; fields outside
+# wanted carry over from previous
+def store_data_from_raw(place_id, raw, wanted=None, previous=None):
+    metrics = get_metrics()
+    wanted = wanted or resolve_fields()
+    store_data = base_store_data(place_id, wanted, previous)
+    if raw.get("error"):
+        logger.warning(f"Script extraction failed: {raw['error']}")
+        metrics.inc("scraper_field_total", field="all", method="js", result="failure")
+        return store_data
+
+    for field in ("店名", "評分", "種類", "平均每人消費", "簡介"):
+        if field in wanted:
+            store_data[field] = raw.get(RAW_KEYS[field]) or ""
+    if "地址" in wanted:
+        store_data["地址"] = (raw.get("address") or "").replace("\n", "")
+    if raw.get("phone"):
+        store_data["電話"] = parse_phone(raw["phone"])
+    if raw.get("hours"):
+        try:
+            store_data["開始營業時間"] = parse_business_hours(raw["hours"])
+        except Exception:
+            logger.info("Failed to extract business hours")
+
+    failed_sections = set()
+    for label in SECTIONS:
+        if label not in wanted:
+            continue
+        texts = (raw.get("sections") or {}).get(label)
+        if texts is None:
+            logger.info(f"{label} extraction failed")
+            failed_sections.add(label)
+            continue
+        store_data[label] = filter_checked_items(texts)
+
+    # Sections found without checked items still count as extracted
+    for field, value in store_data.items():
+        if field not in wanted:
+            continue
+        failed = field in failed_sections if field in SECTIONS else value in ("", {})
+        metrics.inc("scraper_field_total", field=field, method="js", result="failure" if failed else "success")
+
+    missing = [field for field, value in store_data.items() if field in wanted and value in ("", {}, [])]
+    logger.info(f"Extracted {store_data['店名']} in one script call, empty fields: {', '.join(missing) or 'none'}")
+    return store_data
+
+# Click the introduction tab and wait for its content
+def open_intro_tab(driver):
+    with get_metrics().timer("intro_click"):
+        intro_button = driver.find_element(By.XPATH, XPATHS["intro_button"])
+        driver.execute_script("arguments[0].click();", intro_button)
+        wait_for_any(driver, [XPATHS["intro"], XPATHS["section_list"]], timeout=5)
+
+# Main scraping function. fields limits the scrape to some fields (see resolve_fields): only the clicks
+# and lookups they need run, and the other fields carry over from previous, the stored record
+def scrape_store_data(driver, url, place_id, use_js=False, navigate=True, fields=None, previous=None):
+    metrics = get_metrics()
+    wanted = resolve_fields(fields)
+    store_data = base_store_data(place_id, wanted, previous)
+
+    # Navigate under the worker's rate limit and wait for the name to render,
+    # unless the caller already loaded the place page
+    if navigate and not open_page(driver, url, XPATHS["name"]):
+        logger.warning("Failed to extract name")
+        return store_data
+
+    if use_js:
+        try:
+            return extract_store_data_js(driver, place_id, wanted=wanted, previous=previous)
+        except Exception as e:
+            logger.warning(f"Error while scraping data: {e}")
+            return store_data
+
     try:
         # Extract name
         try:
-            name_xpath = '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]/div/div[1]/div[1]/h1'
-            store_name = wait_for_element(driver, name_xpath).text.strip()
+            with metrics.field("店名"):
+                store_name = wait_for_element(driver, XPATHS["name"]).text.strip()
             store_data["店名"] = store_name
-            print(f"Successfully extracted name: {store_name}")
+            logger.debug(f"Successfully extracted name: {store_name}")
         except Exception:
-            print("Failed to extract name")
+            logger.info("Failed to extract name")
 
         # Extract rating
-        try:
-            rating_xpath = '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]/div/div[1]/div[2]/div/div[1]/div[2]/span[1]/span[1]'
-            rating_element = driver.find_element(By.XPATH, rating_xpath)
-            store_data["評分"] = rating_element.text.strip()
-            print(f"Successfully extracted rating: {store_data['評分']}")
-        except Exception:
-            print("Failed to extract rating")
+        if "評分" in wanted:
+            try:
+                with metrics.field("評分"):
+                    rating_element = driver.find_element(By.XPATH, XPATHS["rating"])
+                    store_data["評分"] = rating_element.text.strip()
+                logger.debug(f"Successfully extracted rating: {store_data['評分']}")
+            except Exception:
+                logger.info("Failed to extract rating")
 
         # Extract type
-        try:
-            type_xpath = '//button[contains(@class, "DkEaL")]'
-            store_type = driver.find_element(By.XPATH, type_xpath).text.strip()
-            store_data["種類"] = store_type
-            print(f"Successfully extracted type: {store_type}")
-        except Exception:
-            print("Failed to extract type")
+        if "種類" in wanted:
+            try:
+                with metrics.field("種類"):
+                    store_type = driver.find_element(By.XPATH, XPATHS["type"]).text.strip()
+                store_data["種類"] = store_type
+                logger.debug(f"Successfully extracted type: {store_type}")
+            except Exception:
+                logger.info("Failed to extract type")
 
         # Extract address
-        try:
-            address_xpath = '//button[contains(@aria-label, "地址")]'
-            address = driver.find_element(By.XPATH, address_xpath).text.strip()
-            address = address.replace("\n", "")
-            store_data["地址"] = address
-            print(f"Successfully extracted address: {address}")
-        except Exception:
-            print("Failed to extract address")
+        if "地址" in wanted:
+            try:
+                with metrics.field("地址"):
+                    address = driver.find_element(By.XPATH, XPATHS["address"]).text.strip()
+                address = address.replace("\n", "")
+                store_data["地址"] = address
+                logger.debug(f"Successfully extracted address: {address}")
+            except Exception:
+                logger.info("Failed to extract address")
 
         # Extract average cost
-        try:
-            avg_xpath = '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]/div/div[1]/div[2]/div/div[1]/span/span/span/span[2]/span/span'
-            avg_cost = driver.find_element(By.XPATH, avg_xpath).text.strip()
-            store_data["平均每人消費"] = avg_cost
-            print(f"Successfully extracted average cost: {avg_cost}")
-        except Exception:
-            print("Failed to extract average cost")
+        if "平均每人消費" in wanted:
+            try:
+                with metrics.field("平均每人消費"):
+                    avg_cost = driver.find_element(By.XPATH, XPATHS["avg_cost"]).text.strip()
+                store_data["平均每人消費"] = avg_cost
+                logger.debug(f"Successfully extracted average cost: {avg_cost}")
+            except Exception:
+                logger.info("Failed to extract average cost")
 
         # Extract business hours
-        try:
-            hours_button_xpath = '//div[contains(@class, "OqCZI fontBodyMedium WVXvdc")]'
-            hours_button = driver.find_element(By.XPATH, hours_button_xpath)
-            driver.execute_script("arguments[0].click();", hours_button)
-            random_delay()
-            
-            hours_xpath = '//div[contains(@aria-label, "星期一")]'
-            hours_element = driver.find_element(By.XPATH, hours_xpath)
-            full_hours = hours_element.get_attribute("aria-label").strip()
-            clean_hours = full_hours.replace("隱藏本週營業時間", "").strip()
-            
-            hours_dict = {}
-            for day_hours in clean_hours.split("; "):
-                day, time = day_hours.split("、", 1)
-                hours_dict[day] = time.replace("到", "~").strip()
-            
-            store_data["開始營業時間"] = hours_dict
-            print(f"Successfully extracted business hours: {hours_dict}")
-        except Exception:
-            print("Failed to extract business hours")
+        if "開始營業時間" in wanted:
+            try:
+                with metrics.field("開始營業時間"):
+                    with metrics.timer("hours_click"):
+                        hours_button = driver.find_element(By.XPATH, XPATHS["hours_button"])
+                        driver.execute_script("arguments[0].click();", hours_button)
+                        wait_for_present(driver, XPATHS["hours"], timeout=5)
+
+                    hours_element = driver.find_element(By.XPATH, XPATHS["hours"])
+                    hours_dict = parse_business_hours(hours_element.get_attribute("aria-label"))
+
+                store_data["開始營業時間"] = hours_dict
+                logger.debug(f"Successfully extracted business hours: {hours_dict}")
+            except Exception:
+                logger.info("Failed to extract business hours")
 
         # Extract phone number
-        try:
-            phone_xpath = '//button[contains(@aria-label, "電話號碼")]'
-            phone_element = driver.find_element(By.XPATH, phone_xpath)
-            phone_number = phone_element.get_attribute("aria-label").split("電話號碼:")[-1].strip()
-            store_data["電話"] = phone_number
-            print(f"Successfully extracted phone number: {store_data['電話']}")
-        except Exception:
-            print("Failed to extract phone number")
+        if "電話" in wanted:
+            try:
+                with metrics.field("電話"):
+                    phone_element = driver.find_element(By.XPATH, XPATHS["phone"])
+                    phone_number = parse_phone(phone_element.get_attribute("aria-label"))
+                store_data["電話"] = phone_number
+                logger.debug(f"Successfully extracted phone number: {store_data['電話']}")
+            except Exception:
+                logger.info("Failed to extract phone number")
 
         # Extract introduction
-        try:
-            intro_button_xpath = '//button[contains(@aria-label, "簡介")]'
-            intro_button = driver.find_element(By.XPATH, intro_button_xpath)
-            driver.execute_script("arguments[0].click();", intro_button)
-            random_delay()
-            
-            intro_xpath = '//*[@id="QA0Szd"]/div/div/div[1]/div[2]/div/div[1]/div/div/div[2]/div[2]/p/span/span'
-            intro_element = driver.find_element(By.XPATH, intro_xpath)
-            intro_text = intro_element.text.strip()
-            store_data["簡介"] = intro_text
-            print(f"Successfully extracted introduction: {intro_text}")
-        except Exception:
-            print("No introduction available")
-
-        # Extract checked items from sections
-        sections = [
-            "無障礙程度", "服務項目", "產品/服務", "用餐選擇", "設施",
-            "客層族群", "氛圍", "付款方式", "兒童", "停車場"
-        ]
-
+        if "簡介" in wanted:
+            try:
+                with metrics.field("簡介"):
+                    open_intro_tab(driver)
+                    intro_element = driver.find_element(By.XPATH, XPATHS["intro"])
+                    intro_text = intro_element.text.strip()
+                store_data["簡介"] = intro_text
+                logger.debug(f"Successfully extracted introduction: {intro_text}")
+            except Exception:
+                logger.info("No introduction available")
+
+        # Extract checked items from sections, which sit on the introduction tab
+        sections = [label for label in SECTIONS if label in wanted]
+        if sections and "簡介" not in wanted:
+            try:
+                open_intro_tab(driver)
+            except Exception:
+                logger.info("No introduction tab available")
         for label in sections:
             store_data[label] = extract_checked_items_with_log(driver, label)
 
     except Exception as e:
-        print(f"Error while scraping data: {e}")
+        logger.warning(f"Error while scraping data: {e}")
 
     return store_data
 
-# Format and save data to JSON
-def save_to_json(data, filename):
-    def format_single_line_lists(json_str):
-        import re
-        return re.sub(r'\[\s*(.*?)\s*\]', 
-                      lambda m: '[' + ', '.join(i.strip() for i in m.group(1).split(',')) + ']', 
-                      json_str, flags=re.DOTALL)
-
-    formatted_json = json.dumps(data, ensure_ascii=False, indent=4)
-    formatted_json = format_single_line_lists(formatted_json)
-
-    with open(filename, "w", encoding="utf-8") as f:
-        f.write(formatted_json)
-
 if __name__ == "__main__":
+    setup_logging()
+
     # Get script directory path
     script_dir = os.path.dirname(os.path.abspath(__file__))
     
     # Configure parameters
-    input_file = os.path.join(script_dir, "完整_台北_新北_地點清單.xlsx")
+    input_file = resolve_input_file(os.path.join(script_dir, "完整_台北_新北_地點清單"))
     output_folder = "location_details"  # Can be modified based on data type
-    progress_file = "crawled_locations.json"  # Can be modified based on data type
+    legacy_progress_file = "crawled_locations.json"  # Imported into the crawl state on first run
+    state_file = "crawl_state.sqlite"
+    use_js = True  # Extract all fields with one script call; False uses per-element lookups
+    sink_name = default_sink()  # "json" (one file per place), "jsonl", "sqlite" or "parquet"
     
     os.makedirs(output_folder, exist_ok=True)
 
-    # Read Place ID list
-    df = pd.read_excel(input_file)
-    place_ids = df['Place ID'].dropna().tolist()
-
-    # Get already crawled IDs
-    if os.path.exists(progress_file):
-        with open(progress_file, "r", encoding="utf-8") as f:
-            crawled_ids = json.load(f)
-        print(f"Loaded crawled locations, total: {len(crawled_ids)}")
-    else:
-        crawled_ids = []
-        print("No existing record found, starting from scratch")
+    # Get already crawled IDs from the crawl state
+    state = CrawlState(state_file)
+    migrate_progress_files(state, output_folder, legacy_progress_file)
+    crawled_ids = state.settled_ids(output_folder)
+    logger.info(f"Loaded crawled locations, total: {len(crawled_ids)}")
 
-    # Filter out already crawled Place IDs
-    remaining_place_ids = [pid for pid in place_ids if pid not in crawled_ids]
-    print(f"Remaining locations to crawl: {len(remaining_place_ids)}")
+    # Stream Place IDs from the input, filtering out already crawled ones
+    remaining_place_ids = (pid for pid in iter_place_ids(input_file) if pid not in crawled_ids)
 
     driver = init_driver()
     processed_count = 0
 
+    # Places are marked done once their batch is written
+    def mark_written(place_ids):
+        for place_id in place_ids:
+            state.mark_success(output_folder, place_id)
+
+    sink = open_sink(sink_name, output_folder, on_flush=mark_written)
+
     try:
         for place_id in remaining_place_ids:
-            print(f"Processing Place ID: {place_id}")
-            place_url = f"https://www.google.com/maps/place/?q=place_id:{place_id}"
-            print(f"Accessing URL: {place_url}")
+            url = place_url(place_id)
+            logger.info(f"Processing Place ID: {place_id}")
+            logger.debug(f"Accessing URL: {url}")
 
-            result = scrape_store_data(driver, place_url, place_id)
+            result = scrape_store_data(driver, url, place_id, use_js=use_js)
 
             if result['店名']:
-                filename = os.path.join(output_folder, f"{place_id}.json")
-                save_to_json(result, filename)
-                print(f"Data saved to: {filename}")
-                save_progress(place_id, os.getpid(), progress_file)
+                sink.write(place_id, result)
                 processed_count += 1
-                print(f"Completed scraping location {processed_count}")
+                logger.info(f"Completed scraping location {processed_count}, saved to {output_folder} ({sink_name})")
             else:
-                print(f"Place ID: {place_id} - Failed to extract name, skipping")
-
-            random_delay(3, 6)
+                logger.warning(f"Place ID: {place_id} - Failed to extract name, skipping")
+                state.mark_failure(output_folder, place_id, page_failure("NameNotFound"))
 
     except Exception as e:
-        print(f"Error occurred: {e}")
+        logger.error(f"Error occurred: {e}")
     finally:
-        print(f"Total processed locations: {processed_count}")
+        logger.info(f"Total processed locations: {processed_count}")
+        sink.close()
+        state.close()
         driver.quit()
-        print("Browser closed")
\ No newline at end of file
+        logger.info("Browser closed")
+        get_metrics().dump()
+        export_metrics()
\ No newline at end of file
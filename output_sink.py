@@ -0,0 +1,273 @@
+import os
+import re
+import json
+import glob
+import heapq
+import time
+import sqlite3
+import logging
+import argparse
+from metrics import get_metrics, setup_logging
+
+logger = logging.getLogger(__name__)
+
+ID_FIELD = "Place ID"
+
+# Sink used when none is given, from SCRAPER_OUTPUT_SINK; "json" keeps one file per place
+def default_sink():
+    return os.environ.get("SCRAPER_OUTPUT_SINK", "json")
+
+# Pretty-printed JSON with lists kept on one line, the original per-place file format
+def save_to_json(data, filename):
+    def format_single_line_lists(json_str):
+        return re.sub(r'\[\s*(.*?)\s*\]',
+                      lambda m: '[' + ', '.join(i.strip() for i in m.group(1).split(',')) + ']',
+                      json_str, flags=re.DOTALL)
+
+    formatted_json = json.dumps(data, ensure_ascii=False, indent=4)
+    formatted_json = format_single_line_lists(formatted_json)
+
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write(formatted_json)
+
+# Record with the Place ID field, added in front when the record does not carry it
+def with_place_id(place_id, record):
+    return record if ID_FIELD in record else {ID_FIELD: place_id, **record}
+
+# First free numbered shard path for this process
+def next_shard_path(folder, ext, pid, seq):
+    while True:
+        path = os.path.join(folder, f"part-{pid}-{seq:05d}{ext}")
+        if not os.path.exists(path):
+            return path, seq
+        seq += 1
+
+# Buffers records and writes them in batches; on_flush(place_ids) is called once a batch
+# is durable, so callers can mark places done only after their data is on disk
+class OutputSink:
+    def __init__(self, folder, flush_every=50, flush_interval=10, on_flush=None):
+        self.folder = folder
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.buffer = []
+        self.last_flush = time.time()
+        self.written = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def write(self, place_id, record):
+        self.buffer.append((place_id, record))
+        if len(self.buffer) >= self.flush_every or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        batch, self.buffer = self.buffer, []
+        with get_metrics().timer("save", sink=type(self).__name__):
+            self._write_batch(batch)
+        self.written += len(batch)
+        self.last_flush = time.time()
+        if self.on_flush is not None:
+            self.on_flush([place_id for place_id, _ in batch])
+
+    def _write_batch(self, batch):
+        raise NotImplementedError
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# One pretty-printed {place_id}.json per place, written immediately
+class JsonFileSink(OutputSink):
+    def __init__(self, folder, on_flush=None, **kwargs):
+        super().__init__(folder, flush_every=1, on_flush=on_flush)
+
+    def _write_batch(self, batch):
+        for place_id, record in batch:
+            valid_filename = re.sub(r'[\\/*?:"<>|]', "", place_id)[:100]
+            save_to_json(record, os.path.join(self.folder, f"{valid_filename}.json"))
+
+# JSON Lines shards per process, rotated to a new file once max_mb is reached
+class ShardedJsonlSink(OutputSink):
+    def __init__(self, folder, max_mb=64, **kwargs):
+        super().__init__(folder, **kwargs)
+        self.max_bytes = max_mb * 1024 * 1024
+        self.pid = os.getpid()
+        self.seq = 0
+        self.file = None
+
+    def _open_shard(self):
+        path, self.seq = next_shard_path(self.folder, ".jsonl", self.pid, self.seq)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _write_batch(self, batch):
+        if self.file is None:
+            self._open_shard()
+        for place_id, record in batch:
+            self.file.write(json.dumps(with_place_id(place_id, record), ensure_ascii=False) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if self.file.tell() >= self.max_bytes:
+            self.file.close()
+            self.file = None
+            self.seq += 1
+
+    def close(self):
+        super().close()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+# One records.sqlite per output folder, shared by all processes (WAL mode); rewrites replace older rows
+class SqliteSink(OutputSink):
+    FILENAME = "records.sqlite"
+
+    def __init__(self, folder, **kwargs):
+        super().__init__(folder, **kwargs)
+        self.conn = sqlite3.connect(os.path.join(folder, self.FILENAME), timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS records (place_id TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                          "updated_at REAL NOT NULL)")
+        self.conn.commit()
+
+    def _write_batch(self, batch):
+        now = time.time()
+        with self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO records (place_id, data, updated_at) VALUES (?, ?, ?)",
+                                  ((place_id, json.dumps(record, ensure_ascii=False), now)
+                                   for place_id, record in batch))
+
+    def close(self):
+        super().close()
+        self.conn.close()
+
+# Parquet files per process; each flush writes one row group file with the Place ID and the
+# record as a JSON string, since attribute sections differ between places
+class ParquetSink(OutputSink):
+    def __init__(self, folder, flush_every=500, flush_interval=60, **kwargs):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ImportError("The Parquet output sink requires pyarrow: pip install pyarrow")
+        super().__init__(folder, flush_every=flush_every, flush_interval=flush_interval, **kwargs)
+        self.pid = os.getpid()
+        self.seq = 0
+
+    def _write_batch(self, batch):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.table({
+            "place_id": [place_id for place_id, _ in batch],
+            "data": [json.dumps(record, ensure_ascii=False) for _, record in batch],
+        })
+        path, self.seq = next_shard_path(self.folder, ".parquet", self.pid, self.seq)
+        temp_path = path + ".tmp"
+        pq.write_table(table, temp_path, compression="zstd")
+        os.replace(temp_path, path)
+        self.seq += 1
+
+SINKS = {
+    "json": JsonFileSink,
+    "jsonl": ShardedJsonlSink,
+    "sqlite": SqliteSink,
+    "parquet": ParquetSink,
+}
+
+# Open an output sink by name for an output folder
+def open_sink(name, folder, on_flush=None, **kwargs):
+    if name not in SINKS:
+        raise ValueError(f"Unknown output sink: {name} ({', '.join(SINKS)})")
+    return SINKS[name](folder, on_flush=on_flush, **kwargs)
+
+# Records of one file-based output: per-place JSON, a JSON Lines shard or a Parquet shard
+def _read_file(path):
+    if path.endswith(".json"):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                yield os.path.splitext(os.path.basename(path))[0], json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Failed to read {path}: {e}")
+    elif path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    record = json.loads(line)
+                    yield record.get(ID_FIELD), record
+    else:
+        import pyarrow.parquet as pq
+        data = pq.read_table(path).to_pydict()
+        for place_id, record in zip(data["place_id"], data["data"]):
+            yield place_id, json.loads(record)
+
+# (written_at, place_id, record) for the file-based outputs, file by file in modification order
+def _iter_files(folder, since):
+    paths = [path for pattern in ("*.json", "part-*.jsonl", "part-*.parquet")
+             for path in glob.glob(os.path.join(folder, pattern))]
+    for modified, path in sorted((os.path.getmtime(path), path) for path in paths):
+        if since is None or modified > since:
+            for place_id, record in _read_file(path):
+                yield modified, place_id, record
+
+# (written_at, place_id, record) for the rows of the SQLite table, in write order
+def _iter_sqlite(folder, since):
+    sqlite_path = os.path.join(folder, SqliteSink.FILENAME)
+    if not os.path.exists(sqlite_path):
+        return
+    conn = sqlite3.connect(sqlite_path, timeout=30)
+    try:
+        for place_id, data, updated_at in conn.execute("SELECT place_id, data, updated_at FROM records "
+                                                       "WHERE updated_at > ? ORDER BY updated_at", (since or 0,)):
+            yield updated_at, place_id, json.loads(data)
+    finally:
+        conn.close()
+
+# Yield (place_id, record) from every format found in an output folder in the order they were
+# written (file modification time, SQLite updated_at), so for the same Place ID the newest
+# record comes last whichever sink wrote it. With since (a timestamp), only files modified
+# and rows written after it are read
+def iter_records(folder, since=None):
+    for _, place_id, record in heapq.merge(_iter_files(folder, since), _iter_sqlite(folder, since),
+                                           key=lambda item: item[0]):
+        yield place_id, record
+
+# Latest record per Place ID in an output folder, optionally only for the given Place IDs
+def latest_records(folder, place_ids=None):
+    latest = {}
+    for place_id, record in iter_records(folder):
+        if place_ids is None or place_id in place_ids:
+            latest[place_id] = record
+    return latest
+
+# Convert a per-place JSON directory (or any mix of formats) into one sink, keeping the latest
+# record per Place ID; returns the number of records written
+def compact(source_folder, target_folder, sink="jsonl", remove_source=False, **kwargs):
+    latest = latest_records(source_folder)
+
+    with open_sink(sink, target_folder, **kwargs) as output:
+        for place_id, record in latest.items():
+            output.write(place_id, record)
+
+    if remove_source and sink != "json":
+        for path in glob.glob(os.path.join(source_folder, "*.json")):
+            os.remove(path)
+    logger.info(f"Compacted {len(latest)} records from {source_folder} into {target_folder} ({sink})")
+    return len(latest)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert per-place JSON output into a batched sink")
+    parser.add_argument("source", help="Output folder to read, e.g. 餐廳詳細資訊")
+    parser.add_argument("target", help="Folder to write the compacted output to")
+    parser.add_argument("--sink", choices=[name for name in SINKS if name != "json"], default="jsonl")
+    parser.add_argument("--max-mb", type=int, default=64, help="Shard size for the jsonl sink")
+    parser.add_argument("--remove-source", action="store_true", help="Delete the per-place JSON files afterwards")
+    args = parser.parse_args()
+
+    setup_logging()
+    kwargs = {"max_mb": args.max_mb} if args.sink == "jsonl" else {}
+    compact(args.source, args.target, args.sink, args.remove_source, **kwargs)
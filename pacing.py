@@ -0,0 +1,208 @@
+import os
+import time
+import logging
+import random
+import threading
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+from metrics import get_metrics
+from process_guard import load_page
+from job_queue import heartbeat
+
+logger = logging.getLogger(__name__)
+
+# Signals that Google is throttling or blocking this session
+BLOCK_URL_PATTERNS = ["/sorry/", "consent.google.com"]
+BLOCK_TEXT_PATTERNS = ["unusual traffic", "異常流量", "not a robot", "我不是機器人"]
+GONE_TEXT_PATTERNS = ["Google 地圖找不到", "Google Maps can't find"]
+
+# Error class recorded for each page outcome other than ready
+PAGE_FAILURES = {"blocked": "Blocked", "gone": "PlaceGone", "not_ready": "PageNotReady"}
+
+# Token bucket that spaces page loads for one worker and adapts to block signals
+class RateLimiter:
+    def __init__(self, per_minute=12, burst=1, jitter=0.3, min_per_minute=None, max_per_minute=None,
+                 backoff=0.5, recover_after=20, cooldown=60):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.jitter = jitter
+        self.min_rate = (min_per_minute or per_minute / 8) / 60.0
+        self.max_rate = (max_per_minute or per_minute) / 60.0
+        self.backoff = backoff
+        self.recover_after = recover_after
+        self.cooldown = cooldown
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.successes = 0
+        self.lock = threading.Lock()
+
+    # Refill tokens for the time elapsed since the last update; during a cooldown updated lies in
+    # the future and nothing is refilled until it has passed
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    # Block until a token (or a fraction of one) is available. The tokens are reserved under the
+    # lock (the bucket may go into debt) and the sleep happens after releasing it, so concurrent
+    # callers queue up behind each other and report_* never waits for a sleeping caller
+    def acquire(self, cost=1.0):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= cost
+            ready = max(now, self.updated) + max(0.0, -self.tokens) / self.rate
+            if self.paused_until > now:
+                logger.info(f"Rate limiter cooling down for {self.paused_until - now:.1f} seconds")
+            wait = ready - now
+            if self.jitter:
+                wait += random.uniform(0, self.jitter * cost / self.rate)
+        if wait > 0:
+            time.sleep(wait)
+
+    # Slow down and pause after a block signal
+    def report_block(self):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.successes = 0
+            self.rate = max(self.min_rate, self.rate * self.backoff)
+            self.paused_until = now + self.cooldown
+            self.updated = max(self.updated, self.paused_until)
+            logger.warning(f"Block detected, rate lowered to {self.rate * 60:.1f} pages/minute")
+
+    # Speed back up after a run of clean pages
+    def report_success(self):
+        with self.lock:
+            self.successes += 1
+            if self.successes >= self.recover_after and self.rate < self.max_rate:
+                self.successes = 0
+                self.rate = min(self.max_rate, self.rate * 1.25)
+                logger.info(f"No blocks recently, rate raised to {self.rate * 60:.1f} pages/minute")
+
+_rate_limiter = None
+
+# Configure the rate limiter of the current worker process
+def configure_rate_limiter(**kwargs):
+    global _rate_limiter
+    _rate_limiter = RateLimiter(**kwargs)
+    return _rate_limiter
+
+# Get the rate limiter of the current worker process, configured from the environment by default
+def get_rate_limiter():
+    global _rate_limiter
+    if _rate_limiter is None:
+        per_minute = float(os.environ.get("SCRAPER_PAGES_PER_MINUTE", 12))
+        _rate_limiter = RateLimiter(per_minute=per_minute)
+    return _rate_limiter
+
+# Check whether the current page is a captcha, consent or unusual-traffic wall
+def detect_block(driver):
+    try:
+        url = driver.current_url
+        if any(pattern in url for pattern in BLOCK_URL_PATTERNS):
+            return True
+        body = driver.execute_script("return document.body ? document.body.innerText.slice(0, 2000) : ''")
+        return any(pattern in body for pattern in BLOCK_TEXT_PATTERNS)
+    except Exception:
+        return False
+
+# Wait for an element to be present
+def wait_for_present(driver, xpath, timeout=20):
+    return WebDriverWait(driver, timeout, poll_frequency=0.2).until(
+        EC.presence_of_element_located((By.XPATH, xpath)))
+
+# Wait for any of several XPaths to be present, returning the one that matched or None
+def wait_for_any(driver, xpaths, timeout=5):
+    def matched(d):
+        for xpath in xpaths:
+            if d.find_elements(By.XPATH, xpath):
+                return xpath
+        return False
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=0.2).until(matched)
+    except TimeoutException:
+        return None
+
+# Count elements matching an XPath in one round trip
+def count_elements(driver, xpath):
+    return driver.execute_script(
+        "return document.evaluate(arguments[0], document, null, "
+        "XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null).snapshotLength;", xpath)
+
+# Wait until more elements than previous_count match, returning the new count
+def wait_for_count_growth(driver, xpath, previous_count, timeout=8):
+    def grown(d):
+        count = count_elements(d, xpath)
+        return count if count > previous_count else False
+    try:
+        return WebDriverWait(driver, timeout, poll_frequency=0.25).until(grown)
+    except TimeoutException:
+        return count_elements(driver, xpath)
+
+# Wait until no new network resources have started for idle_time seconds
+def wait_for_network_idle(driver, idle_time=0.5, timeout=10):
+    deadline = time.monotonic() + timeout
+    last_count = -1
+    idle_since = time.monotonic()
+    while time.monotonic() < deadline:
+        count = driver.execute_script("return performance.getEntriesByType('resource').length;")
+        now = time.monotonic()
+        if count != last_count:
+            last_count = count
+            idle_since = now
+        elif now - idle_since >= idle_time:
+            return True
+        time.sleep(0.1)
+    return False
+
+# Check whether Maps answered with a "can't find" page instead of a place
+def detect_place_gone(driver):
+    try:
+        body = driver.execute_script("return document.body ? document.body.innerText.slice(0, 2000) : ''")
+        return any(pattern in body for pattern in GONE_TEXT_PATTERNS)
+    except Exception:
+        return False
+
+_last_page = "ready"
+
+# Error class for the last page this worker opened, or default when it loaded fine
+def page_failure(default="PageNotReady"):
+    return PAGE_FAILURES.get(_last_page, default)
+
+# Place page URL; SCRAPER_PLACE_URL points the scrapers at another host, e.g. the benchmark fixture server
+def place_url(place_id):
+    template = os.environ.get("SCRAPER_PLACE_URL", "https://www.google.com/maps/place/?q=place_id:{place_id}")
+    return template.format(place_id=place_id)
+
+# Navigate under the rate limit and wait until the page is ready or a block shows up
+def open_page(driver, url, ready_xpath, timeout=20):
+    global _last_page
+    metrics = get_metrics()
+    limiter = get_rate_limiter()
+    with metrics.timer("rate_limit_wait"):
+        limiter.acquire()
+    heartbeat()
+    with metrics.timer("navigation"):
+        load_page(driver, url)
+    try:
+        with metrics.timer("wait_ready"):
+            wait_for_present(driver, ready_xpath, timeout)
+    except TimeoutException:
+        if detect_block(driver):
+            limiter.report_block()
+            _last_page = "blocked"
+        elif detect_place_gone(driver):
+            _last_page = "gone"
+        else:
+            _last_page = "not_ready"
+        metrics.inc("scraper_pages_total", result=_last_page)
+        logger.warning(f"Page not ready after {timeout} seconds ({_last_page}): {url}")
+        return False
+    _last_page = "ready"
+    limiter.report_success()
+    metrics.inc("scraper_pages_total", result="ready")
+    return True
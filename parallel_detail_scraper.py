@@ -1,148 +1,142 @@
 import os
-import json
-import pandas as pd
-from multiprocessing import Process
-import re
-import atexit
+import logging
 import glob
-from multi_element_scraper import init_driver, scrape_store_data, save_to_json
-
-# Clean up all temporary files
+import argparse
+from multi_element_scraper import init_driver, scrape_store_data, resolve_fields
+from job_queue import build_jobs, iter_jobs, run_job_queue
+from driver_pool import DriverPool
+from metrics import get_metrics, setup_logging
+from pacing import configure_rate_limiter, page_failure, place_url
+from place_source import iter_place_rows, resolve_input_file
+from crawl_state import CrawlState, RetrySource, migrate_progress_files
+from failures import CircuitBreaker
+from output_sink import default_sink, open_sink, latest_records
+
+logger = logging.getLogger(__name__)
+
+# Clean up legacy temporary progress files once they are imported into the crawl state
 def cleanup_temp_files():
     temp_files = glob.glob("temp_crawled_detail_*.json")
     for temp_file in temp_files:
         try:
             os.remove(temp_file)
-            print(f"Cleaned temporary file: {temp_file}")
+            logger.info(f"Cleaned temporary file: {temp_file}")
         except Exception as e:
-            print(f"Failed to clean temporary file: {temp_file}, Error: {e}")
+            logger.warning(f"Failed to clean temporary file: {temp_file}, Error: {e}")
+
+# Execute single scraper process, pulling Place IDs from the shared job queue. With fields, only those
+# are scraped and the rest carry over from the stored record the job brings; retried jobs, which
+# come without one, are scraped in full
+def run_scraper_process(job_queue, result_queue, output_folder, state_file, use_js=True, pages_per_minute=12,
+                        sink_name="json", fields=None):
+    setup_logging()
+    pid = os.getpid()
+    configure_rate_limiter(per_minute=pages_per_minute)
+    pool = DriverPool(init_driver)
+    state = CrawlState(state_file)
+    breaker = CircuitBreaker(state)
 
-# Save progress to main record file
-def save_progress(place_id, pid, progress_file):
-    try:
-        if os.path.exists(progress_file):
-            with open(progress_file, "r", encoding="utf-8") as f:
-                crawled_ids = json.load(f)
-        else:
-            crawled_ids = []
-
-        if place_id not in crawled_ids:
-            crawled_ids.append(place_id)
-            with open(progress_file, "w", encoding="utf-8") as f:
-                json.dump(list(set(crawled_ids)), f, ensure_ascii=False, indent=4)
-            print(f"Process {pid} updated main record: {place_id}")
-    except Exception as e:
-        print(f"Failed to update progress file: {e}")
-        temp_file = f"temp_crawled_detail_{pid}.json"
-        try:
-            if os.path.exists(temp_file):
-                with open(temp_file, "r", encoding="utf-8") as f:
-                    temp_ids = json.load(f)
-            else:
-                temp_ids = []
-
-            if place_id not in temp_ids:
-                temp_ids.append(place_id)
-                with open(temp_file, "w", encoding="utf-8") as f:
-                    json.dump(temp_ids, f, ensure_ascii=False, indent=4)
-            print(f"Process {pid} updated temporary record: {place_id}")
-        except Exception as e:
-            print(f"Failed to update temporary record: {e}")
+    # Places are marked done only once the sink has written their batch
+    def mark_written(place_ids):
+        for place_id in place_ids:
+            state.mark_success(output_folder, place_id)
 
-# Execute single scraper process
-def run_scraper_process(df_chunk, output_folder, progress_file):
-    pid = os.getpid()
-    driver = init_driver()
+    sink = open_sink(sink_name, output_folder, on_flush=mark_written)
 
     try:
-        for index, row in df_chunk.iterrows():
-            place_id = row['Place ID']
-            print(f"Process {pid} starts scraping Place ID: {place_id}")
+        for job in iter_jobs(job_queue, result_queue):
+            place_id = job['place_id']
+            breaker.wait()
+            logger.info(f"Process {pid} starts scraping Place ID: {place_id}")
 
             try:
-                place_url = f"https://www.google.com/maps/place/?q=place_id:{place_id}"
-                print(f"Process {pid} accessing URL: {place_url}")
+                url = place_url(place_id)
+                logger.debug(f"Process {pid} accessing URL: {url}")
 
-                result = scrape_store_data(driver, place_url, place_id)
+                previous = job.get('previous')
+                result = pool.run(scrape_store_data, url, place_id, use_js=use_js,
+                                  fields=fields if previous else None, previous=previous,
+                                  succeeded=lambda data: data['店名'])
 
                 if result['店名']:
-                    valid_filename = re.sub(r'[\\/*?:"<>|]', "", place_id)[:100]
-                    filename = os.path.join(output_folder, f"{valid_filename}.json")
-                    save_to_json(result, filename)
-                    print(f"Process {pid} data saved to: {filename}")
-                    save_progress(place_id, pid, progress_file)
+                    sink.write(place_id, result)
+                    logger.info(f"Process {pid} data saved to: {output_folder} ({sink_name})")
                 else:
-                    print(f"Process {pid} Place ID: {place_id} failed to extract name, skipping")
+                    logger.warning(f"Process {pid} Place ID: {place_id} failed to extract name, skipping")
+                    state.mark_failure(output_folder, place_id, page_failure("NameNotFound"))
 
             except Exception as e:
-                print(f"Process {pid} failed to scrape Place ID {place_id}, Error: {e}")
+                logger.warning(f"Process {pid} failed to scrape Place ID {place_id}, Error: {e}")
+                state.mark_failure(output_folder, place_id, type(e).__name__, str(e))
     finally:
-        driver.quit()
-        print(f"Process {pid} browser closed")
-
-# Main parallel scraping control function
-def parallel_scrape(input_file, num_processes, is_restaurant=True):
-    # Register cleanup function
-    atexit.register(cleanup_temp_files)
-
-    # Clean up possible residual files
-    cleanup_temp_files()
-
-    # Read Excel file
-    print(f"Reading input file: {input_file}")
-    df = pd.read_excel(input_file)
-
-    # Set folder and progress file names based on data type
+        sink.close()
+        state.close()
+        pool.close()
+        logger.info(f"Process {pid} browser closed")
+        get_metrics().dump()
+
+# Main parallel scraping control function. fields (e.g. ["評分", "開始營業時間"]) turns the run into
+# a partial refresh of the places already stored: only those fields are scraped again
+def parallel_scrape(input_file, num_processes, is_restaurant=True, cost_column=None, use_js=True, pages_per_minute=12,
+                    state_file="crawl_state.sqlite", sink_name=None, fields=None):
+    sink_name = sink_name or default_sink()
+    if fields is not None:
+        fields = sorted(resolve_fields(fields))
+
+    # Resolve the input file (.csv / .parquet / .jsonl / .xlsx)
+    input_file = resolve_input_file(input_file)
+    logger.info(f"Reading input file: {input_file}")
+
+    # Set folder name based on data type; it is also the crawl-state kind
     output_folder = "餐廳詳細資訊" if is_restaurant else "景點詳細資訊"
-    progress_file = "爬過的餐廳ID.json" if is_restaurant else "爬過的景點ID.json"
+    legacy_progress_file = "爬過的餐廳ID.json" if is_restaurant else "爬過的景點ID.json"
     os.makedirs(output_folder, exist_ok=True)
 
-    # Read crawled Place IDs
-    if os.path.exists(progress_file):
-        with open(progress_file, "r", encoding="utf-8") as f:
-            crawled_ids = json.load(f)
-        print(f"Loaded crawled IDs, total: {len(crawled_ids)}")
-    else:
-        crawled_ids = []
-        print("No existing record found, starting from scratch")
-
-    # Filter already scraped Place IDs
-    df = df[~df['Place ID'].isin(crawled_ids)]
-    print(f"Remaining locations to scrape: {len(df)}")
-
-    if len(df) == 0:
-        print("No locations to scrape, program ends")
-        return
-
-    # Split data into chunks
-    chunk_size = max(1, len(df) // num_processes)
-    chunks = [df[i:i + chunk_size] for i in range(0, len(df), chunk_size)]
-
-    # Create and start processes
-    processes = []
-    for chunk in chunks:
-        p = Process(target=run_scraper_process, args=(chunk, output_folder, progress_file))
-        processes.append(p)
-        p.start()
-
-    # Wait for all processes to complete
-    for p in processes:
-        p.join()
-
-    print("All scraping processes completed!")
+    # Read crawled Place IDs from the crawl state, importing legacy progress files once
+    state = CrawlState(state_file)
+    migrate_progress_files(state, output_folder, legacy_progress_file)
+    cleanup_temp_files()
+    crawled_ids = state.settled_ids(output_folder)
+    state.close()
+    logger.info(f"Loaded crawled IDs, total: {len(crawled_ids)}")
+
+    # Stream only the needed columns and filter already scraped Place IDs, unless refreshing them
+    columns = ["Place ID", cost_column] if cost_column else ["Place ID"]
+    rows = (row for row in iter_place_rows(input_file, columns) if fields or row['Place ID'] not in crawled_ids)
+
+    # Workers pull one Place ID at a time from a shared queue; failed places are retried at the end
+    jobs = build_jobs(rows, cost_column)
+    if fields:
+        # A refresh covers stored places only, each job carrying its record for the fields not scraped
+        stored = latest_records(output_folder)
+        logger.info(f"Refreshing {', '.join(fields)} of {len(stored)} stored places")
+        jobs = ({**job, "previous": stored[job['place_id']]} for job in jobs if job['place_id'] in stored)
+    run_job_queue(jobs, run_scraper_process, (output_folder, state_file, use_js, pages_per_minute, sink_name, fields),
+                  num_processes, retry_source=RetrySource(state_file, [output_folder]))
+
+    logger.info("All scraping processes completed!")
 
 if __name__ == "__main__":
     # Get script directory path
     script_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # Configure input file and process count
-    input_file = os.path.join(script_dir, "完整_台北_新北_地點清單.xlsx")
-    num_processes = 6
-    is_restaurant = True  # Set to False for attractions
-
-    print(f"Starting parallel scraping")
-    print(f"Input file: {input_file}")
-    print(f"Number of processes: {num_processes}")
-    print(f"Data type: {'Restaurant' if is_restaurant else 'Attraction'}")
-
-    parallel_scrape(input_file, num_processes, is_restaurant)
\ No newline at end of file
+
+    parser = argparse.ArgumentParser(description="Scrape place details with several processes")
+    parser.add_argument("input_file", nargs="?", default=os.path.join(script_dir, "完整_台北_新北_地點清單"),
+                        help="Place list (.csv / .parquet / .jsonl / .xlsx)")
+    parser.add_argument("--processes", type=int, default=6)
+    parser.add_argument("--attractions", action="store_true", help="Scrape attractions instead of restaurants")
+    parser.add_argument("--no-js", action="store_true", help="Use per-element lookups instead of one script")
+    parser.add_argument("--sink", default=None,
+                        help="json (one file per place), jsonl (sharded), sqlite or parquet (default: SCRAPER_OUTPUT_SINK or json)")
+    parser.add_argument("--fields", help="Refresh only these fields of stored places, e.g. 評分,開始營業時間")
+    args = parser.parse_args()
+
+    setup_logging()
+    is_restaurant = not args.attractions
+    logger.info("Starting parallel scraping")
+    logger.info(f"Input file: {args.input_file}")
+    logger.info(f"Number of processes: {args.processes}")
+    logger.info(f"Data type: {'Restaurant' if is_restaurant else 'Attraction'}")
+
+    parallel_scrape(args.input_file, args.processes, is_restaurant, use_js=not args.no_js, sink_name=args.sink,
+                    fields=args.fields)
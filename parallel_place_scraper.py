@@ -0,0 +1,165 @@
+import os
+import logging
+from multi_element_scraper import init_driver, scrape_store_data, XPATHS
+from comment_scraper import scrape_reviews
+from job_queue import build_jobs, iter_jobs, run_job_queue
+from driver_pool import DriverPool
+from metrics import get_metrics, setup_logging
+from pacing import configure_rate_limiter, open_page, page_failure, place_url
+from place_source import iter_place_rows, resolve_input_file
+from crawl_state import CrawlState, RetrySource, migrate_progress_files, migrate_output_folder
+from failures import CircuitBreaker
+from output_sink import default_sink, open_sink
+
+logger = logging.getLogger(__name__)
+
+PARTS = ("details", "reviews")
+
+# Load a place page once, then extract details and scroll reviews on the same page.
+# Returns {part: success}; a part that was not requested is left out
+def scrape_place(driver, place_id, parts, review_folder, use_js=True, streaming=False):
+    url = place_url(place_id)
+    logger.debug(f"Accessing URL: {url}")
+
+    results = {}
+    if not open_page(driver, url, XPATHS["name"], timeout=30):
+        return {part: None for part in parts}
+
+    # Details first: the review tab replaces the overview panel the detail XPaths read from
+    if "details" in parts:
+        results["details"] = scrape_store_data(driver, url, place_id, use_js=use_js, navigate=False)
+    if "reviews" in parts:
+        results["reviews"] = scrape_reviews(driver, place_id, review_folder, streaming=streaming, navigate=False)
+    return results
+
+# Record each part of a scrape_place result independently; returns the number of parts that succeeded.
+# Details go to the sink, which marks them done once written; page_error is recorded for parts
+# the page never loaded for (PageNotReady, Blocked or PlaceGone)
+def record_results(state, sink, detail_folder, review_folder, place_id, results, page_error="PageNotReady"):
+    parts_done = 0
+    if "details" in results:
+        store_data = results["details"]
+        if store_data and store_data['店名']:
+            sink.write(place_id, store_data)
+            parts_done += 1
+        else:
+            state.mark_failure(detail_folder, place_id, page_error if store_data is None else "NameNotFound")
+    if "reviews" in results:
+        if results["reviews"]:
+            state.mark_success(review_folder, place_id)
+            parts_done += 1
+        else:
+            state.mark_failure(review_folder, place_id, page_error if results["reviews"] is None else "ScrapeFailed")
+    return parts_done
+
+# Execute single scraper process, pulling places and the parts still missing for them from the job queue
+def run_scraper_process(job_queue, result_queue, detail_folder, review_folder, state_file, use_js=True,
+                        pages_per_minute=12, streaming=False, sink_name="json"):
+    setup_logging()
+    pid = os.getpid()
+    configure_rate_limiter(per_minute=pages_per_minute)
+    pool = DriverPool(init_driver)
+    state = CrawlState(state_file)
+    breaker = CircuitBreaker(state)
+
+    # Details are marked done only once the sink has written their batch
+    def mark_written(place_ids):
+        for place_id in place_ids:
+            state.mark_success(detail_folder, place_id)
+
+    sink = open_sink(sink_name, detail_folder, on_flush=mark_written)
+    visits = 0
+    parts_done = 0
+
+    try:
+        for job in iter_jobs(job_queue, result_queue):
+            place_id = job['place_id']
+            parts = job['parts']
+            breaker.wait()
+            logger.info(f"Process {pid} starts scraping Place ID: {place_id} ({', '.join(parts)})")
+
+            try:
+                results = pool.run(scrape_place, place_id, parts, review_folder, use_js=use_js, streaming=streaming,
+                                   succeeded=lambda results: any(results.values()))
+                visits += 1
+            except Exception as e:
+                logger.warning(f"Process {pid} failed to scrape Place ID {place_id}, Error: {e}")
+                for part in parts:
+                    kind = detail_folder if part == "details" else review_folder
+                    state.mark_failure(kind, place_id, type(e).__name__, str(e))
+                continue
+
+            parts_done += record_results(state, sink, detail_folder, review_folder, place_id, results, page_failure())
+    finally:
+        sink.close()
+        state.close()
+        pool.close()
+        logger.info(f"Process {pid} finished {parts_done} parts in {visits} page visits")
+        get_metrics().dump()
+
+# Output folders, which double as crawl-state kinds shared with the single-part scrapers,
+# and one job per place with the parts still missing for it
+def plan_jobs(input_file, is_restaurant=True, cost_column="評論數", state_file="crawl_state.sqlite"):
+    # Resolve the input file (.csv / .parquet / .jsonl / .xlsx)
+    input_file = resolve_input_file(input_file)
+    logger.info(f"Reading input file: {input_file}")
+
+    detail_folder = "餐廳詳細資訊" if is_restaurant else "景點詳細資訊"
+    review_folder = "餐廳評論爬蟲" if is_restaurant else "景點評論爬蟲"
+    legacy_progress_file = "爬過的餐廳ID.json" if is_restaurant else "爬過的景點ID.json"
+    os.makedirs(detail_folder, exist_ok=True)
+    os.makedirs(review_folder, exist_ok=True)
+
+    state = CrawlState(state_file)
+    migrate_progress_files(state, detail_folder, legacy_progress_file)
+    migrate_output_folder(state, review_folder, review_folder)
+    done = {"details": state.settled_ids(detail_folder), "reviews": state.settled_ids(review_folder)}
+    state.close()
+    logger.info(f"Already scraped: {len(done['details'])} details, {len(done['reviews'])} reviews")
+
+    # Stream only the needed columns and skip places that have every part already
+    columns = ["Place ID", cost_column] if cost_column else ["Place ID"]
+    rows = (row for row in iter_place_rows(input_file, columns)
+            if any(row['Place ID'] not in done[part] for part in PARTS))
+
+    jobs = ({**job, "parts": [part for part in PARTS if job['place_id'] not in done[part]]}
+            for job in build_jobs(rows, cost_column))
+    return detail_folder, review_folder, jobs
+
+# Retry source for the jobs of plan_jobs
+def retry_source(detail_folder, review_folder, state_file):
+    return RetrySource(state_file, {detail_folder: "details", review_folder: "reviews"})
+
+# Main control function: one job per place with the parts still missing for it
+def parallel_scrape(input_file, num_processes, is_restaurant=True, cost_column="評論數", use_js=True,
+                    pages_per_minute=12, streaming=False, state_file="crawl_state.sqlite", sink_name=None):
+    sink_name = sink_name or default_sink()
+
+    detail_folder, review_folder, jobs = plan_jobs(input_file, is_restaurant, cost_column, state_file)
+    run_job_queue(jobs, run_scraper_process,
+                  (detail_folder, review_folder, state_file, use_js, pages_per_minute, streaming, sink_name),
+                  num_processes, retry_source=retry_source(detail_folder, review_folder, state_file))
+
+    logger.info("All scraping processes completed!")
+
+if __name__ == "__main__":
+    setup_logging()
+
+    # Get script directory path
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+
+    # Configure input file and process count
+    input_file = os.path.join(script_dir, "完整_台北_新北_地點清單")  # .csv / .parquet / .jsonl / .xlsx
+    num_processes = 6
+    is_restaurant = True  # Set to False for attractions
+    use_js = True  # Extract all fields with one script call; False uses per-element lookups
+    streaming = False  # True appends reviews to {place_id}.jsonl while scrolling
+    sink_name = "json"  # "json" (one file per place), "jsonl" (sharded), "sqlite" or "parquet"
+
+    logger.info("Starting parallel scraping (details and reviews in one visit)")
+    logger.info(f"Input file: {input_file}")
+    logger.info(f"Number of processes: {num_processes}")
+    logger.info(f"Data type: {'Restaurant' if is_restaurant else 'Attraction'}")
+
+    parallel_scrape(input_file, num_processes, is_restaurant, use_js=use_js, streaming=streaming,
+                    sink_name=sink_name)
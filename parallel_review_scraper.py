@@ -1,109 +1,100 @@
 import os
+import logging
 import json
-import pandas as pd
-from multiprocessing import Process
 import sys
-import atexit
-import glob
 
 # Import functions from the comment scraper
-from comment_scraper import kill_chrome_processes, init_driver, scrape_reviews
-
-# Clean up all temporary files
-def cleanup_temp_files():
-    temp_files = glob.glob("temp_crawled_*.json")
-    for temp_file in temp_files:
-        try:
-            os.remove(temp_file)
-            print(f"Cleaned temporary file: {temp_file}")
-        except Exception as e:
-            print(f"Failed to clean temporary file: {temp_file}, Error: {e}")
-
-# Execute single scraper process
-def run_scraper_process(df_chunk, folder_name):
+from comment_scraper import init_driver, scrape_reviews, refresh_reviews
+from job_queue import build_jobs, iter_jobs, run_job_queue
+from driver_pool import DriverPool
+from metrics import get_metrics, setup_logging
+from pacing import configure_rate_limiter, page_failure
+from place_source import iter_place_rows, resolve_input_file
+from crawl_state import CrawlState, RetrySource, migrate_output_folder
+from failures import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+# Execute single scraper process, pulling Place IDs from the shared job queue
+def run_scraper_process(job_queue, result_queue, folder_name, state_file, pages_per_minute=12, streaming=False, refresh=False):
+    setup_logging()
     pid = os.getpid()
-    driver = init_driver()
+    configure_rate_limiter(per_minute=pages_per_minute)
+    state = CrawlState(state_file)
+    breaker = CircuitBreaker(state)
+    pool = DriverPool(init_driver)
     try:
-        for index, row in df_chunk.iterrows():
-            place_id = row['Place ID']
-            print(f"Process {pid} starts scraping Place ID: {place_id}")
+        for job in iter_jobs(job_queue, result_queue):
+            place_id = job['place_id']
+            breaker.wait()
+            logger.info(f"Process {pid} starts scraping Place ID: {place_id}")
 
             try:
-                # Check if file already exists
-                file_path = os.path.join(folder_name, f"{place_id}.json")
-                if not os.path.exists(file_path):
-                    success = scrape_reviews(driver, place_id, folder_name=folder_name)
-                    if success:
-                        print(f"Successfully scraped Place ID: {place_id}")
+                # Refresh mode merges only reviews newer than the stored ones
+                if refresh:
+                    success = pool.run(refresh_reviews, place_id, folder_name=folder_name)
+                else:
+                    success = pool.run(scrape_reviews, place_id, folder_name=folder_name, streaming=streaming)
+
+                if success:
+                    state.mark_success(folder_name, place_id)
+                    logger.info(f"Successfully {'refreshed' if refresh else 'scraped'} Place ID: {place_id}")
                 else:
-                    print(f"Place ID {place_id} already exists, skipping")
+                    state.mark_failure(folder_name, place_id, page_failure("ScrapeFailed"))
             except Exception as e:
-                print(f"Process {pid} failed to scrape Place ID {place_id}, Error: {e}")
+                state.mark_failure(folder_name, place_id, type(e).__name__, str(e))
+                logger.warning(f"Process {pid} failed to scrape Place ID {place_id}, Error: {e}")
     finally:
-        driver.quit()
+        pool.close()
+        state.close()
+        get_metrics().dump()
 
 # Main parallel scraping control function
-def parallel_scrape(input_file, num_processes, is_restaurant=True):
-    # Register cleanup function
-    atexit.register(cleanup_temp_files)
-
-    # Clean up possible residual files
-    cleanup_temp_files()
-
-    # Clean up residual processes
-    kill_chrome_processes()
-
-    # Read Excel file
-    print(f"Reading input file: {input_file}")
-    df = pd.read_excel(input_file)
+def parallel_scrape(input_file, num_processes, is_restaurant=True, cost_column="評論數", pages_per_minute=12, streaming=False, refresh=False,
+                    state_file="crawl_state.sqlite"):
+    # Resolve the input file (.csv / .parquet / .jsonl / .xlsx)
+    input_file = resolve_input_file(input_file)
+    logger.info(f"Reading input file: {input_file}")
 
     # Set folder name based on data type
     folder_name = "餐廳評論爬蟲" if is_restaurant else "景點評論爬蟲"
 
-    # Check existing files
-    if os.path.exists(folder_name):
-        crawled_files = {file.replace(".json", "") for file in os.listdir(folder_name) if file.endswith(".json")}
-    else:
-        crawled_files = set()
-        os.makedirs(folder_name)
-
-    # Filter already scraped Place IDs
-    df = df[~df['Place ID'].isin(crawled_files)]
-    print(f"Remaining locations to scrape: {len(df)}")
-
-    if len(df) == 0:
-        print("No locations to scrape, program ends")
-        return
+    # Load crawl state, importing existing review files on the first run
+    state = CrawlState(state_file)
+    migrate_output_folder(state, folder_name, folder_name)
+    crawled_files = state.settled_ids(folder_name)
+    state.close()
+    logger.info(f"Already scraped locations: {len(crawled_files)}")
+    os.makedirs(folder_name, exist_ok=True)
 
-    # Split data into chunks
-    chunk_size = max(1, len(df) // num_processes)
-    chunks = [df[i:i + chunk_size] for i in range(0, len(df), chunk_size)]
+    # Stream only the needed columns and filter already scraped Place IDs, unless refreshing them
+    columns = ["Place ID", cost_column] if cost_column else ["Place ID"]
+    rows = (row for row in iter_place_rows(input_file, columns)
+            if refresh or row['Place ID'] not in crawled_files)
 
-    # Create and start processes
-    processes = []
-    for chunk in chunks:
-        p = Process(target=run_scraper_process, args=(chunk, folder_name))
-        processes.append(p)
-        p.start()
+    # Workers pull one Place ID at a time, places with the most reviews first
+    jobs = build_jobs(rows, cost_column)
+    run_job_queue(jobs, run_scraper_process, (folder_name, state_file, pages_per_minute, streaming, refresh), num_processes,
+                  retry_source=RetrySource(state_file, [folder_name]))
 
-    # Wait for all processes to complete
-    for p in processes:
-        p.join()
-
-    print("All scraping processes completed!")
+    logger.info("All scraping processes completed!")
 
 if __name__ == "__main__":
+    setup_logging()
+
     # Get script directory path
     script_dir = os.path.dirname(os.path.abspath(__file__))
     
     # Configure input file and process count
-    input_file = os.path.join(script_dir, "完整_台北_新北_地點清單.xlsx")
+    input_file = os.path.join(script_dir, "完整_台北_新北_地點清單")  # .csv / .parquet / .jsonl / .xlsx
     num_processes = 6
     is_restaurant = True  # Set to False for attractions
+    streaming = False  # True appends reviews to {place_id}.jsonl while scrolling
+    refresh = False  # True re-crawls stored places newest-first and merges only new reviews
 
-    print(f"Starting parallel scraping")
-    print(f"Input file: {input_file}")
-    print(f"Number of processes: {num_processes}")
-    print(f"Data type: {'Restaurant' if is_restaurant else 'Attraction'}")
+    logger.info("Starting parallel scraping")
+    logger.info(f"Input file: {input_file}")
+    logger.info(f"Number of processes: {num_processes}")
+    logger.info(f"Data type: {'Restaurant' if is_restaurant else 'Attraction'}")
 
-    parallel_scrape(input_file, num_processes, is_restaurant)
\ No newline at end of file
+    parallel_scrape(input_file, num_processes, is_restaurant, streaming=streaming, refresh=refresh)
\ No newline at end of file
@@ -0,0 +1,347 @@
+import os
+import re
+import math
+import time
+import sqlite3
+import logging
+import argparse
+from output_sink import iter_records
+from place_source import iter_place_rows, resolve_input_file
+from metrics import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Query index over the scraped details, so consumers can ask "open Sunday 19:00, takes credit
+# cards, has parking, within 1 km" without loading every record. Built from the output folders
+# (any sink format) and the grid-search sheet, updated incrementally from what changed since
+# the last update:
+#   attributes  inverted index of the checked items of every section (付款方式, 設施, 停車場, ...)
+#   hours       opening intervals as minutes since Monday 00:00, one row per day they touch
+#   locations   coordinates bucketed into CELL_DEGREES grid cells
+# Queries start from the grid cells around a location (or from the best rated places) and check
+# the other conditions with index lookups per place, so they stay in milliseconds
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS places (
+    place_id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    name TEXT,
+    rating REAL,
+    address TEXT
+);
+CREATE INDEX IF NOT EXISTS places_rating ON places (rating);
+CREATE TABLE IF NOT EXISTS attributes (
+    section TEXT NOT NULL,
+    item TEXT NOT NULL,
+    place_id TEXT NOT NULL,
+    PRIMARY KEY (section, item, place_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS attributes_place ON attributes (place_id, section, item);
+CREATE TABLE IF NOT EXISTS hours (
+    place_id TEXT NOT NULL,
+    day INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS hours_place ON hours (place_id, day, start, end);
+CREATE TABLE IF NOT EXISTS locations (
+    place_id TEXT PRIMARY KEY,
+    lat REAL NOT NULL,
+    lng REAL NOT NULL,
+    cell_lat INTEGER NOT NULL,
+    cell_lng INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS locations_cell ON locations (cell_lat, cell_lng);
+CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, updated_at REAL NOT NULL);
+"""
+
+DAYS = ["星期一", "星期二", "星期三", "星期四", "星期五", "星期六", "星期日"]
+DAY_MINUTES = 24 * 60
+WEEK_MINUTES = 7 * DAY_MINUTES
+
+CELL_DEGREES = 0.01  # About 1.1 km of latitude
+EARTH_RADIUS_KM = 6371.0
+
+CLOSED_TEXTS = ("休息", "休業", "暫停營業")
+ALL_DAY_TEXTS = ("24 小時營業", "24小時營業")
+TIME_PATTERN = re.compile(r"(上午|中午|下午|晚上|凌晨)?\s*(\d{1,2})(?:[:：](\d{2}))?")
+
+# Minutes since midnight of a clock time such as "11:00", "24:00" or "下午5:30"
+def parse_clock(text):
+    match = TIME_PATTERN.search(text)
+    if not match:
+        raise ValueError(f"Unrecognised time: {text}")
+    period, hour, minute = match.group(1), int(match.group(2)), int(match.group(3) or 0)
+    if period in ("下午", "晚上") and hour < 12:
+        hour += 12
+    elif period in ("上午", "凌晨") and hour == 12:
+        hour = 0
+    return hour * 60 + minute
+
+# Day index (0 = 星期一) of a day name or index; day names may carry a note, e.g. "星期日（國慶日）"
+def day_index(day):
+    if isinstance(day, int):
+        return day % 7
+    for i, name in enumerate(DAYS):
+        if day.startswith(name):
+            return i
+    raise ValueError(f"Unrecognised day: {day}")
+
+# Opening intervals of a day's hours text, in minutes since that midnight; closing at or
+# before the opening time means closing after midnight
+def parse_day_hours(text):
+    text = text.strip()
+    if not text or any(closed in text for closed in CLOSED_TEXTS):
+        return []
+    if any(all_day in text for all_day in ALL_DAY_TEXTS):
+        return [(0, DAY_MINUTES)]
+    intervals = []
+    for part in re.split(r"[、,，;；]", text):
+        bounds = re.split(r"[~～–]|到", part)
+        if len(bounds) != 2:
+            continue
+        start, end = parse_clock(bounds[0]), parse_clock(bounds[1])
+        if end <= start:
+            end += DAY_MINUTES
+        intervals.append((start, end))
+    return intervals
+
+# Merged weekly opening intervals (minutes since Monday 00:00) of an 開始營業時間 dict. An interval
+# running past Sunday midnight keeps going past WEEK_MINUTES; a place open around the clock all
+# week gets one interval two weeks long so queries across Sunday midnight still match
+def weekly_intervals(hours):
+    intervals = []
+    for day, text in (hours or {}).items():
+        try:
+            offset = day_index(day) * DAY_MINUTES
+            intervals += [(offset + start, offset + end) for start, end in parse_day_hours(text)]
+        except ValueError as e:
+            logger.debug(f"Skipping hours {day}: {text} ({e})")
+    intervals.sort()
+
+    merged = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if merged == [(0, WEEK_MINUTES)]:
+        return [(0, 2 * WEEK_MINUTES)]
+
+    # Hours from Monday midnight continue the last interval of the week when it runs up to them
+    if len(merged) > 1 and merged[0][0] == 0 and merged[-1][1] >= WEEK_MINUTES:
+        first = merged.pop(0)
+        merged[-1] = (merged[-1][0], max(merged[-1][1], WEEK_MINUTES + first[1]))
+    return merged
+
+# Index rows (day, start, end) of weekly intervals: each interval is filed under every day it
+# touches, shifted back a week for days past Sunday, so a query only scans its own day
+def hour_rows(intervals):
+    for start, end in intervals:
+        for day in range(start // DAY_MINUTES, (end - 1) // DAY_MINUTES + 1):
+            shift = (day // 7) * WEEK_MINUTES
+            yield day % 7, start - shift, end - shift
+
+# Minutes since Monday 00:00 of a day and a clock time
+def week_minute(day, clock):
+    return day_index(day) * DAY_MINUTES + parse_clock(clock)
+
+def grid_cell(lat, lng):
+    return math.floor(lat / CELL_DEGREES), math.floor(lng / CELL_DEGREES)
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+def parse_rating(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+class PlaceIndex:
+    def __init__(self, path="place_index.sqlite"):
+        self.path = path
+        self.conn = sqlite3.connect(path, timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+
+    # Index one scraped record, replacing what was indexed for the place before
+    def add(self, place_id, record, kind):
+        self.conn.execute("INSERT OR REPLACE INTO places (place_id, kind, name, rating, address) VALUES (?, ?, ?, ?, ?)",
+                          (place_id, kind, record.get("店名"), parse_rating(record.get("評分")), record.get("地址")))
+        self.conn.execute("DELETE FROM attributes WHERE place_id=?", (place_id,))
+        self.conn.executemany("INSERT OR IGNORE INTO attributes (section, item, place_id) VALUES (?, ?, ?)",
+                              ((section, item, place_id) for section, items in record.items()
+                               if isinstance(items, list) for item in items))
+        self.conn.execute("DELETE FROM hours WHERE place_id=?", (place_id,))
+        self.conn.executemany("INSERT INTO hours (place_id, day, start, end) VALUES (?, ?, ?, ?)",
+                              ((place_id, *row) for row in hour_rows(weekly_intervals(record.get("開始營業時間")))))
+
+    def add_location(self, place_id, lat, lng):
+        self.conn.execute("INSERT OR REPLACE INTO locations (place_id, lat, lng, cell_lat, cell_lng) "
+                          "VALUES (?, ?, ?, ?, ?)", (place_id, lat, lng, *grid_cell(lat, lng)))
+
+    def _source_updated(self, source):
+        row = self.conn.execute("SELECT updated_at FROM sources WHERE source=?", (source,)).fetchone()
+        return row[0] if row else None
+
+    def _mark_source(self, source, updated_at):
+        self.conn.execute("INSERT OR REPLACE INTO sources (source, updated_at) VALUES (?, ?)", (source, updated_at))
+
+    # Index the records of an output folder saved since its last update; returns how many were indexed
+    def update_folder(self, folder, kind=None):
+        source = f"records:{os.path.abspath(folder)}"
+        started = time.time()
+        count = 0
+        with self.conn:
+            for place_id, record in iter_records(folder, since=self._source_updated(source)):
+                if place_id:
+                    self.add(place_id, record, kind or os.path.basename(os.path.normpath(folder)))
+                    count += 1
+            self._mark_source(source, started)
+        return count
+
+    # Load coordinates from the grid-search sheet (緯度 / 經度 columns) when it changed; returns how many
+    def update_locations(self, input_file):
+        input_file = resolve_input_file(input_file)
+        source = f"locations:{os.path.abspath(input_file)}"
+        modified = os.path.getmtime(input_file)
+        if (self._source_updated(source) or 0) >= modified:
+            return 0
+        count = 0
+        with self.conn:
+            for row in iter_place_rows(input_file, ["Place ID", "緯度", "經度"]):
+                try:
+                    lat, lng = float(row["緯度"]), float(row["經度"])
+                except (TypeError, ValueError):
+                    continue
+                if lat == lat and lng == lng:  # Skip NaN
+                    self.add_location(row["Place ID"], lat, lng)
+                    count += 1
+            self._mark_source(source, modified)
+        return count
+
+    # Bring the index up to date with the output folders and the place list
+    def update(self, folders, input_file=None):
+        for folder in folders:
+            if os.path.isdir(folder):
+                count = self.update_folder(folder)
+                if count:
+                    logger.info(f"Indexed {count} records from {folder}")
+        if input_file:
+            count = self.update_locations(input_file)
+            if count:
+                logger.info(f"Indexed {count} locations from {input_file}")
+        self.conn.execute("PRAGMA optimize")
+
+    # Places matching every given condition, nearest first with near, otherwise best rated first;
+    # limit=None returns every match.
+    #   open_at     (day, "HH:MM") open at that time, or (day, "HH:MM", "HH:MM") open throughout;
+    #               an end before the start runs past midnight
+    #   attributes  {section: item, [items] (all required) or True (any checked item)},
+    #               e.g. {"付款方式": "信用卡", "停車場": True}
+    #   near        (lat, lng, km)
+    def query(self, open_at=None, attributes=None, near=None, kind=None, min_rating=None, limit=100):
+        conditions, params = [], []
+        if near:
+            lat, lng, km = near
+            dlat = km / 111.0
+            dlng = km / (111.0 * max(math.cos(math.radians(lat)), 0.01))
+            (min_lat, min_lng), (max_lat, max_lng) = grid_cell(lat - dlat, lng - dlng), grid_cell(lat + dlat, lng + dlng)
+            cells = list(range(min_lat, max_lat + 1))
+            conditions.append(f"l.cell_lat IN ({', '.join('?' * len(cells))}) AND l.cell_lng BETWEEN ? AND ?")
+            params += cells + [min_lng, max_lng]
+        if kind:
+            conditions.append("p.kind = ?")
+            params.append(kind)
+        if min_rating is not None:
+            conditions.append("p.rating >= ?")
+            params.append(min_rating)
+
+        if open_at:
+            start = week_minute(open_at[0], open_at[1])
+            end = start + (parse_clock(open_at[2]) - parse_clock(open_at[1])) % DAY_MINUTES if len(open_at) > 2 else start
+            conditions.append("EXISTS (SELECT 1 FROM hours h WHERE h.place_id = p.place_id AND h.day = ? "
+                              "AND h.start <= ? AND h.end >= ?)")
+            params += [start // DAY_MINUTES, start, end]
+
+        for section, items in (attributes or {}).items():
+            if items is True:
+                conditions.append("EXISTS (SELECT 1 FROM attributes a WHERE a.place_id = p.place_id AND a.section = ?)")
+                params.append(section)
+                continue
+            for item in [items] if isinstance(items, str) else items:
+                conditions.append("EXISTS (SELECT 1 FROM attributes a WHERE a.place_id = p.place_id "
+                                  "AND a.section = ? AND a.item = ?)")
+                params += [section, item]
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        if near:
+            sql = f"SELECT p.place_id, p.name, p.rating, l.lat, l.lng FROM locations l JOIN places p USING (place_id) {where}"
+        else:
+            sql = (f"SELECT p.place_id, p.name, p.rating, NULL, NULL FROM places p {where} ORDER BY p.rating DESC"
+                   + (" LIMIT ?" if limit else ""))
+            params += [limit] if limit else []
+
+        results = []
+        for place_id, name, rating, place_lat, place_lng in self.conn.execute(sql, params):
+            result = {"place_id": place_id, "name": name, "rating": rating}
+            if near:
+                result["distance_km"] = round(haversine_km(lat, lng, place_lat, place_lng), 3)
+                if result["distance_km"] > km:
+                    continue
+            results.append(result)
+        if near:
+            results.sort(key=lambda result: result["distance_km"])
+        return results[:limit] if limit else results
+
+    # Checked items of a section with the number of places listing them, most common first
+    def items(self, section):
+        return self.conn.execute("SELECT item, COUNT(*) FROM attributes WHERE section = ? GROUP BY item "
+                                 "ORDER BY COUNT(*) DESC", (section,)).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build and query the place index over the scraped details")
+    parser.add_argument("--index-file", default="place_index.sqlite")
+    parser.add_argument("--folders", default="餐廳詳細資訊,景點詳細資訊", help="Comma-separated output folders")
+    parser.add_argument("--input-file", help="Grid-search place list with 緯度 / 經度 columns")
+    parser.add_argument("--watch", type=float, help="Keep updating every this many seconds")
+    parser.add_argument("--open", help="Open at a time, e.g. 星期日,19:00 or 星期日,18:00,21:00")
+    parser.add_argument("--has", action="append", default=[],
+                        help="Section or section=item, repeatable, e.g. --has 付款方式=信用卡 --has 停車場")
+    parser.add_argument("--near", help="lat,lng,km")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    setup_logging()
+    index = PlaceIndex(args.index_file)
+    folders = args.folders.split(",")
+    index.update(folders, args.input_file)
+
+    if args.open or args.has or args.near:
+        attributes = {}
+        for condition in args.has:
+            section, _, item = condition.partition("=")
+            if item:
+                items = attributes.get(section)
+                attributes[section] = (items if isinstance(items, list) else []) + [item]
+            else:
+                attributes.setdefault(section, True)
+        near = tuple(float(value) for value in args.near.split(",")) if args.near else None
+        started = time.perf_counter()
+        results = index.query(tuple(args.open.split(",")) if args.open else None, attributes, near, limit=args.limit)
+        for result in results:
+            distance = f"\t{result['distance_km']} km" if "distance_km" in result else ""
+            print(f"{result['place_id']}\t{result['name']}\t{result['rating'] or ''}{distance}")
+        logger.info(f"{len(results)} places in {(time.perf_counter() - started) * 1000:.1f} ms")
+
+    while args.watch:
+        time.sleep(args.watch)
+        index.update(folders, args.input_file)
+    index.close()
@@ -0,0 +1,127 @@
+import os
+import csv
+import json
+import pickle
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Formats the input layer can read, in the order they are preferred
+INPUT_EXTENSIONS = [".csv", ".parquet", ".jsonl", ".xlsx"]
+
+# Pick the first existing input file for a base path without extension
+def resolve_input_file(base_path):
+    if os.path.splitext(base_path)[1] in INPUT_EXTENSIONS and os.path.exists(base_path):
+        return base_path
+    for ext in INPUT_EXTENSIONS:
+        path = os.path.splitext(base_path)[0] + ext
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No input file found for {base_path} ({', '.join(INPUT_EXTENSIONS)})")
+
+# Read CSV rows lazily, keeping only the requested columns
+def _iter_csv(path, columns):
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f):
+            yield tuple(row.get(column) for column in columns)
+
+# Read JSONL rows lazily, keeping only the requested columns
+def _iter_jsonl(path, columns):
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                row = json.loads(line)
+                yield tuple(row.get(column) for column in columns)
+
+# Read Parquet in record batches, loading only the requested columns
+def _iter_parquet(path, columns):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Reading Parquet input requires pyarrow: pip install pyarrow")
+    parquet_file = pq.ParquetFile(path)
+    present = [column for column in columns if column in parquet_file.schema_arrow.names]
+    for batch in parquet_file.iter_batches(columns=present):
+        data = batch.to_pydict()
+        for i in range(batch.num_rows):
+            yield tuple(data[column][i] if column in data else None for column in columns)
+
+# Read xlsx through openpyxl's streaming read-only mode, projecting columns by header
+def _iter_xlsx(path, columns):
+    from openpyxl import load_workbook
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, ())
+        indexes = [header.index(column) if column in header else None for column in columns]
+        for row in rows:
+            yield tuple(row[i] if i is not None and i < len(row) else None for i in indexes)
+    finally:
+        workbook.close()
+
+READERS = {
+    ".csv": _iter_csv,
+    ".jsonl": _iter_jsonl,
+    ".parquet": _iter_parquet,
+    ".xlsx": _iter_xlsx,
+}
+
+# Cache file next to the source, one per column projection
+def _cache_path(path, columns):
+    digest = hashlib.md5("\0".join(columns).encode("utf-8")).hexdigest()[:8]
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{name}.{digest}.cache")
+
+# Load cached rows if the cache matches the source file's mtime and size
+def _read_cache(cache_path, stat):
+    try:
+        with open(cache_path, "rb") as f:
+            cache = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if cache.get("mtime_ns") != stat.st_mtime_ns or cache.get("size") != stat.st_size:
+        return None
+    return cache["rows"]
+
+# Write the cache atomically, ignoring read-only locations
+def _write_cache(cache_path, stat, rows):
+    temp_path = cache_path + ".tmp"
+    try:
+        with open(temp_path, "wb") as f:
+            pickle.dump({"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "rows": rows}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, cache_path)
+    except OSError as e:
+        logger.warning(f"Failed to write input cache {cache_path}: {e}")
+
+# Yield rows as dicts with only the requested columns (the first one is the Place ID),
+# serving from the cache when fresh
+def iter_place_rows(path, columns=("Place ID",), use_cache=True):
+    columns = list(columns)
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in READERS:
+        raise ValueError(f"Unsupported input format: {path}")
+
+    stat = os.stat(path)
+    cache_path = _cache_path(path, columns)
+    rows = _read_cache(cache_path, stat) if use_cache else None
+    if rows is not None:
+        for row in rows:
+            yield dict(zip(columns, row))
+        return
+
+    collected = []
+    for row in READERS[ext](path, columns):
+        if row[0] is None or row[0] == "":
+            continue
+        row = (str(row[0]),) + tuple(row[1:])
+        collected.append(row)
+        yield dict(zip(columns, row))
+    if use_cache:
+        _write_cache(cache_path, stat, collected)
+
+# Yield Place IDs from any supported input file
+def iter_place_ids(path, use_cache=True):
+    for row in iter_place_rows(path, ["Place ID"], use_cache):
+        yield row["Place ID"]
@@ -0,0 +1,330 @@
+import math
+import time
+import heapq
+import csv
+import os
+import json
+import sqlite3
+import threading
+import requests
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
+
+# 全域每秒請求數限制（所有執行緒共用）
+class QpsLimiter:
+    def __init__(self, qps):
+        self.interval = 1.0 / qps if qps else 0
+        self.next_time = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait_time = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+# Nearby Search 每個查詢最多回傳 3 頁共 60 筆
+RESULT_CAP = 60
+
+# 依邊界切出初始的粗網格
+def make_cells(bounds, step):
+    cells = []
+    south = bounds["south"]
+    while south < bounds["north"]:
+        west = bounds["west"]
+        north = min(south + step, bounds["north"])
+        while west < bounds["east"]:
+            east = min(west + step, bounds["east"])
+            cells.append({"south": south, "north": north, "west": west, "east": east, "depth": 0})
+            west = east
+        south = north
+    return cells
+
+# 將網格切成四等分
+def split_cell(cell):
+    mid_lat = (cell["south"] + cell["north"]) / 2
+    mid_lng = (cell["west"] + cell["east"]) / 2
+    depth = cell["depth"] + 1
+    return [
+        {"south": cell["south"], "north": mid_lat, "west": cell["west"], "east": mid_lng, "depth": depth},
+        {"south": cell["south"], "north": mid_lat, "west": mid_lng, "east": cell["east"], "depth": depth},
+        {"south": mid_lat, "north": cell["north"], "west": cell["west"], "east": mid_lng, "depth": depth},
+        {"south": mid_lat, "north": cell["north"], "west": mid_lng, "east": cell["east"], "depth": depth},
+    ]
+
+# 剛好覆蓋整個網格的半徑（半對角線，公尺），重疊最小
+def cell_radius_m(cell):
+    mid_lat = math.radians((cell["south"] + cell["north"]) / 2)
+    dy = (cell["north"] - cell["south"]) * 111320
+    dx = (cell["east"] - cell["west"]) * 111320 * math.cos(mid_lat)
+    return math.ceil(math.hypot(dx, dy) / 2)
+
+# 網格對應的查詢任務
+def cell_task(cell, place_type):
+    return {
+        "location": {"lat": (cell["south"] + cell["north"]) / 2, "lng": (cell["west"] + cell["east"]) / 2},
+        "radius": cell_radius_m(cell),
+        "type": place_type,
+        "cell": cell,
+    }
+
+# 自適應四分樹：查詢結果達到 60 筆上限的網格才往下細分
+class QuadtreeSubdivider:
+    def __init__(self, max_depth=6, cap=RESULT_CAP):
+        self.max_depth = max_depth
+        self.cap = cap
+        self.split = 0
+        self.truncated = 0
+
+    def __call__(self, task, pages, results):
+        cell = task.get("cell")
+        if cell is None or results < self.cap:
+            return []
+        if cell["depth"] >= self.max_depth:
+            self.truncated += 1
+            return []
+        self.split += 1
+        return [cell_task(child, task["type"]) for child in split_cell(cell)]
+
+# 查詢結果的磁碟快取（SQLite），鍵為 (location, radius, type, pagetoken)
+# 分頁鏈只有在最後一頁也取得後才標記完成，中斷的鏈會在下次執行時重新查詢
+class ResponseCache:
+    def __init__(self, path, ttl_days=30):
+        self.ttl = ttl_days * 86400
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                location TEXT, radius INTEGER, type TEXT, pagetoken TEXT,
+                response TEXT, fetched_at REAL, complete INTEGER DEFAULT 0,
+                PRIMARY KEY (location, radius, type, pagetoken)
+            )
+        """)
+        self.conn.commit()
+        self.hits = 0
+
+    @staticmethod
+    def location_key(location):
+        return f"{location['lat']:.6f},{location['lng']:.6f}"
+
+    # 取得快取的回應，過期或分頁鏈未完成則回傳 None
+    def get(self, location, radius, place_type, pagetoken=None):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT response, fetched_at, complete FROM responses "
+                "WHERE location=? AND radius=? AND type=? AND pagetoken=?",
+                (self.location_key(location), radius, place_type, pagetoken or "")).fetchone()
+        if row is None or not row[2] or time.time() - row[1] > self.ttl:
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    # 儲存回應；沒有下一頁時將整條分頁鏈標記為完成
+    def put(self, location, radius, place_type, pagetoken, data):
+        key = (self.location_key(location), radius, place_type)
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, 0)",
+                (*key, pagetoken or "", json.dumps(data, ensure_ascii=False), time.time()))
+            if not data.get("next_page_token"):
+                self.conn.execute(
+                    "UPDATE responses SET complete=1 WHERE location=? AND radius=? AND type=?", key)
+            self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+# 邊查詢邊去重，將不重複的地點逐批附加寫入 CSV 或 JSONL；
+# 檔案已存在時先讀入既有的 Place ID，中斷後重跑會接續寫入
+class UniquePlaceWriter:
+    def __init__(self, path, fieldnames, key="Place ID"):
+        self.path = path
+        self.fieldnames = fieldnames
+        self.key = key
+        self.jsonl = path.endswith(".jsonl")
+        self.seen = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                if self.jsonl:
+                    rows = (json.loads(line) for line in f if line.strip())
+                else:
+                    rows = csv.DictReader(f)
+                self.seen = {row[key] for row in rows}
+            print(f"已讀入 {len(self.seen)} 個既有地點：{path}")
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        self.file = open(path, "a", encoding="utf-8", newline="")
+        self.writer = None if self.jsonl else csv.DictWriter(self.file, fieldnames=fieldnames)
+        if self.writer is not None and is_new:
+            self.writer.writeheader()
+        self.duplicates = 0
+
+    # 寫入一批資料，只保留尚未出現過的地點，回傳新增筆數
+    def add(self, rows):
+        added = 0
+        for row in rows:
+            if not row.get(self.key) or row[self.key] in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(row[self.key])
+            if self.jsonl:
+                self.file.write(json.dumps(row, ensure_ascii=False) + "\n")
+            else:
+                self.writer.writerow(row)
+            added += 1
+        self.file.flush()
+        return added
+
+    def close(self):
+        self.file.close()
+
+# Places API 用戶端：共用 keep-alive 連線池，網路錯誤時退避重試
+class PlacesClient:
+    def __init__(self, api_url, api_key, qps=10, pool_size=16, max_retries=3, timeout=15, cache=None):
+        self.api_url = api_url
+        self.cache = cache
+        self.api_key = api_key
+        self.limiter = QpsLimiter(qps)
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.calls = 0
+        self.calls_lock = threading.Lock()
+
+    # 發送單次查詢（先查快取），回傳 API 的 JSON
+    def query(self, location, radius, place_type, pagetoken=None):
+        if self.cache is not None:
+            data = self.cache.get(location, radius, place_type, pagetoken)
+            if data is not None:
+                data["_from_cache"] = True
+                return data
+            data = self._fetch(location, radius, place_type, pagetoken)
+            if data.get("status") in ("OK", "ZERO_RESULTS"):
+                self.cache.put(location, radius, place_type, pagetoken, data)
+            return data
+        return self._fetch(location, radius, place_type, pagetoken)
+
+    def _fetch(self, location, radius, place_type, pagetoken=None):
+        params = {
+            "location": f"{location['lat']},{location['lng']}",
+            "radius": radius,
+            "type": place_type,
+            "key": self.api_key,
+        }
+        if pagetoken:
+            params["pagetoken"] = pagetoken
+
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            with self.calls_lock:
+                self.calls += 1
+            try:
+                response = self.session.get(self.api_url, params=params, timeout=self.timeout)
+                response.raise_for_status()
+                return response.json()
+            except (requests.RequestException, ValueError) as e:
+                if attempt == self.max_retries:
+                    return {"status": "REQUEST_FAILED", "error_message": str(e)}
+                time.sleep(2 ** attempt)
+
+    def close(self):
+        self.session.close()
+
+# 並行查詢引擎：每個 HTTP 請求是一個工作單位，分頁與 OVER_QUERY_LIMIT 重試
+# 排入延遲佇列，等待期間其他網格點的查詢照常進行
+class SearchEngine:
+    def __init__(self, client, max_workers=8, page_token_delay=2, max_retries=5, backoff=2):
+        self.client = client
+        self.max_workers = max_workers
+        self.page_token_delay = page_token_delay
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    # tasks: [{"location": {...}, "radius": ..., "type": ...}]
+    # on_page(task, data) 在主執行緒處理每一頁結果
+    # on_task_done(task, pages, results) 在任務所有分頁完成後呼叫，可回傳新任務
+    def run(self, tasks, on_page, on_task_done=None, progress_every=100):
+        heap = []
+        seq = 0
+        now = time.monotonic()
+        for task in tasks:
+            heapq.heappush(heap, (now, seq, task, None, 0))
+            seq += 1
+
+        total_tasks = len(heap)
+        finished_tasks = 0
+        task_stats = {}
+        in_flight = {}
+        started = time.monotonic()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while heap or in_flight:
+                # 送出所有已到時間的請求
+                now = time.monotonic()
+                while heap and heap[0][0] <= now and len(in_flight) < self.max_workers * 2:
+                    ready, _, task, token, attempt = heapq.heappop(heap)
+                    future = executor.submit(self.client.query, task["location"], task["radius"], task["type"], token)
+                    in_flight[future] = (task, token, attempt)
+
+                timeout = max(0.05, heap[0][0] - now) if heap else None
+                if not in_flight:
+                    time.sleep(timeout)
+                    continue
+                done, _ = wait(list(in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    task, token, attempt = in_flight.pop(future)
+                    data = future.result()
+                    status = data.get("status")
+
+                    # 超過配額或分頁 token 尚未生效：退避後重排
+                    retry_delay = None
+                    if status == "OVER_QUERY_LIMIT":
+                        retry_delay = self.backoff * (2 ** attempt)
+                    elif status == "INVALID_REQUEST" and token:
+                        retry_delay = self.page_token_delay
+                    if retry_delay is not None and attempt < self.max_retries:
+                        heapq.heappush(heap, (time.monotonic() + retry_delay, seq, task, token, attempt + 1))
+                        seq += 1
+                        continue
+
+                    stats = task_stats.setdefault(id(task), {"pages": 0, "results": 0})
+                    if status in ("OK", "ZERO_RESULTS"):
+                        stats["pages"] += 1
+                        stats["results"] += len(data.get("results", []))
+                        on_page(task, data)
+                    else:
+                        print(f"查詢失敗 {status}: {task['type']} {task['location']} {data.get('error_message', '')}")
+
+                    # 檢查是否有下一頁，分頁查詢需要延遲
+                    # 快取中的分頁不需要等待 token 生效
+                    next_page_token = data.get("next_page_token") if status == "OK" else None
+                    if next_page_token:
+                        delay = 0 if data.get("_from_cache") else self.page_token_delay
+                        heapq.heappush(heap, (time.monotonic() + delay, seq, task, next_page_token, 0))
+                        seq += 1
+                        continue
+
+                    # 任務完成
+                    task_stats.pop(id(task), None)
+                    finished_tasks += 1
+                    if on_task_done:
+                        for new_task in on_task_done(task, stats["pages"], stats["results"]) or []:
+                            heapq.heappush(heap, (time.monotonic(), seq, new_task, None, 0))
+                            seq += 1
+                            total_tasks += 1
+                    if finished_tasks % progress_every == 0:
+                        elapsed = time.monotonic() - started
+                        print(f"已完成 {finished_tasks}/{total_tasks} 個查詢任務，API 呼叫 {self.client.calls} 次，耗時 {elapsed:.0f} 秒")
+
+        cache_hits = self.client.cache.hits if self.client.cache is not None else 0
+        print(f"全部 {finished_tasks} 個查詢任務完成，API 呼叫 {self.client.calls} 次，快取命中 {cache_hits} 次")
+        return finished_tasks
@@ -0,0 +1,115 @@
+import os
+import logging
+import psutil
+from selenium.common.exceptions import TimeoutException
+
+logger = logging.getLogger(__name__)
+
+# Browser processes are owned by the scraper run that launched them. The run ID lives in the
+# SCRAPER_RUN_ID environment variable, which chromedriver and Chrome inherit from the worker,
+# so a run can find its own processes (even orphaned ones) and never touches anyone else's.
+RUN_ENV = "SCRAPER_RUN_ID"
+
+# Per-command bounds so one hung page cannot stall a worker
+PAGE_LOAD_TIMEOUT = float(os.environ.get("SCRAPER_PAGE_LOAD_TIMEOUT", 45))
+SCRIPT_TIMEOUT = float(os.environ.get("SCRAPER_SCRIPT_TIMEOUT", 30))
+
+# Run ID of the current process, created for this process when no parent set one
+def ensure_run_id():
+    if RUN_ENV not in os.environ:
+        os.environ[RUN_ENV] = f"{os.getpid()}-{int(psutil.Process().create_time())}"
+    return os.environ[RUN_ENV]
+
+# Start a new run owned by this process, first cleaning up browsers left by runs that died
+def start_run():
+    os.environ.pop(RUN_ENV, None)
+    run_id = ensure_run_id()
+    kill_stale_runs()
+    return run_id
+
+# Whether the process that owns a run is still alive
+def run_alive(run_id):
+    try:
+        pid, created = run_id.split("-")
+        return int(psutil.Process(int(pid)).create_time()) == int(created)
+    except (ValueError, psutil.Error):
+        return False
+
+# Processes (other than this one and its ancestors) carrying a run ID, as {run_id: [process]}
+def tagged_processes():
+    own = {os.getpid()} | {p.pid for p in psutil.Process().parents()}
+    runs = {}
+    for proc in psutil.process_iter():
+        if proc.pid in own:
+            continue
+        try:
+            run_id = proc.environ().get(RUN_ENV)
+        except (psutil.Error, OSError):
+            continue
+        if run_id:
+            runs.setdefault(run_id, []).append(proc)
+    return runs
+
+# Terminate processes, killing any that ignore it within timeout seconds; returns how many were stopped
+def kill_processes(procs, timeout=5):
+    procs = [p for p in procs if p.is_running()]
+    for proc in procs:
+        try:
+            proc.terminate()
+        except psutil.Error:
+            pass
+    _, alive = psutil.wait_procs(procs, timeout=timeout)
+    for proc in alive:
+        try:
+            proc.kill()
+        except psutil.Error:
+            pass
+    return len(procs)
+
+# A process and all of its descendants
+def process_tree(pid):
+    try:
+        root = psutil.Process(pid)
+        return [root] + root.children(recursive=True)
+    except psutil.Error:
+        return []
+
+def kill_tree(pid, timeout=5):
+    return kill_processes(process_tree(pid), timeout)
+
+# Stop every process still tagged with a run ID (this run's by default)
+def kill_run_processes(run_id=None, timeout=5):
+    run_id = run_id or os.environ.get(RUN_ENV)
+    if not run_id:
+        return 0
+    killed = kill_processes(tagged_processes().get(run_id, []), timeout)
+    if killed:
+        logger.info(f"Stopped {killed} leftover browser processes of run {run_id}")
+    return killed
+
+# Stop browser processes whose run owner no longer exists
+def kill_stale_runs(timeout=5):
+    killed = 0
+    for run_id, procs in tagged_processes().items():
+        if not run_alive(run_id):
+            killed += kill_processes(procs, timeout)
+    if killed:
+        logger.info(f"Stopped {killed} browser processes left by earlier runs")
+    return killed
+
+# Bound page loads and scripts of a driver
+def apply_timeouts(driver, page_load_timeout=None, script_timeout=None):
+    driver.set_page_load_timeout(page_load_timeout or PAGE_LOAD_TIMEOUT)
+    driver.set_script_timeout(script_timeout or SCRIPT_TIMEOUT)
+
+# driver.get that stops a page still loading at the page-load timeout; Maps keeps requests open
+# long after the panel rendered, so the caller's ready check decides whether the page is usable
+def load_page(driver, url):
+    try:
+        driver.get(url)
+    except TimeoutException:
+        logger.debug(f"Page load timed out, stopping it: {url}")
+        try:
+            driver.execute_script("window.stop();")
+        except Exception:
+            pass
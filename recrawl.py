@@ -0,0 +1,171 @@
+import os
+import json
+import math
+import time
+import logging
+import argparse
+from place_source import iter_place_rows, resolve_input_file
+from crawl_state import CrawlState
+from multi_element_scraper import FIELDS
+from metrics import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Change-driven recrawls. The grid search already returns 評分 and 評論數 for every place; the
+# scheduler records them as signals in the crawl state, scores each crawled place by how far its
+# signals moved since it was last crawled, how long ago that was and how often it has been failing,
+# and hands the best-scoring places that fit a time budget to the detail and review scrapers.
+# Places never crawled are left to the regular runs, which pick them up anyway.
+
+PARTS = {"details": ("餐廳詳細資訊", "景點詳細資訊"), "reviews": ("餐廳評論爬蟲", "景點評論爬蟲")}
+
+# Estimated worker seconds per place: a detail page, or a review refresh that scrolls only as far
+# as the new reviews (about ten per scroll)
+DETAIL_SECONDS = 10
+REVIEW_SECONDS = 8
+SECONDS_PER_NEW_REVIEW = 0.3
+
+# Scores below this are not worth a visit; a place whose signals did not move reaches it once
+# its crawl is MAX_AGE_DAYS old
+MIN_SCORE = 1.0
+MAX_AGE_DAYS = 90
+FAILURE_PENALTY = 0.5
+
+def parse_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number == number else None  # NaN
+
+# Priority of recrawling a place from its signal row (see CrawlState.signal_rows)
+def priority(row, now=None):
+    now = now or time.time()
+    new_reviews = max(0, (row["review_count"] or 0) - (row["crawled_review_count"] or 0))
+    rating_change = abs((row["rating"] or 0) - (row["crawled_rating"] or 0))
+    age_days = (now - row["completed_at"]) / 86400 if row["completed_at"] else MAX_AGE_DAYS
+
+    score = math.log1p(new_reviews)  # 1 new review ~0.7, 10 ~2.4, 100 ~4.6
+    score += 2 * min(1.0, new_reviews / max(row["crawled_review_count"] or 0, 10))  # Relative growth
+    score += 10 * rating_change  # A 0.1 move in the average matters
+    score += age_days / MAX_AGE_DAYS
+    score -= FAILURE_PENALTY * (row["failures"] or 0)
+    return score
+
+def estimated_seconds(part, row):
+    if part == "details":
+        return DETAIL_SECONDS
+    new_reviews = max(0, (row["review_count"] or 0) - (row["crawled_review_count"] or 0))
+    return REVIEW_SECONDS + SECONDS_PER_NEW_REVIEW * new_reviews
+
+# Record the snapshot's signals for every kind, settle finished recrawls, and return the recrawls
+# worth doing, best first, as dicts with part, place_id, score, seconds and review_count.
+# Places on the dead-letter list are never scheduled
+def plan_recrawls(input_file, kinds, state_file="crawl_state.sqlite", min_score=MIN_SCORE):
+    input_file = resolve_input_file(input_file)
+    rows = []
+    for row in iter_place_rows(input_file, ["Place ID", "評分", "評論數"]):
+        review_count = parse_number(row["評論數"])
+        review_count = int(review_count) if review_count is not None else None
+        rows.append((row["Place ID"], parse_number(row["評分"]), review_count))
+    logger.info(f"Read signals of {len(rows)} places from {input_file}")
+
+    state = CrawlState(state_file)
+    now = time.time()
+    candidates = []
+    try:
+        for part, kind in kinds.items():
+            state.record_signals(kind, rows)
+            settled = state.settle_signals(kind)
+            if settled:
+                logger.info(f"{settled} recrawls of {kind} finished since the last plan")
+            for row in state.signal_rows(kind):
+                if row["status"] == "dead":
+                    continue
+                score = priority(row, now)
+                if score >= min_score:
+                    candidates.append({"part": part, "place_id": row["place_id"], "score": round(score, 3),
+                                       "seconds": estimated_seconds(part, row), "review_count": row["review_count"]})
+    finally:
+        state.close()
+
+    candidates.sort(key=lambda candidate: candidate["score"], reverse=True)
+    return candidates
+
+# The best recrawls that fit budget_seconds of worker time, at most top_k of them
+def select(candidates, budget_seconds=None, top_k=None):
+    selected = []
+    spent = 0
+    for candidate in candidates:
+        if top_k and len(selected) >= top_k:
+            break
+        if budget_seconds is not None and spent + candidate["seconds"] > budget_seconds:
+            continue
+        selected.append(candidate)
+        spent += candidate["seconds"]
+    logger.info(f"Selected {len(selected)} of {len(candidates)} changed places, about {spent / 60:.0f} worker minutes")
+    return selected
+
+# Write one part's recrawls as a place list the scrapers read (JSONL with Place ID and 評論數)
+def write_plan(path, recrawls):
+    with open(path, "w", encoding="utf-8") as f:
+        for recrawl in recrawls:
+            f.write(json.dumps({"Place ID": recrawl["place_id"], "評論數": recrawl["review_count"]},
+                               ensure_ascii=False) + "\n")
+    return path
+
+# Plan, then recrawl the selected places: details are scraped again in full over the stored record
+# (detail_fields limits them), reviews are refreshed with only the new ones merged in.
+# budget_minutes is wall time for num_processes workers
+def run_recrawl(input_file, num_processes, is_restaurant=True, budget_minutes=60, top_k=None, parts=("details", "reviews"),
+                detail_fields=None, state_file="crawl_state.sqlite", sink_name=None, plan_only=False):
+    kinds = {part: PARTS[part][0 if is_restaurant else 1] for part in parts}
+    candidates = plan_recrawls(input_file, kinds, state_file)
+    budget_seconds = budget_minutes * 60 * num_processes if budget_minutes else None
+    selected = select(candidates, budget_seconds, top_k)
+
+    for part, kind in kinds.items():
+        recrawls = [recrawl for recrawl in selected if recrawl["part"] == part]
+        logger.info(f"{part}: {len(recrawls)} places to recrawl")
+        if not recrawls or plan_only:
+            continue
+        plan_file = write_plan(f"recrawl_{part}.jsonl", recrawls)
+
+        state = CrawlState(state_file)
+        state.plan_signals(kind, [recrawl["place_id"] for recrawl in recrawls])
+        state.close()
+
+        if part == "details":
+            from parallel_detail_scraper import parallel_scrape
+            parallel_scrape(plan_file, num_processes, is_restaurant, cost_column="評論數", state_file=state_file,
+                            sink_name=sink_name, fields=detail_fields or FIELDS)
+        else:
+            from parallel_review_scraper import parallel_scrape
+            parallel_scrape(plan_file, num_processes, is_restaurant, refresh=True, state_file=state_file)
+
+        state = CrawlState(state_file)
+        logger.info(f"{state.settle_signals(kind)} {kind} recrawls finished")
+        state.close()
+        os.remove(plan_file)
+    return selected
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recrawl the places whose grid-search signals changed")
+    parser.add_argument("input_file", help="Latest grid-search output with Place ID, 評分 and 評論數")
+    parser.add_argument("--processes", type=int, default=6)
+    parser.add_argument("--attractions", action="store_true", help="Recrawl attractions instead of restaurants")
+    parser.add_argument("--budget-minutes", type=float, default=60, help="Wall time for all processes; 0 for no limit")
+    parser.add_argument("--top-k", type=int, help="Recrawl at most this many places")
+    parser.add_argument("--parts", default="details,reviews", help="details, reviews or both")
+    parser.add_argument("--fields", help="Detail fields to recrawl, e.g. 評分,開始營業時間 (default: all)")
+    parser.add_argument("--state-file", default="crawl_state.sqlite")
+    parser.add_argument("--sink", default=None, help="json, jsonl, sqlite or parquet")
+    parser.add_argument("--plan-only", action="store_true", help="Print the plan without scraping")
+    args = parser.parse_args()
+
+    setup_logging()
+    selected = run_recrawl(args.input_file, args.processes, not args.attractions, args.budget_minutes, args.top_k,
+                           args.parts.split(","), args.fields, args.state_file, args.sink, args.plan_only)
+    if args.plan_only:
+        for recrawl in selected:
+            print(f"{recrawl['part']}\t{recrawl['place_id']}\t{recrawl['score']}\t{recrawl['seconds']:.0f}s")
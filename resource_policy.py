@@ -0,0 +1,121 @@
+import os
+import json
+import logging
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+# Resource policies applied when a driver is created; the scrapers only read DOM text,
+# so images, media, fonts, map tiles, WebGL and telemetry can all be dropped
+RESOURCE_POLICIES = {
+    "off": None,
+    "lean": {
+        "block_images": True,
+        "disable_webgl": True,
+        "blocked_urls": [
+            # Photos and map tiles
+            "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.ico",
+            "*googleusercontent.com/*", "*.ggpht.com/*", "*/maps/vt*", "*/kh/v=*",
+            "*khms*.google.com/*", "*streetviewpixels-pa.googleapis.com/*",
+            # Fonts and media
+            "*.woff", "*.woff2", "*.ttf", "*.otf", "*fonts.gstatic.com/*",
+            "*.mp4", "*.webm", "*.mp3",
+            # Telemetry
+            "*/gen_204*", "*/log?*", "*/csi?*", "*play.google.com/log*",
+            "*google-analytics.com/*", "*googletagmanager.com/*", "*doubleclick.net/*",
+        ],
+    },
+}
+
+# Rough transfer size of a blocked request by CDP resource type, used to estimate savings
+ESTIMATED_BYTES = {
+    "Image": 35_000,
+    "Font": 45_000,
+    "Media": 250_000,
+    "Ping": 500,
+    "XHR": 2_000,
+    "Fetch": 2_000,
+    "Other": 5_000,
+}
+
+# Policy name from SCRAPER_RESOURCE_POLICY, "lean" by default
+def default_policy():
+    return os.environ.get("SCRAPER_RESOURCE_POLICY", "lean")
+
+# Look up a policy by name, or pass a custom policy dict through
+def get_policy(policy):
+    if isinstance(policy, dict) or policy is None:
+        return policy
+    if policy not in RESOURCE_POLICIES:
+        raise ValueError(f"Unknown resource policy: {policy}")
+    return RESOURCE_POLICIES[policy]
+
+# Add Chrome options for the policy before the driver starts. The performance log, which
+# page_transfer_report reads, is only turned on for callers that drain it after every page,
+# since chromedriver buffers it without limit
+def apply_to_options(options, policy, performance_log=False):
+    policy = get_policy(policy)
+    if not policy:
+        return
+    if policy.get("block_images"):
+        options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+    if policy.get("disable_webgl"):
+        options.add_argument("--disable-webgl")
+        options.add_argument("--disable-3d-apis")
+    if performance_log:
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+
+# Install URL blocking through CDP once the driver is running
+def apply_to_driver(driver, policy):
+    policy = get_policy(policy)
+    if not policy:
+        return
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": policy.get("blocked_urls", [])})
+    logger.info(f"Resource policy installed, blocking {len(policy.get('blocked_urls', []))} URL patterns")
+
+_totals = {"pages": 0, "transferred": 0, "blocked": 0, "saved": 0}
+
+# Summarise bytes transferred and blocked since the last call from the performance log
+def page_transfer_report(driver):
+    try:
+        entries = driver.get_log("performance")
+    except Exception:
+        return None
+
+    types = {}
+    report = {"transferred": 0, "blocked": 0, "saved": 0, "blocked_by_type": {}}
+    for entry in entries:
+        try:
+            message = json.loads(entry["message"])["message"]
+        except (KeyError, ValueError):
+            continue
+        method = message.get("method")
+        params = message.get("params", {})
+        if method == "Network.requestWillBeSent":
+            types[params.get("requestId")] = params.get("type", "Other")
+        elif method == "Network.loadingFinished":
+            report["transferred"] += params.get("encodedDataLength", 0)
+        elif method == "Network.loadingFailed" and params.get("blockedReason"):
+            resource_type = params.get("type") or types.get(params.get("requestId"), "Other")
+            report["blocked"] += 1
+            report["saved"] += ESTIMATED_BYTES.get(resource_type, ESTIMATED_BYTES["Other"])
+            report["blocked_by_type"][resource_type] = report["blocked_by_type"].get(resource_type, 0) + 1
+
+    _totals["pages"] += 1
+    for key in ("transferred", "blocked", "saved"):
+        _totals[key] += report[key]
+    return report
+
+# Log the transfer report of the last page and the running total of this process
+def report_page_transfer(driver):
+    report = page_transfer_report(driver)
+    if report is None:
+        return None
+    metrics = get_metrics()
+    metrics.inc("scraper_transferred_bytes_total", report["transferred"])
+    metrics.inc("scraper_blocked_requests_total", report["blocked"])
+    logger.debug(f"Page transferred {report['transferred'] / 1024:.0f} KB, blocked {report['blocked']} requests "
+          f"(~{report['saved'] / 1024:.0f} KB saved); process total over {_totals['pages']} pages: "
+          f"{_totals['transferred'] / 1048576:.1f} MB transferred, ~{_totals['saved'] / 1048576:.1f} MB saved")
+    return report
@@ -0,0 +1,328 @@
+import os
+import re
+import gzip
+import json
+import time
+import glob
+import hashlib
+import sqlite3
+import logging
+import argparse
+from collections import Counter, OrderedDict
+from output_sink import next_shard_path
+from metrics import get_metrics, setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed review store. Every review text is kept once, under a hash of the text, no
+# matter how many crawls or places saw it:
+#   blocks/part-{pid}-{seq}.jsonl.gz|.zst   compressed JSON Lines of new texts, written once and
+#                                           never changed, one JSON string per line
+#   index.sqlite                            where each text is (block, line), and every review a
+#                                           place listed with its own 日期, 作者 and page position
+# A place's review is identified by its text, author and occurrence (the n-th identical text by
+# the same author on the page), so repeated short reviews such as "好吃" are all kept and each
+# keeps its own date; a recrawl only adds the occurrences not seen before.
+# Texts are keyed by the first 64 bits of their hash, which keeps the index small.
+# Updates only append blocks and index rows, so several processes can add to the same store
+# and a crash leaves at most an unreferenced block behind
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blocks (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    reviews INTEGER NOT NULL,
+    raw_bytes INTEGER NOT NULL,
+    stored_bytes INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY,
+    block INTEGER NOT NULL,
+    line INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS places (
+    id INTEGER PRIMARY KEY,
+    place_id TEXT NOT NULL UNIQUE,
+    first_block INTEGER,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS places_block ON places (first_block);
+CREATE TABLE IF NOT EXISTS place_reviews (
+    place INTEGER NOT NULL,
+    review INTEGER NOT NULL,
+    author TEXT NOT NULL,
+    occurrence INTEGER NOT NULL,
+    crawled_at INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    date TEXT,
+    PRIMARY KEY (place, review, author, occurrence)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sources (source TEXT PRIMARY KEY, updated_at REAL NOT NULL);
+"""
+
+CODECS = {"gzip": ".gz", "zstd": ".zst"}
+ZSTD_LEVEL = 10
+
+# Stable fingerprint of a review; relative dates ("一個月前") change between crawls so they are left out
+def review_fingerprint(text, author=""):
+    normalized = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha1(f"{author}\n{normalized}".encode("utf-8")).hexdigest()
+
+# Reviews of a scraper output file ({place_id}.json keyed "評論 1"... or {place_id}.jsonl),
+# as [{"內容", "日期", "作者"?}, ...] in page order
+def read_review_file(path):
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            reviews = [json.loads(line) for line in f if line.strip()]
+        else:
+            reviews = list(json.load(f).values())
+    return [{key: review[key] for key in ("內容", "日期", "作者") if key in review} for review in reviews]
+
+# Codec used when none is given, from SCRAPER_REVIEW_CODEC; gzip needs no extra package
+def default_codec():
+    return os.environ.get("SCRAPER_REVIEW_CODEC", "gzip")
+
+def zstd_module():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("The zstd review codec requires zstandard: pip install zstandard")
+    return zstandard
+
+def compress(data, codec):
+    if codec == "zstd":
+        return zstd_module().ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, compresslevel=9)
+
+# Decompress a block, picking the codec from its file name
+def decompress(data, name):
+    if name.endswith(CODECS["zstd"]):
+        return zstd_module().ZstdDecompressor().decompressobj().decompress(data)
+    return gzip.decompress(data)
+
+# Text key: the first 64 bits of the SHA-1 of the exact text as a signed SQLite integer
+def text_key(text):
+    return int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "big", signed=True)
+
+# Hex form of a text key
+def key_hex(key):
+    return key.to_bytes(8, "big", signed=True).hex()
+
+class ReviewStore:
+    def __init__(self, path="review_store", codec=None, block_reviews=5000, cached_blocks=8):
+        codec = codec or default_codec()
+        if codec not in CODECS:
+            raise ValueError(f"Unknown review codec: {codec} ({', '.join(CODECS)})")
+        if codec == "zstd":
+            zstd_module()
+        self.path = path
+        self.codec = codec
+        self.block_reviews = block_reviews
+        self.cached_blocks = cached_blocks
+        self.block_dir = os.path.join(path, "blocks")
+        os.makedirs(self.block_dir, exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(path, "index.sqlite"), timeout=30)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self.conn.commit()
+        self.pending = {}  # key -> text, texts not stored yet
+        self.members = []  # (place_id, key, author, occurrence, crawled_at, position, date) not indexed yet
+        self.pid = os.getpid()
+        self.seq = 0
+        self.cache = OrderedDict()  # block id -> lines
+
+    # Add one crawl of a place's reviews (page order, [{"內容", "日期", "作者"?}, ...]); texts
+    # already stored are only referenced. Returns how many texts were new
+    def add(self, place_id, reviews, crawled_at=None):
+        crawled_at = int(crawled_at or time.time())
+        occurrences = Counter()
+        new = 0
+        for position, review in enumerate(reviews):
+            text = review.get("內容")
+            if not text:
+                continue
+            key = text_key(text)
+            author = review.get("作者") or ""
+            if key not in self.pending and not self._stored(key):
+                self.pending[key] = text
+                new += 1
+            self.members.append((place_id, key, author, occurrences[key, author], crawled_at, position,
+                                 review.get("日期")))
+            occurrences[key, author] += 1
+        if len(self.pending) >= self.block_reviews:
+            self.flush()
+        return new
+
+    def _stored(self, key):
+        return self.conn.execute("SELECT 1 FROM reviews WHERE id=?", (key,)).fetchone() is not None
+
+    # Write the pending reviews as one block, then index them with the pending memberships;
+    # the block is on disk before any row points at it
+    def flush(self):
+        if not self.pending and not self.members:
+            return
+        pending, self.pending = self.pending, {}
+        members, self.members = self.members, []
+        with get_metrics().timer("save", sink="review_store"):
+            block = self._write_block(pending) if pending else None
+            with self.conn:
+                if block:
+                    name, raw_bytes, stored_bytes = block
+                    block_id = self.conn.execute("INSERT INTO blocks (name, reviews, raw_bytes, stored_bytes, created_at) "
+                                                 "VALUES (?, ?, ?, ?, ?)",
+                                                 (name, len(pending), raw_bytes, stored_bytes, time.time())).lastrowid
+                    # Another process may have stored the same review meanwhile; the first copy wins
+                    self.conn.executemany("INSERT OR IGNORE INTO reviews (id, block, line) VALUES (?, ?, ?)",
+                                          ((key, block_id, line) for line, key in enumerate(pending)))
+                else:
+                    # Only known reviews: the places read from the latest block
+                    block_id = self.conn.execute("SELECT MAX(id) FROM blocks").fetchone()[0]
+
+                places = {}
+                now = time.time()
+                for place_id in dict.fromkeys(member[0] for member in members):
+                    self.conn.execute("INSERT INTO places (place_id, first_block, updated_at) VALUES (?, ?, ?) "
+                                      "ON CONFLICT (place_id) DO UPDATE SET updated_at = excluded.updated_at",
+                                      (place_id, block_id, now))
+                    places[place_id] = self._place(place_id)
+                # Occurrences seen by an earlier crawl keep their first date and position
+                self.conn.executemany("INSERT OR IGNORE INTO place_reviews "
+                                      "(place, review, author, occurrence, crawled_at, position, date) "
+                                      "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                      ((places[member[0]], *member[1:]) for member in members))
+        if block:
+            logger.debug(f"Stored {len(pending)} new texts in {name} ({stored_bytes} of {raw_bytes} bytes)")
+
+    def _write_block(self, pending):
+        raw = "".join(json.dumps(text, ensure_ascii=False) + "\n" for text in pending.values()).encode("utf-8")
+        data = compress(raw, self.codec)
+        path, self.seq = next_shard_path(self.block_dir, ".jsonl" + CODECS[self.codec], self.pid, self.seq)
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+        self.seq += 1
+        return os.path.basename(path), len(raw), len(data)
+
+    def _place(self, place_id):
+        row = self.conn.execute("SELECT id FROM places WHERE place_id=?", (place_id,)).fetchone()
+        return row[0] if row else None
+
+    def _source_updated(self, source):
+        row = self.conn.execute("SELECT updated_at FROM sources WHERE source=?", (source,)).fetchone()
+        return row[0] if row else None
+
+    # Add the review files of a scraper output folder saved since its last update; returns how
+    # many new reviews were stored
+    def update_folder(self, folder):
+        source = f"reviews:{os.path.abspath(folder)}"
+        since = self._source_updated(source) or 0
+        started = time.time()
+        new = files = 0
+        for path in sorted(glob.glob(os.path.join(folder, "*.json")) + glob.glob(os.path.join(folder, "*.jsonl"))):
+            modified = os.path.getmtime(path)
+            if modified <= since:
+                continue
+            try:
+                reviews = read_review_file(path)
+            except (OSError, ValueError, KeyError, AttributeError) as e:
+                logger.warning(f"Failed to read {path}: {e}")
+                continue
+            new += self.add(os.path.basename(path).split(".")[0], reviews, modified)
+            files += 1
+        self.flush()
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO sources (source, updated_at) VALUES (?, ?)", (source, started))
+        if files:
+            logger.info(f"Stored {new} new reviews from {files} files in {folder}")
+        return new
+
+    # Lines of a block, keeping the most recently used blocks decompressed
+    def _block(self, block_id):
+        if block_id in self.cache:
+            self.cache.move_to_end(block_id)
+            return self.cache[block_id]
+        name = self.conn.execute("SELECT name FROM blocks WHERE id=?", (block_id,)).fetchone()[0]
+        with open(os.path.join(self.block_dir, name), "rb") as f:
+            lines = decompress(f.read(), name).decode("utf-8").splitlines()
+        self.cache[block_id] = lines
+        if len(self.cache) > self.cached_blocks:
+            self.cache.popitem(last=False)
+        return lines
+
+    # Reviews of a place, newest crawl first and in page order within a crawl; each carries the
+    # id of its text and the 爬取日期 it was first seen on, since 日期 is relative to that day
+    def reviews(self, place_id):
+        rows = self.conn.execute("SELECT r.id, r.block, r.line, m.author, m.date, m.crawled_at FROM places p "
+                                 "JOIN place_reviews m ON m.place = p.id JOIN reviews r ON r.id = m.review "
+                                 "WHERE p.place_id = ? ORDER BY m.crawled_at DESC, m.position", (place_id,)).fetchall()
+        reviews = []
+        for key, block, line, author, date, crawled_at in rows:
+            review = {"id": key_hex(key), "內容": json.loads(self._block(block)[line]), "日期": date}
+            if author:
+                review["作者"] = author
+            review["爬取日期"] = time.strftime("%Y-%m-%d", time.localtime(crawled_at))
+            reviews.append(review)
+        return reviews
+
+    # Yield (place_id, reviews) for every place (or the given ones) in the order they were stored,
+    # so consecutive places mostly read the same cached blocks
+    def iter_places(self, place_ids=None):
+        if place_ids is None:
+            place_ids = [row[0] for row in self.conn.execute("SELECT place_id FROM places ORDER BY first_block, id")]
+        for place_id in place_ids:
+            yield place_id, self.reviews(place_id)
+
+    # Yield every distinct review text once with its id, block by block, for corpus-wide jobs;
+    # copies of a text that another process stored first are not indexed and are skipped
+    def iter_reviews(self):
+        for key, block, line in self.conn.execute("SELECT id, block, line FROM reviews ORDER BY block, line"):
+            yield {"id": key_hex(key), "內容": json.loads(self._block(block)[line])}
+
+    def stats(self):
+        members = self.conn.execute("SELECT COUNT(*) FROM place_reviews").fetchone()[0]
+        places = self.conn.execute("SELECT COUNT(*) FROM places").fetchone()[0]
+        reviews = self.conn.execute("SELECT COUNT(*) FROM reviews").fetchone()[0]
+        blocks, raw_bytes, stored_bytes = self.conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(raw_bytes), 0), COALESCE(SUM(stored_bytes), 0) FROM blocks").fetchone()
+        return {"places": places, "place_reviews": members, "texts": reviews, "blocks": blocks,
+                "raw_bytes": raw_bytes, "stored_bytes": stored_bytes,
+                "index_bytes": os.path.getsize(os.path.join(self.path, "index.sqlite"))}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Store scraped reviews deduplicated and block-compressed")
+    parser.add_argument("folders", nargs="*", default=["餐廳評論爬蟲", "景點評論爬蟲"], help="Review output folders to add")
+    parser.add_argument("--store", default="review_store")
+    parser.add_argument("--codec", choices=list(CODECS), help="Block compression (default: gzip)")
+    parser.add_argument("--block-reviews", type=int, default=5000, help="New review texts per block")
+    parser.add_argument("--watch", type=float, help="Keep adding new review files every this many seconds")
+    parser.add_argument("--place", help="Print the stored reviews of one Place ID instead")
+    args = parser.parse_args()
+
+    setup_logging()
+    with ReviewStore(args.store, args.codec, args.block_reviews) as store:
+        if args.place:
+            for review in store.reviews(args.place):
+                print(json.dumps(review, ensure_ascii=False))
+        else:
+            while True:
+                for folder in args.folders:
+                    if os.path.isdir(folder):
+                        store.update_folder(folder)
+                logger.info(f"Review store: {store.stats()}")
+                if not args.watch:
+                    break
+                time.sleep(args.watch)
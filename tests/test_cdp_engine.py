@@ -0,0 +1,34 @@
+import time
+import asyncio
+import pytest
+
+cdp_engine = pytest.importorskip("cdp_engine")
+
+class StalledConnection:
+    async def send(self, method, params=None, session_id=None, timeout=30):
+        raise asyncio.TimeoutError()
+
+def test_tab_close_tolerates_a_stalled_browser():
+    tab = cdp_engine.Tab(StalledConnection(), "context", "session")
+    asyncio.run(tab.close())
+
+def test_blocking_calls_run_off_the_event_loop():
+    engine = cdp_engine.CDPEngine("details", "reviews", "state.sqlite", num_tabs=1, policy={})
+    engine.io = cdp_engine.ThreadPoolExecutor(max_workers=1)
+
+    async def main():
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        await engine.blocking(time.sleep, 0.2)
+        ticker.cancel()
+        return ticks
+
+    assert asyncio.run(main()) >= 10
+    engine.io.shutdown()
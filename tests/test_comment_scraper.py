@@ -0,0 +1,55 @@
+import pytest
+
+comment_scraper = pytest.importorskip("comment_scraper")
+NewReviewFilter = comment_scraper.NewReviewFilter
+
+def review(text, date="1 週前"):
+    return {"內容": text, "日期": date}
+
+def run(existing, scraped, known_streak=3):
+    new_filter = NewReviewFilter(existing, known_streak)
+    reached = False
+    for item in scraped:
+        if new_filter.add(item):
+            reached = True
+            break
+    return new_filter.new_reviews, reached
+
+def test_known_reviews_between_new_ones_are_not_written_again():
+    existing = [review("A"), review("B"), review("C"), review("D")]
+    scraped = [review("new 1"), review("A"), review("new 2"), review("B"), review("C"), review("D")]
+    new_reviews, reached = run(existing, scraped)
+    assert [item["內容"] for item in new_reviews] == ["new 1", "new 2"]
+    assert reached
+    merged = [item["內容"] for item in new_reviews + existing]
+    assert len(merged) == len(set(merged))
+
+def test_repeated_short_texts_are_matched_one_by_one():
+    existing = [review("好吃", "1 年前"), review("B"), review("C")]
+    scraped = [review("好吃", "2 天前"), review("好吃", "1 年前"), review("B"), review("C")]
+    new_reviews, reached = run(existing, scraped)
+    assert new_reviews == [review("好吃", "2 天前")]
+    assert reached
+
+def test_drifted_relative_dates_still_count_as_stored():
+    existing = [review("A", "3 天前"), review("B", "5 天前"), review("C", "1 週前")]
+    scraped = [review("A", "1 週前"), review("B", "2 週前"), review("C", "2 週前")]
+    new_reviews, reached = run(existing, scraped)
+    assert new_reviews == []
+    assert reached
+
+def test_review_age_days_reads_relative_dates():
+    assert comment_scraper.review_age_days("3 天前") == 3
+    assert comment_scraper.review_age_days("一個月前") == 30
+    assert comment_scraper.review_age_days("2 週前") == 14
+    assert comment_scraper.review_age_days("") is None
+
+class UntouchableDriver:
+    def __getattr__(self, name):
+        raise AssertionError(f"driver.{name} used after the page failed")
+
+def test_open_reviews_fails_fast_on_a_page_that_did_not_load(monkeypatch, tmp_path):
+    monkeypatch.setattr(comment_scraper, "open_page", lambda *args, **kwargs: False)
+    monkeypatch.setattr(comment_scraper, "page_failure", lambda default="PageNotReady": "Blocked")
+    with pytest.raises(RuntimeError, match="Blocked"):
+        comment_scraper.open_reviews(UntouchableDriver(), "P1", str(tmp_path))
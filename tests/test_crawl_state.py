@@ -0,0 +1,79 @@
+import time
+import pytest
+from crawl_state import CrawlState, RetrySource
+from failures import CircuitBreaker
+
+KIND = "餐廳詳細資訊"
+
+@pytest.fixture
+def state(tmp_path):
+    state = CrawlState(str(tmp_path / "state.sqlite"))
+    yield state
+    state.close()
+
+def test_failure_schedules_a_retry_with_backoff(state):
+    assert state.mark_failure(KIND, "A", "TimeoutException") == "timeout"
+    row = state.get(KIND, "A")
+    assert row["status"] == "retry"
+    assert row["failures"] == 1
+    assert row["next_attempt"] > time.time() + 30
+
+def test_retries_run_out_into_the_dead_letter_list(state):
+    for _ in range(3):
+        state.mark_failure(KIND, "A", "TimeoutException")
+    assert state.get(KIND, "A")["status"] == "retry"
+    state.mark_failure(KIND, "A", "TimeoutException")
+    assert state.get(KIND, "A")["status"] == "dead"
+    assert [row["place_id"] for row in state.dead_letters(KIND)] == ["A"]
+
+def test_place_gone_is_dead_lettered_at_once(state):
+    state.mark_failure(KIND, "A", "PlaceGone")
+    assert state.get(KIND, "A")["status"] == "dead"
+
+def test_success_resets_the_failure_count(state):
+    for _ in range(3):
+        state.mark_failure(KIND, "A", "TimeoutException")
+    state.mark_success(KIND, "A")
+    state.flush()
+    assert state.get(KIND, "A")["failures"] == 0
+    state.mark_failure(KIND, "A", "TimeoutException")
+    assert state.get(KIND, "A")["status"] == "retry"
+
+def test_requeued_places_get_a_fresh_set_of_retries(state):
+    for _ in range(4):
+        state.mark_failure(KIND, "A", "TimeoutException")
+    assert state.requeue_dead(KIND) == 1
+    row = state.get(KIND, "A")
+    assert (row["status"], row["attempts"], row["failures"]) == ("retry", 0, 0)
+    state.mark_failure(KIND, "A", "TimeoutException")
+    assert state.get(KIND, "A")["status"] == "retry"
+
+def test_requeue_filters_by_failure_class(state):
+    state.mark_failure(KIND, "A", "PlaceGone")
+    for _ in range(2):
+        state.mark_failure(KIND, "B", "NameNotFound")
+    assert state.requeue_dead(failure_class="selector_miss") == 1
+    assert state.get(KIND, "A")["status"] == "dead"
+    assert state.get(KIND, "B")["status"] == "retry"
+
+def test_retry_source_hands_out_due_retries_once(tmp_path):
+    path = str(tmp_path / "state.sqlite")
+    source = RetrySource(path, [KIND])
+    state = CrawlState(path)
+    state.mark_failure(KIND, "A", "TimeoutException")
+    state.conn.execute("UPDATE places SET next_attempt = ? WHERE place_id = 'A'", (time.time() - 1,))
+    state.conn.commit()
+    state.close()
+    due, _ = source()
+    assert [job["place_id"] for job in due] == ["A"]
+    assert source()[0] == []
+
+def test_circuit_breaker_opens_after_a_spike_of_blocks(state):
+    breaker = CircuitBreaker(state, threshold=3, window=300, cooldown=900)
+    for place_id in "AB":
+        state.mark_failure(KIND, place_id, "Blocked")
+    assert breaker.pause_remaining() == 0
+    state.mark_failure(KIND, "C", "Blocked")
+    assert breaker.pause_remaining() > 890
+    # Opening the breaker starts the block count over
+    assert state.count_blocks(0) == 0
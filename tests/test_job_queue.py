@@ -0,0 +1,62 @@
+import os
+import time
+import threading
+import pytest
+from job_queue import iter_jobs, run_job_queue
+
+@pytest.fixture(autouse=True)
+def metrics_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv("SCRAPER_METRICS_DIR", str(tmp_path / "metrics"))
+
+# Worker that dies on the first attempt of place "crash" and, once idle, after place "last"
+def crashing_worker(job_queue, result_queue, marker):
+    for job in iter_jobs(job_queue, result_queue):
+        if job["place_id"] == "crash" and not os.path.exists(marker):
+            open(marker, "w").close()
+            os._exit(1)
+        with open(marker + ".done", "a") as f:
+            f.write(job["place_id"] + "\n")
+        if job["place_id"] == "last":
+            threading.Timer(0.5, os._exit, (1,)).start()
+
+# Worker that hangs without heartbeats on place "hang"
+def hanging_worker(job_queue, result_queue, done_file):
+    for job in iter_jobs(job_queue, result_queue):
+        if job["place_id"] == "hang":
+            while True:
+                pass
+        with open(done_file, "a") as f:
+            f.write(job["place_id"] + "\n")
+
+def done_places(path):
+    with open(path) as f:
+        return sorted(f.read().split())
+
+def test_worker_that_dies_mid_job_is_replaced_and_the_job_requeued(tmp_path):
+    marker = str(tmp_path / "crashed")
+    jobs = [{"place_id": place_id, "cost": 0} for place_id in ["a", "crash", "b"]]
+    stats = run_job_queue(jobs, crashing_worker, (marker,), 1)
+    assert done_places(marker + ".done") == ["a", "b", "crash"]
+    assert sum(s["jobs"] for s in stats.values()) == 3
+
+def test_worker_that_dies_idle_is_replaced(tmp_path):
+    marker = str(tmp_path / "crashed")
+    open(marker, "w").close()
+    release = time.time() + 3
+    retries = [{"place_id": "late", "cost": 0}]
+
+    # The retry comes due after the only worker has died waiting for a job
+    def retry_source():
+        if time.time() < release:
+            return [], release
+        due, retries[:] = retries[:], []
+        return due, None
+
+    run_job_queue([{"place_id": "last", "cost": 0}], crashing_worker, (marker,), 1, retry_source=retry_source)
+    assert done_places(marker + ".done") == ["last", "late"]
+
+def test_silent_worker_is_killed_and_its_job_dropped_after_two_stalls(tmp_path):
+    done_file = str(tmp_path / "done")
+    jobs = [{"place_id": place_id, "cost": 0} for place_id in ["a", "hang", "b"]]
+    run_job_queue(jobs, hanging_worker, (done_file,), 1, heartbeat_timeout=1)
+    assert done_places(done_file) == ["a", "b"]
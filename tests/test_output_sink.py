@@ -0,0 +1,39 @@
+import os
+import time
+from output_sink import iter_records, latest_records, open_sink
+
+def touch_new_files(folder, before, timestamp):
+    for name in set(os.listdir(folder)) - before:
+        os.utime(os.path.join(folder, name), (timestamp, timestamp))
+
+def test_latest_records_keeps_the_newest_write_across_sinks(tmp_path):
+    folder = str(tmp_path)
+    now = time.time()
+    with open_sink("jsonl", folder) as sink:
+        sink.write("a", {"店名": "old jsonl"})
+        sink.write("b", {"店名": "only jsonl"})
+    touch_new_files(folder, set(), now - 30)
+    with open_sink("sqlite", folder) as sink:
+        sink.write("a", {"店名": "sqlite"})
+    before = set(os.listdir(folder))
+    with open_sink("json", folder) as sink:
+        sink.write("a", {"店名": "json"})
+        sink.write("c", {"店名": "old json"})
+    touch_new_files(folder, before, now + 10)
+    before = set(os.listdir(folder))
+    with open_sink("jsonl", folder) as sink:
+        sink.write("c", {"店名": "new jsonl"})
+    touch_new_files(folder, before, now + 20)
+
+    latest = latest_records(folder)
+    assert {place_id: record["店名"] for place_id, record in latest.items()} == {
+        "a": "json", "b": "only jsonl", "c": "new jsonl"}
+
+def test_iter_records_since_skips_older_outputs(tmp_path):
+    folder = str(tmp_path)
+    with open_sink("json", folder) as sink:
+        sink.write("a", {"店名": "a"})
+    with open_sink("sqlite", folder) as sink:
+        sink.write("b", {"店名": "b"})
+    assert list(iter_records(folder, since=time.time() + 5)) == []
+    assert sorted(place_id for place_id, _ in iter_records(folder)) == ["a", "b"]
@@ -0,0 +1,42 @@
+import threading
+import time
+from pacing import RateLimiter
+
+def test_acquire_spaces_calls_at_the_rate():
+    limiter = RateLimiter(per_minute=600, jitter=0)  # One token every 0.1 s
+    start = time.monotonic()
+    for _ in range(4):
+        limiter.acquire()
+    assert 0.25 <= time.monotonic() - start < 0.6
+
+def test_concurrent_callers_reserve_distinct_slots():
+    limiter = RateLimiter(per_minute=600, jitter=0)
+    done = []
+    threads = [threading.Thread(target=lambda: (limiter.acquire(), done.append(time.monotonic())))
+               for _ in range(4)]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    gaps = sorted(t - start for t in done)
+    assert gaps[-1] >= 0.25
+
+def test_reports_do_not_wait_for_a_sleeping_caller():
+    limiter = RateLimiter(per_minute=6, jitter=0, cooldown=5)  # One token every 10 s
+    limiter.acquire()
+    sleeper = threading.Thread(target=limiter.acquire, daemon=True)
+    sleeper.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    limiter.report_block()
+    limiter.report_success()
+    assert time.monotonic() - start < 0.1
+    assert sleeper.is_alive()
+
+def test_block_pauses_later_acquires_for_the_cooldown():
+    limiter = RateLimiter(per_minute=600, jitter=0, cooldown=0.3)
+    limiter.report_block()
+    start = time.monotonic()
+    limiter.acquire()
+    assert time.monotonic() - start >= 0.3
@@ -0,0 +1,38 @@
+import json
+from crawl_state import CrawlState
+from recrawl import plan_recrawls, select
+
+KINDS = {"details": "餐廳詳細資訊"}
+
+def write_snapshot(path, rows):
+    with open(path, "w", encoding="utf-8") as f:
+        for place_id, rating, review_count in rows:
+            f.write(json.dumps({"Place ID": place_id, "評分": rating, "評論數": review_count}) + "\n")
+
+def test_changed_places_are_planned_best_first(tmp_path):
+    state_file = str(tmp_path / "state.sqlite")
+    snapshot = str(tmp_path / "snapshot.jsonl")
+    state = CrawlState(state_file)
+    for place_id in "ABC":
+        state.mark_success(KINDS["details"], place_id)
+    state.close()
+
+    write_snapshot(snapshot, [("A", 4.0, 100), ("B", 4.0, 0), ("C", 4.0, 10)])
+    assert plan_recrawls(snapshot, KINDS, state_file) == []
+
+    write_snapshot(snapshot, [("A", 4.0, 160), ("B", 4.0, 12), ("C", 4.0, 10)])
+    candidates = plan_recrawls(snapshot, KINDS, state_file)
+    assert [candidate["place_id"] for candidate in candidates] == ["A", "B"]
+    assert select(candidates, top_k=1) == candidates[:1]
+
+def test_zero_review_count_is_kept(tmp_path):
+    state_file = str(tmp_path / "state.sqlite")
+    snapshot = str(tmp_path / "snapshot.jsonl")
+    state = CrawlState(state_file)
+    state.mark_success(KINDS["details"], "A")
+    state.close()
+    write_snapshot(snapshot, [("A", 4.0, 0)])
+    plan_recrawls(snapshot, KINDS, state_file)
+    state = CrawlState(state_file)
+    assert state.signal_rows(KINDS["details"])[0]["review_count"] == 0
+    state.close()
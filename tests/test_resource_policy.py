@@ -0,0 +1,11 @@
+from selenium import webdriver
+from resource_policy import apply_to_options
+
+def test_performance_log_is_opt_in():
+    options = webdriver.ChromeOptions()
+    apply_to_options(options, "lean")
+    assert "goog:loggingPrefs" not in options.to_capabilities()
+
+    options = webdriver.ChromeOptions()
+    apply_to_options(options, "lean", performance_log=True)
+    assert options.to_capabilities()["goog:loggingPrefs"] == {"performance": "ALL"}
@@ -0,0 +1,50 @@
+import json
+import os
+import time
+from review_store import ReviewStore, read_review_file
+
+def plain(reviews):
+    return [{key: review[key] for key in ("內容", "日期", "作者") if key in review} for review in reviews]
+
+def test_round_trip_keeps_duplicate_texts_within_a_place(tmp_path):
+    reviews = [{"內容": "好吃", "日期": "1 週前"}, {"內容": "服務很好", "日期": "2 週前"},
+               {"內容": "好吃", "日期": "1 年前"}, {"內容": "好吃", "日期": "1 年前", "作者": "小明"}]
+    with ReviewStore(str(tmp_path)) as store:
+        store.add("A", reviews)
+    with ReviewStore(str(tmp_path)) as store:
+        assert plain(store.reviews("A")) == reviews
+        assert store.stats()["texts"] == 2
+
+def test_round_trip_keeps_each_places_own_date_and_author(tmp_path):
+    a = [{"內容": "好吃", "日期": "1 年前", "作者": "甲"}]
+    b = [{"內容": "好吃", "日期": "1 週前"}, {"內容": "好吃", "日期": "3 天前"}]
+    with ReviewStore(str(tmp_path)) as store:
+        store.add("A", a)
+        store.flush()
+        store.add("B", b)
+        store.flush()
+        assert plain(store.reviews("A")) == a
+        assert plain(store.reviews("B")) == b
+        assert [review["內容"] for review in store.iter_reviews()] == ["好吃"]
+
+def test_recrawl_adds_only_new_occurrences_newest_first(tmp_path):
+    first = [{"內容": "不錯", "日期": "1 天前"}, {"內容": "普通", "日期": "2 天前"}]
+    with ReviewStore(str(tmp_path)) as store:
+        assert store.add("A", first, crawled_at=time.time() - 86400) == 2
+        store.flush()
+        second = [{"內容": "新的", "日期": "1 天前"}, {"內容": "不錯", "日期": "2 天前"}, {"內容": "普通", "日期": "3 天前"}]
+        assert store.add("A", second) == 1
+        store.flush()
+        stored = plain(store.reviews("A"))
+    # Earlier occurrences keep the date they were first seen with
+    assert stored == [{"內容": "新的", "日期": "1 天前"}] + first
+
+def test_update_folder_is_incremental(tmp_path):
+    folder = tmp_path / "reviews"
+    folder.mkdir()
+    reviews = {"評論 1": {"內容": "好吃", "日期": "1 週前"}, "評論 2": {"內容": "好吃", "日期": "2 週前"}}
+    (folder / "P1.json").write_text(json.dumps(reviews, ensure_ascii=False), encoding="utf-8")
+    with ReviewStore(str(tmp_path / "store")) as store:
+        assert store.update_folder(str(folder)) == 1
+        assert store.update_folder(str(folder)) == 0
+        assert plain(store.reviews("P1")) == read_review_file(os.path.join(folder, "P1.json"))